@@ -9,6 +9,7 @@ from .utils import get_dr
 
 from .dsr_state import init_dsr_status_hook
 from .sync_hook import init_sync_hook
+from .jobs import init_jobs
 from .schedule.reschedule import reschedule
 from .schedule.postpone import postpone
 from .schedule.advance import advance
@@ -342,6 +343,7 @@ def configuration_changed():
 
 
 init_sync_hook()
+init_jobs()
 init_stats()
 init_browser()
 init_review_hook()
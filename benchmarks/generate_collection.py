@@ -0,0 +1,258 @@
+"""Write a synthetic collection to benchmark the scheduling operations on.
+
+Usage: python benchmarks/generate_collection.py PATH [--cards N] [--cards-per-note N]
+    [--presets N] [--reviews-per-card X] [--seed N]
+
+Notes get `--cards-per-note` sibling cards and are spread over one deck per
+preset. The review history of every card is simulated with the FSRS
+formulas of the add-on: each review happens at the interval for the
+preset's desired retention, sometimes late, and is forgotten with the
+probability the model predicts. The stored memory state is the result of
+replaying that history, as Anki would compute it. Some cards are new,
+suspended or overdue.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+from anki.collection import Collection
+from anki.consts import (
+    CARD_TYPE_NEW,
+    CARD_TYPE_REV,
+    QUEUE_TYPE_NEW,
+    QUEUE_TYPE_REV,
+    QUEUE_TYPE_SUSPENDED,
+)
+from anki.stats import REVLOG_LRN, REVLOG_REV
+from anki.utils import field_checksum, guid64
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import headless
+
+DESIRED_RETENTIONS = [0.9, 0.85, 0.95, 0.8, 0.88]
+MAXIMUM_INTERVALS = [36500, 3650, 36500, 1825, 365]
+HISTORY_DAYS = 3650
+# days from the first to the last review, plus the last interval
+MAX_SPAN = HISTORY_DAYS - 60
+BATCH_SIZE = 10000
+
+
+def simulate_reviews(
+    model, desired_retention: float, maximum_interval: int, count: int, rng
+) -> Tuple[List[Tuple[int, int, int, int]], Tuple[float, float], int]:
+    """Simulate `count` reviews, starting on day 0.
+
+    Returns the (day, rating, interval, last interval) of each review, the
+    memory state after them and the number of lapses.
+    """
+    decay = model.decay
+    reviews = []
+    rating = rng.choices((1, 2, 3, 4), (0.15, 0.05, 0.7, 0.1))[0]
+    state = model.next_state(0, rating, None)
+    day = 0
+    last_interval = 0
+    lapses = 0
+    while True:
+        stability = state[0]
+        interval = (stability / model.factor) * (desired_retention ** (1 / decay) - 1)
+        interval = min(max(1, round(interval)), maximum_interval)
+        interval = max(1, min(interval, MAX_SPAN - day))
+        reviews.append((day, rating, interval, last_interval))
+        if len(reviews) >= count or day + interval * 1.25 + 1 >= MAX_SPAN:
+            return reviews, state, lapses
+        delay = 0 if rng.random() < 0.7 else rng.randint(1, interval // 4 + 1)
+        elapsed = interval + delay
+        retrievability = (1 + model.factor * elapsed / stability) ** decay
+        if rng.random() < retrievability:
+            rating = rng.choices((2, 3, 4), (0.1, 0.8, 0.1))[0]
+        else:
+            rating = 1
+            lapses += 1
+        state = model.next_state(elapsed, rating, state)
+        day += elapsed
+        last_interval = interval
+
+
+def generate(
+    path: Path,
+    cards: int = 10000,
+    cards_per_note: int = 2,
+    presets: int = 3,
+    reviews_per_card: float = 6.0,
+    seed: int = 0,
+) -> Path:
+    headless.install()
+    headless.load_addon()
+    from fsrs4anki_helper.core.memory_state import FSRSModel, fill_parameters
+
+    rng = random.Random(seed)
+    path = Path(path)
+    path.unlink(missing_ok=True)
+    col = Collection(str(path))
+    col.set_config("fsrs", True)
+    col.db.execute("UPDATE col SET crt = crt - ?", HISTORY_DAYS * 86400)
+    col.close()
+    col = Collection(str(path))
+    today = col.sched.today
+    day_cutoff = col.sched.day_cutoff
+
+    model = FSRSModel(fill_parameters([]))
+    decks = []
+    for index in range(presets):
+        preset = col.decks.get_config(1) if index == 0 else None
+        if preset is None:
+            preset = col.decks.get_config(
+                col.decks.add_config_returning_id(f"Benchmark {index}")
+            )
+        preset["desiredRetention"] = DESIRED_RETENTIONS[index % len(DESIRED_RETENTIONS)]
+        preset["rev"]["maxIvl"] = MAXIMUM_INTERVALS[index % len(MAXIMUM_INTERVALS)]
+        col.decks.save(preset)
+        deck = col.decks.get(col.decks.id(f"Benchmark::Preset {index}"))
+        deck["conf"] = preset["id"]
+        col.decks.save(deck)
+        decks.append((deck["id"], preset["desiredRetention"], preset["rev"]["maxIvl"]))
+
+    models_manager = col.models
+    notetype = models_manager.new("Benchmark")
+    for name in ("Front", "Back"):
+        models_manager.add_field(notetype, models_manager.new_field(name))
+    for ord in range(cards_per_note):
+        template = models_manager.new_template(f"Card {ord + 1}")
+        template["qfmt"] = f"{{{{Front}}}} {ord + 1}"
+        template["afmt"] = "{{FrontSide}}<hr id=answer>{{Back}}"
+        models_manager.add_template(notetype, template)
+    mid = models_manager.add_dict(notetype).id
+
+    now = int(time.time())
+    first_id = (now - HISTORY_DAYS * 86400) * 1000
+    note_rows = []
+    card_rows = []
+    revlog_rows = []
+
+    def flush():
+        col.db.executemany(
+            "INSERT INTO notes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", note_rows
+        )
+        col.db.executemany(
+            "INSERT INTO cards VALUES "
+            "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            card_rows,
+        )
+        col.db.executemany(
+            "INSERT INTO revlog VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", revlog_rows
+        )
+        note_rows.clear()
+        card_rows.clear()
+        revlog_rows.clear()
+
+    note_count = math.ceil(cards / cards_per_note)
+    for note_index in range(note_count):
+        nid = first_id + note_index
+        front = f"Question {note_index}"
+        note_rows.append(
+            (
+                nid,
+                guid64(),
+                mid,
+                now,
+                -1,
+                "",
+                f"{front}\x1fAnswer {note_index}",
+                front,
+                field_checksum(front),
+                0,
+                "",
+            )
+        )
+        did, desired_retention, maximum_interval = rng.choice(decks)
+        for ord in range(min(cards_per_note, cards - note_index * cards_per_note)):
+            card_index = note_index * cards_per_note + ord
+            cid = first_id + card_index
+            if rng.random() < 0.1:
+                card_rows.append(
+                    (cid, nid, did, ord, now, -1, CARD_TYPE_NEW, QUEUE_TYPE_NEW)
+                    + (note_index, 0, 0, 0, 0, 0, 0, 0, 0, "")
+                )
+                continue
+
+            count = 1 + round(rng.expovariate(1 / max(reviews_per_card - 1, 0.1)))
+            reviews, (stability, difficulty), lapses = simulate_reviews(
+                model, desired_retention, maximum_interval, count, rng
+            )
+            last_day, _, interval, _ = reviews[-1]
+            if rng.random() < 0.05:
+                # overdue by up to a month
+                due = today - rng.randint(1, 30)
+            else:
+                due = today + rng.randint(0, interval - 1)
+            offset = due - interval - last_day
+            for day, rating, review_interval, last_interval in reviews:
+                # unique per card and day, within the day of the review
+                second = 1 + (card_index // 1000) % 86000
+                revlog_id = (
+                    day_cutoff + (offset + day - today - 1) * 86400 + second
+                ) * 1000 + card_index % 1000
+                revlog_rows.append(
+                    (
+                        revlog_id,
+                        cid,
+                        -1,
+                        rating,
+                        review_interval,
+                        last_interval if last_interval else -600,
+                        2500,
+                        rng.randint(2000, 20000),
+                        REVLOG_LRN if day == 0 else REVLOG_REV,
+                    )
+                )
+            data = json.dumps(
+                {
+                    "s": round(stability, 4),
+                    "d": round(difficulty, 3),
+                    "dr": desired_retention,
+                    "decay": round(-model.decay, 4),
+                }
+            )
+            queue = QUEUE_TYPE_SUSPENDED if rng.random() < 0.02 else QUEUE_TYPE_REV
+            card_rows.append(
+                (cid, nid, did, ord, now, -1, CARD_TYPE_REV, queue, due, interval)
+                + (2500, len(reviews), lapses, 0, 0, 0, 0, data)
+            )
+        if len(card_rows) >= BATCH_SIZE:
+            flush()
+    flush()
+    col.close()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--cards", type=int, default=10000)
+    parser.add_argument("--cards-per-note", type=int, default=2)
+    parser.add_argument("--presets", type=int, default=3)
+    parser.add_argument("--reviews-per-card", type=float, default=6.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    generate(
+        args.path,
+        args.cards,
+        args.cards_per_note,
+        args.presets,
+        args.reviews_per_card,
+        args.seed,
+    )
+    print(f"{args.path}: {args.cards} cards in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
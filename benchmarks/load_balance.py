@@ -0,0 +1,102 @@
+"""Compare the greedy and the global load balancer on synthetic cards.
+
+Usage: python benchmarks/load_balance.py [cards] [seed]
+
+For each mode, prints the runtime, how flat the daily review load is over
+the next 100 days (standard deviation and maximum divided by the mean), and
+the mean distance of the new intervals from the target intervals.
+"""
+
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.load_balance import BalanceCard, LoadBalancer
+
+TODAY = 1000
+HORIZON = 100
+EASY_DAYS_PERCENTAGES = [1.0, 1.0, 1.0, 1.0, 1.0, 0.5, 0.0]
+
+
+def synthetic_cards(count: int, seed: int):
+    rng = random.Random(seed)
+    cards = []
+    for cid in range(count):
+        last_interval = int(rng.lognormvariate(3, 1)) + 1
+        last_review = TODAY - rng.randint(0, last_interval)
+        target_ivl = max(1, int(last_interval * rng.uniform(0.5, 3)))
+        cards.append(
+            BalanceCard(
+                cid=cid,
+                reps=rng.randint(1, 20),
+                target_ivl=target_ivl,
+                maximum_interval=36500,
+                due=last_review + last_interval,
+                last_review=last_review,
+                last_interval=last_interval,
+                reviewed=True,
+            )
+        )
+    return cards
+
+
+def new_balancer(cards) -> LoadBalancer:
+    balancer = LoadBalancer(TODAY, date(2025, 1, 6))
+    balancer.preset_id = 0
+    balancer.apply_easy_days = True
+    balancer.easy_days_percentages_per_preset[0] = EASY_DAYS_PERCENTAGES
+    for card in cards:
+        if card.due <= TODAY:
+            balancer.due_today += 1
+        else:
+            balancer.due_cnt_per_day.add(card.due)
+    return balancer
+
+
+def run(mode: str, cards):
+    balancer = new_balancer(cards)
+    start = time.perf_counter()
+    if mode == "global":
+        new_ivls = balancer.balance_globally(cards)
+    else:
+        new_ivls = balancer.balance_in_order(cards)
+    seconds = time.perf_counter() - start
+
+    loads = [balancer.due_today] + balancer.due_cnt_per_day.window(
+        TODAY + 1, TODAY + HORIZON
+    )
+    # only compare the days that easy days leave open at full capacity
+    full_days = [
+        load
+        for offset, load in enumerate(loads)
+        if EASY_DAYS_PERCENTAGES[(balancer.current_date.weekday() + offset) % 7] == 1
+    ]
+    mean = statistics.mean(full_days)
+    deviation = statistics.mean(
+        abs(new_ivl - card.target_ivl) / card.target_ivl
+        for card, new_ivl in zip(cards, new_ivls)
+    )
+    print(
+        f"{mode:8} {seconds:8.3f}s"
+        f"  load std/mean {statistics.pstdev(full_days) / mean:.3f}"
+        f"  max/mean {max(full_days) / mean:.3f}"
+        f"  deviation from target {deviation:.2%}"
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    cards = synthetic_cards(count, seed)
+    print(f"{count} cards")
+    for mode in ("greedy", "global"):
+        run(mode, cards)
+
+
+if __name__ == "__main__":
+    main()
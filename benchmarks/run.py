@@ -0,0 +1,164 @@
+"""Benchmark the scheduling operations on synthetic collections.
+
+Usage: python benchmarks/run.py [--sizes N ...] [--operations NAME ...]
+    [--dir DIR] [--seed N]
+
+Collections are written by `generate_collection.py` into `--dir` the
+first time a size is used, and reused afterwards. Each operation runs its
+background function on a fresh copy of the collection in its own process,
+so the peak memory reported is that of the operation. Throughput is the
+number of review cards in the collection divided by the run time.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate_collection import generate
+
+import headless
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+
+
+def reschedule(col):
+    from fsrs4anki_helper.schedule.reschedule import reschedule_background
+
+    reschedule_background(None)
+
+
+def disperse_siblings(col):
+    from fsrs4anki_helper.schedule.disperse_siblings import (
+        disperse_siblings_background,
+    )
+
+    disperse_siblings_background(None)
+
+
+def flatten(col):
+    from fsrs4anki_helper.schedule.flatten import flatten_background
+
+    # the average load of the next month, so the busier days get flattened
+    today = col.sched.today
+    due_next_month = col.db.scalar(f"""
+        SELECT count()
+        FROM cards
+        WHERE queue = 2
+        AND due BETWEEN {today} AND {today + 29}
+    """)
+    flatten_background(None, max(1, due_next_month // 30))
+
+
+def _answer_prompt(module, name: str):
+    """Accept the number of cards the dialog of `module` suggests."""
+    setattr(module, name, lambda safe_cnt, did: (max(safe_cnt, 1), True))
+    module.tooltip = lambda *args, **kwargs: None
+    module.showWarning = lambda *args, **kwargs: None
+
+
+def postpone(col):
+    from fsrs4anki_helper.schedule import postpone as module
+
+    _answer_prompt(module, "get_desired_postpone_cnt_with_response")
+    module.postpone(None)
+
+
+def advance(col):
+    from fsrs4anki_helper.schedule import advance as module
+
+    _answer_prompt(module, "get_desired_advance_cnt_with_response")
+    module.advance(None)
+
+
+def schedule_break(col):
+    from fsrs4anki_helper.schedule.schedule_break import _schedule_break_background
+
+    _schedule_break_background(None, 3, 7)
+
+
+OPERATIONS = {
+    "reschedule": reschedule,
+    "disperse_siblings": disperse_siblings,
+    "flatten": flatten,
+    "postpone": postpone,
+    "advance": advance,
+    "schedule_break": schedule_break,
+}
+
+
+def peak_memory_mb() -> float:
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def run_operation(name: str, source: Path) -> dict:
+    """Run operation `name` on a copy of `source`, in this process."""
+    with tempfile.TemporaryDirectory() as folder:
+        folder = Path(folder)
+        headless.install(folder=folder)
+        headless.load_addon()
+        work = folder / "collection.anki2"
+        shutil.copy(source, work)
+        col = headless.open_collection(work)
+        cards = col.db.scalar("SELECT count() FROM cards WHERE type = 2")
+        start = time.perf_counter()
+        OPERATIONS[name](col)
+        seconds = time.perf_counter() - start
+        col.close()
+    return {"cards": cards, "seconds": seconds, "peak_mb": peak_memory_mb()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument(
+        "--operations", nargs="+", choices=list(OPERATIONS), default=list(OPERATIONS)
+    )
+    parser.add_argument("--dir", type=Path, default=Path(tempfile.gettempdir()))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--child", nargs=2, metavar=("OPERATION", "PATH"))
+    args = parser.parse_args()
+
+    if args.child:
+        name, path = args.child
+        print(json.dumps(run_operation(name, Path(path))))
+        return
+
+    args.dir.mkdir(parents=True, exist_ok=True)
+    print(
+        f"{'operation':18} {'cards':>9} {'seconds':>9} {'cards/s':>10} {'peak MB':>9}"
+    )
+    for size in args.sizes:
+        path = args.dir / f"fsrs4anki-helper-benchmark-{size}-{args.seed}.anki2"
+        if not path.exists():
+            partial = path.with_suffix(".partial")
+            generate(partial, cards=size, seed=args.seed)
+            partial.rename(path)
+        for name in args.operations:
+            output = subprocess.run(
+                [sys.executable, __file__, "--child", name, str(path)],
+                check=True,
+                stdout=subprocess.PIPE,
+                text=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"{name:18} {result['cards']:9d} {result['seconds']:9.2f}"
+                f" {result['cards'] / result['seconds']:10.0f}"
+                f" {result['peak_mb']:9.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
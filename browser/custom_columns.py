@@ -6,6 +6,7 @@ from aqt.browser import Browser, CellRow, Column, ItemId
 from aqt.utils import tooltip
 from ..i18n import t
 from ..utils import *
+from ..core.intervals import power_forgetting_curve
 
 
 class CustomColumn:
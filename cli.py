@@ -0,0 +1,155 @@
+"""Reschedule a collection file from the command line, without Anki running.
+
+Usage: python cli.py COLLECTION [--deck NAME] [--recent] [--disperse]
+    [--postpone COUNT] [--flatten LIMIT] [--config FILE]
+
+Reschedules the review cards of COLLECTION, or of the deck NAME and its
+subdecks, with the add-on's reschedule. The other options run after it, in
+this order: disperse siblings, postpone up to COUNT overdue cards, and
+flatten the days over LIMIT reviews. All of the changes are made in one
+transaction, so an error leaves the collection as it was.
+
+The collection must not be open in Anki. The add-on's settings are those of
+`meta.json` next to this file when Anki has saved them, else those of
+`config.json`; `--config` reads overrides from a JSON file.
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from anki.errors import DBError
+from anki.utils import ids2str, strip_html
+
+import headless
+
+
+def load_config(path: Optional[Path]) -> dict:
+    config = {}
+    meta = headless.REPO / "meta.json"
+    if meta.exists():
+        with open(meta, encoding="utf-8") as file:
+            config.update(json.load(file).get("config", {}))
+    if path is not None:
+        with open(path, encoding="utf-8") as file:
+            config.update(json.load(file))
+    return config
+
+
+def review_card_states(col, did: Optional[int]) -> Dict[int, tuple]:
+    """The scheduling fields of the review cards, to tell which a step changed."""
+    did_query = ""
+    if did is not None:
+        did_list = ids2str(col.decks.deck_and_child_ids(did))
+        did_query = f"AND CASE WHEN odid==0 THEN did ELSE odid END IN {did_list}"
+    return {
+        row[0]: tuple(row[1:])
+        for row in col.db.all(f"""
+            SELECT id, due, odue, ivl, data
+            FROM cards
+            WHERE type = 2 {did_query}
+        """)
+    }
+
+
+def operations(args, did: Optional[int]) -> List[Tuple[str, Callable[[], str]]]:
+    from fsrs4anki_helper.schedule.disperse_siblings import (
+        disperse_siblings_background,
+    )
+    from fsrs4anki_helper.schedule.flatten import flatten_background
+    from fsrs4anki_helper.schedule.postpone import postpone_background
+    from fsrs4anki_helper.schedule.reschedule import reschedule_background
+
+    def reschedule():
+        result = reschedule_background(did, recent=args.recent)
+        # the rescheduled notes, when auto disperse after reschedule is on
+        return result[0] if isinstance(result, tuple) else result
+
+    steps = [("reschedule", reschedule)]
+    if args.disperse:
+        steps.append(("disperse", lambda: disperse_siblings_background(did)))
+    if args.postpone:
+        steps.append(("postpone", lambda: postpone_background(did, args.postpone)))
+    if args.flatten:
+        steps.append(("flatten", lambda: flatten_background(did, args.flatten)))
+    return steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("collection", type=Path)
+    parser.add_argument("--deck", help="only the cards of this deck and subdecks")
+    parser.add_argument(
+        "--recent",
+        action="store_true",
+        help="only the cards reviewed in the last `days_to_reschedule` days",
+    )
+    parser.add_argument("--disperse", action="store_true")
+    parser.add_argument("--postpone", type=int, metavar="COUNT")
+    parser.add_argument("--flatten", type=int, metavar="LIMIT")
+    parser.add_argument("--config", type=Path, metavar="FILE")
+    args = parser.parse_args()
+    for name in ("postpone", "flatten"):
+        value = getattr(args, name)
+        if value is not None and value <= 0:
+            parser.error(f"--{name} must be a positive integer")
+    if not args.collection.exists():
+        parser.error(f"{args.collection} does not exist")
+
+    with tempfile.TemporaryDirectory(prefix="fsrs4anki-helper-") as folder:
+        headless.install(load_config(args.config), Path(folder))
+        headless.load_addon()
+        try:
+            col = headless.open_collection(args.collection)
+        except DBError as error:
+            sys.exit(f"cannot open {args.collection}: {error}")
+
+        try:
+            if not col.get_config("fsrs"):
+                sys.exit("FSRS is not enabled in this collection")
+            did = None
+            if args.deck is not None:
+                did = col.decks.id_for_name(args.deck)
+                if did is None:
+                    sys.exit(f"no deck named {args.deck}")
+            col.db.execute("PRAGMA journal_mode = WAL")
+            states = review_card_states(col, did)
+            cards = len(states)
+            results = []
+            total = 0.0
+
+            def run():
+                nonlocal states, total
+                for name, operation in operations(args, did):
+                    start = time.perf_counter()
+                    text = operation()
+                    seconds = time.perf_counter() - start
+                    total += seconds
+                    # compared outside of the timing, so it doesn't skew cards/s
+                    before, states = states, review_card_states(col, did)
+                    changed = sum(
+                        before.get(cid) != state for cid, state in states.items()
+                    )
+                    results.append((name, text, seconds, changed))
+
+            col.db.transact(run)
+        finally:
+            col.close()
+
+    for name, text, seconds, changed in results:
+        print(f"{name}: {strip_html(text)}")
+        print(
+            f"  {seconds:.2f}s, {changed} cards changed, "
+            f"{changed / max(seconds, 1e-9):.0f} cards/s"
+        )
+    print(
+        f"{cards} review cards in {total:.2f}s, {cards / max(total, 1e-9):.0f} cards/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
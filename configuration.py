@@ -17,6 +17,11 @@ HAS_RATED = "has_rated"
 RESCHEDULE_SET_DUE_DATE = "reschedule-set-due-date"
 SHOW_STEPS_STATS = "show_steps_stats"
 SHOW_TRUE_RETENTION = "show_true_retention"
+RESCHEDULE_WORKERS = "reschedule_workers"
+GLOBAL_LOAD_BALANCE = "global_load_balance"
+PROFILE_OPERATIONS = "profile_operations"
+AUTO_RESCHEDULE_TIME_BUDGET = "auto_reschedule_time_budget"
+DISPERSE_WORKERS = "disperse_workers"
 
 
 def load_config():
@@ -172,3 +177,48 @@ class Config:
     def show_true_retention(self, value):
         self.data[SHOW_TRUE_RETENTION] = value
         self.save()
+
+    @property
+    def reschedule_workers(self):
+        return self.data[RESCHEDULE_WORKERS]
+
+    @reschedule_workers.setter
+    def reschedule_workers(self, value):
+        self.data[RESCHEDULE_WORKERS] = value
+        self.save()
+
+    @property
+    def global_load_balance(self):
+        return self.data[GLOBAL_LOAD_BALANCE]
+
+    @global_load_balance.setter
+    def global_load_balance(self, value):
+        self.data[GLOBAL_LOAD_BALANCE] = value
+        self.save()
+
+    @property
+    def profile_operations(self):
+        return self.data[PROFILE_OPERATIONS]
+
+    @profile_operations.setter
+    def profile_operations(self, value):
+        self.data[PROFILE_OPERATIONS] = value
+        self.save()
+
+    @property
+    def auto_reschedule_time_budget(self):
+        return self.data[AUTO_RESCHEDULE_TIME_BUDGET]
+
+    @auto_reschedule_time_budget.setter
+    def auto_reschedule_time_budget(self, value):
+        self.data[AUTO_RESCHEDULE_TIME_BUDGET] = value
+        self.save()
+
+    @property
+    def disperse_workers(self):
+        return self.data[DISPERSE_WORKERS]
+
+    @disperse_workers.setter
+    def disperse_workers(self, value):
+        self.data[DISPERSE_WORKERS] = value
+        self.save()
@@ -0,0 +1,8 @@
+"""Scheduling math of the add-on, independent of Anki.
+
+Nothing in this package imports `anki` or `aqt` or reads from the
+collection: the functions take plain numbers, lists and records and return
+intervals and due dates. The modules in `schedule/` read the cards from
+`mw.col`, call into this package and write the results back, so worker
+processes and `benchmarks/` can use it on its own.
+"""
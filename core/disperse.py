@@ -0,0 +1,175 @@
+"""The due dates of siblings, spread as far apart as their fuzz ranges allow."""
+
+from typing import Dict, List, Tuple
+
+from .intervals import next_interval
+from .load_balance import get_fuzz_range
+
+
+def due_range(
+    stability: float,
+    due: int,
+    desired_retention: float,
+    maximum_interval: int,
+    decay: float,
+    last_review: int,
+    last_interval: int,
+    today: int,
+) -> Tuple[int, int]:
+    """The days a review card due on `due` may be moved to when dispersing."""
+    new_ivl = next_interval(stability, desired_retention, decay)
+
+    if new_ivl <= 2.5:
+        return (due, due)
+
+    min_ivl, max_ivl = get_fuzz_range(new_ivl, last_interval, maximum_interval)
+
+    # If the card is currently scheduled outside the fuzz range, don't reschedule the card to bring it within the fuzz range.
+    # Rather, create a new fuzz range around the original due date. Users can use `reschedule` to bring the card in range.
+    if (
+        due > last_review + max_ivl + 2
+    ):  # +2 is just a safeguard to exclude cards that go beyond the fuzz range due to rounding
+        current_ivl = due - last_review
+        # set maximum_interval = current_ivl to prevent a further increase in ivl
+        min_ivl, max_ivl = get_fuzz_range(current_ivl, last_interval, current_ivl)
+
+    if (
+        due < last_review + min_ivl - 2
+    ):  # +2 is just a safeguard to exclude cards that go beyond the fuzz range due to rounding
+        current_ivl = due - last_review
+        min_ivl, max_ivl = get_fuzz_range(current_ivl, last_interval, maximum_interval)
+        # Prevent a further decrease in ivl because it is already lower than the optimal range
+        min_ivl = max(current_ivl, min_ivl)
+
+    if due >= today:
+        return (
+            max(last_review + min_ivl, today),
+            max(last_review + max_ivl, today),
+        )
+    elif last_review + max_ivl > today:
+        return (today, last_review + max_ivl)
+    else:
+        return (due, due)
+
+
+def disperse_due_dates(
+    due_ranges: Dict[int, Tuple[int, int]], last_reviews: Dict[int, int]
+) -> Tuple[int, Dict[int, int]]:
+    """The minimum gap and the due date of each sibling in `due_ranges`.
+
+    The latest of the `last_reviews` takes part as a fixed point, so no
+    sibling is placed right after it.
+    """
+    latest_review = max(last_reviews.values())
+    due_ranges = {**due_ranges, -1: (latest_review, latest_review)}
+    min_gap, best_due_dates = maximize_siblings_due_gap(due_ranges)
+    best_due_dates.pop(-1)
+    return min_gap, best_due_dates
+
+
+def disperse_notes(notes: List[List[tuple]], today: int) -> Dict[int, int]:
+    """The new due date of every sibling of `notes`.
+
+    Each note is a list of its siblings, and each sibling a tuple of its card
+    id followed by the arguments of `due_range` before `today`. Only plain
+    values go in and out, so a worker process can disperse a share of the
+    notes.
+    """
+    due_dates = {}
+    for siblings in notes:
+        due_ranges = {
+            sibling[0]: due_range(*sibling[1:], today) for sibling in siblings
+        }
+        last_reviews = {sibling[0]: sibling[6] for sibling in siblings}
+        due_dates.update(disperse_due_dates(due_ranges, last_reviews)[1])
+    return due_dates
+
+
+# Modifying the algorithm to accept a dictionary as input and return a dictionary as output
+def maximize_siblings_due_gap(points_dict: Dict[int, Tuple[int, int]]):
+    """
+    Function to find the arrangement that maximizes the gaps between adjacent points
+    while maintaining the maximum minimum gap. Accepts and returns dictionaries.
+    """
+    # Convert the dictionary to a list of tuples and also keep track of the original keys
+    points_list = [(k, v) for k, v in points_dict.items()]
+
+    # Sort the list based on the right endpoints of the intervals
+    points_list.sort(key=lambda x: x[1][1])
+
+    # First, find the maximum minimum gap and the arrangement that achieves it
+    intervals_only = [interval for _, interval in points_list]
+    max_min_gap, initial_arrangement = find_max_min_gap_and_arrangement(intervals_only)
+
+    # Initialize the optimized arrangement with the initial arrangement
+    optimized_arrangement = initial_arrangement.copy()
+
+    # Go through each point to try to maximize the gap with its adjacent points
+    for i in range(len(points_list)):
+        left_limit, right_limit = points_list[i][1]
+
+        # Set initial boundaries based on the previous and next points in the arrangement
+        if i > 0:
+            left_limit = max(left_limit, optimized_arrangement[i - 1] + max_min_gap)
+        if i < len(points_list) - 1:
+            right_limit = min(right_limit, optimized_arrangement[i + 1] - max_min_gap)
+
+        # Move the point as far to the right as possible within the adjusted limits
+        optimized_arrangement[i] = right_limit
+
+    # Convert the list back to a dictionary
+    optimized_arrangement_dict = {
+        points_list[i][0]: optimized_arrangement[i] for i in range(len(points_list))
+    }
+
+    return max_min_gap, optimized_arrangement_dict
+
+
+def find_max_min_gap_and_arrangement(points):
+    """
+    Find the maximum minimum gap between adjacent points and also return the arrangement that achieves it.
+    """
+    # Sort the points based on their right endpoints
+    points.sort(key=lambda x: x[1])
+
+    # Initialize binary search parameters
+    min_gap = 0  # Minimum possible gap
+    max_gap = points[-1][1] - points[0][0]  # Maximum possible gap
+    best_gap = 0  # To store the result
+
+    arrangement = []  # To store the best arrangement of points
+
+    def can_place_points_with_arrangement(points, min_gap):
+        """
+        A greedy algorithm to check if we can place all points with a minimum gap of `min_gap`.
+        Also returns the arrangement if possible.
+        """
+        last_point_position = points[0][
+            0
+        ]  # Place the first point at its leftmost position
+        temp_arrangement = [last_point_position]
+        for i in range(1, len(points)):
+            next_possible_point = last_point_position + min_gap
+            # Find the rightmost position in the current point's range where it can be placed
+            if next_possible_point > points[i][1]:
+                return (
+                    False,
+                    [],
+                )  # Can't place the point while maintaining the minimum gap
+            last_point_position = max(next_possible_point, points[i][0])
+            temp_arrangement.append(last_point_position)
+        return True, temp_arrangement
+
+    while min_gap <= max_gap:
+        mid_gap = (min_gap + max_gap) // 2  # Compute the middle gap
+        can_place, temp_arrangement = can_place_points_with_arrangement(points, mid_gap)
+        if can_place:
+            # If we can place all points with this gap, it means we can try to increase it
+            best_gap = mid_gap
+            arrangement = temp_arrangement  # Update the best arrangement
+            min_gap = mid_gap + 1
+        else:
+            # If we can't place all points with this gap, it means we need to try a smaller gap
+            max_gap = mid_gap - 1
+
+    return best_gap, arrangement
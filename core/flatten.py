@@ -0,0 +1,27 @@
+"""The new due dates of the cards moved off the days over a review limit."""
+
+from typing import Dict, Iterator, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+def flatten_due_dates(
+    cards: Sequence[T], due_cnt_per_day: Dict[int, int], limit: int, today: int
+) -> Iterator[Tuple[T, int]]:
+    """Yield each of `cards` with its new due date, in order.
+
+    Starting from `today`, every day is filled up to `limit` reviews,
+    counting the `due_cnt_per_day` already due on it, and days already at
+    the limit are skipped.
+    """
+    cnt = 0
+    for new_due in range(today, today + 36500):
+        rest_cnt = len(cards) - cnt
+        if rest_cnt <= 0:
+            break
+        quota = limit - due_cnt_per_day.get(new_due, 0)
+        if quota <= 0:
+            continue
+        for card in cards[cnt : cnt + min(quota, rest_cnt)]:
+            yield card, new_due
+        cnt += min(quota, rest_cnt)
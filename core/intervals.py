@@ -0,0 +1,78 @@
+"""The FSRS forgetting curve and the intervals it gives."""
+
+from typing import List
+
+DECAY = -0.2
+
+
+def power_forgetting_curve(t, s, decay=DECAY):
+    factor = 0.9 ** (1 / decay) - 1
+    return (1 + factor * t / s) ** decay
+
+
+def next_interval(s, r, decay=DECAY):
+    factor = 0.9 ** (1 / decay) - 1
+    ivl = s / factor * (r ** (1 / decay) - 1)
+    return max(1, int(round(ivl)))
+
+
+def next_intervals(
+    stabilities: List[float], retentions: List[float], decays: List[float]
+) -> List[int]:
+    """Batch form of `next_interval`, with identical results.
+
+    The curve factor and retention term are computed once per distinct
+    (retention, decay) pair instead of once per card.
+    """
+    terms = {}
+    intervals = []
+    for s, r, decay in zip(stabilities, retentions, decays):
+        term = terms.get((r, decay))
+        if term is None:
+            term = (0.9 ** (1 / decay) - 1, r ** (1 / decay) - 1)
+            terms[(r, decay)] = term
+        factor, retention_term = term
+        intervals.append(max(1, int(round(s / factor * retention_term))))
+    return intervals
+
+
+def threshold_retentions(desired_retention: float, threshold: float):
+    """Retentions bounding the reschedule threshold band around `desired_retention`.
+
+    Returns (dr_upper, dr_lower): the odds of recall are scaled by
+    1 + threshold and 1 - threshold respectively, so dr_upper gives the
+    shortest acceptable interval and dr_lower the longest.
+    """
+    odds = desired_retention / (1 - desired_retention)
+
+    odds_upper = (1 + threshold) * odds
+    dr_upper = odds_upper / (odds_upper + 1)
+
+    odds_lower = (1 - threshold) * odds
+    dr_lower = odds_lower / (odds_lower + 1)
+    return dr_upper, dr_lower
+
+
+def in_threshold_band(
+    intervals: List[int],
+    stabilities: List[float],
+    retentions: List[float],
+    decays: List[float],
+    threshold: float,
+) -> List[bool]:
+    """For each card, whether its current interval lies inside the reschedule threshold band."""
+    bounds = {}
+    upper_retentions = []
+    lower_retentions = []
+    for r in retentions:
+        if r not in bounds:
+            bounds[r] = threshold_retentions(r, threshold)
+        dr_upper, dr_lower = bounds[r]
+        upper_retentions.append(dr_upper)
+        lower_retentions.append(dr_lower)
+    ivl_lower = next_intervals(stabilities, upper_retentions, decays)
+    ivl_upper = next_intervals(stabilities, lower_retentions, decays)
+    return [
+        lower <= ivl <= upper
+        for ivl, lower, upper in zip(intervals, ivl_lower, ivl_upper)
+    ]
@@ -0,0 +1,467 @@
+"""Fuzz and load balancing of review intervals."""
+
+import math
+from bisect import bisect
+from collections import defaultdict
+from datetime import date
+from itertools import accumulate
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+FUZZ_RANGES = [
+    {
+        "start": 2.5,
+        "end": 7.0,
+        "factor": 0.15,
+    },
+    {
+        "start": 7.0,
+        "end": 20.0,
+        "factor": 0.1,
+    },
+    {
+        "start": 20.0,
+        "end": math.inf,
+        "factor": 0.05,
+    },
+]
+
+
+def get_fuzz_range(interval, last_interval, maximum_interval):
+    delta = 1.0
+    for range in FUZZ_RANGES:
+        delta += range["factor"] * max(
+            min(interval, range["end"]) - range["start"], 0.0
+        )
+    interval = min(interval, maximum_interval)
+    min_ivl = int(round(interval - delta))
+    max_ivl = int(round(interval + delta))
+    min_ivl = max(2, min_ivl)
+    max_ivl = min(max_ivl, maximum_interval)
+    if interval > last_interval:
+        min_ivl = max(min_ivl, last_interval + 1)
+    min_ivl = min(min_ivl, max_ivl)
+    return min_ivl, max_ivl
+
+
+MASK_64 = (1 << 64) - 1
+
+
+def fuzz_random(cid: int, counter: int) -> float:
+    """A uniform value in [0, 1) derived only from `cid` and `counter`.
+
+    The pair is mixed with the SplitMix64 finalizer. No global random state
+    is touched, so the value does not depend on which other cards were
+    processed before, in which order, or in which process.
+    """
+    x = (cid + counter * 0x9E3779B97F4A7C15) & MASK_64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK_64
+    x ^= x >> 31
+    return (x >> 11) / (1 << 53)
+
+
+def weighted_choice(values: List[int], weights: List[float], fuzz_factor: float):
+    """Pick from `values` with probability proportional to `weights`.
+
+    Uses `fuzz_factor` from `fuzz_random` in place of a fresh random number,
+    in the same way as `random.choices`.
+    """
+    cum_weights = list(accumulate(weights))
+    return values[
+        bisect(cum_weights, fuzz_factor * cum_weights[-1], 0, len(values) - 1)
+    ]
+
+
+class PowerTable:
+    """`1 / x**exponent` for non-negative integers `x`, computed once per `x`.
+
+    The table grows to the largest `x` asked for and is shared by every card
+    of an operation, so load balancing weights are list lookups.
+    """
+
+    def __init__(self, exponent: float):
+        self.exponent = exponent
+        # x == 0 is left to the caller
+        self.values: List[float] = [1.0]
+
+    def gather(self, xs: List[int]) -> List[float]:
+        values = self.values
+        top = max(xs)
+        if top >= len(values):
+            exponent = self.exponent
+            values.extend(1 / (x**exponent) for x in range(len(values), top + 1))
+        return [values[x] for x in xs]
+
+
+REVIEW_COUNT_WEIGHTS = PowerTable(2.15)
+INTERVAL_WEIGHTS = PowerTable(3)
+
+
+def check_review_distribution(actual_reviews: List[int], percentages: List[float]):
+    easy_days_modifier = []
+    percentages = [p if p != 0 else 0.0001 for p in percentages]
+    possible_days_cnt = len(actual_reviews)
+    if possible_days_cnt <= 1:
+        return [1] * possible_days_cnt
+    total_review_count = sum(actual_reviews)
+    total_percentage = sum(percentages)
+    for p, review_count in zip(percentages, actual_reviews):
+        if p == 1:
+            easy_days_modifier.append(1)
+        elif p == 0.0001:
+            easy_days_modifier.append(0)
+        else:
+            other_days_count_total = total_review_count - review_count
+            other_days_p_total = total_percentage - p
+            if review_count / p >= other_days_count_total / other_days_p_total:
+                easy_days_modifier.append(0)
+            else:
+                easy_days_modifier.append(1)
+    return easy_days_modifier
+
+
+class DueHistogram:
+    """Number of review cards due on each day after `today`, for one preset.
+
+    Counts live in a list indexed by `due - today`, so increments are
+    constant time and the counts of a fuzz range are read as one slice.
+    Days up to today are not stored; `LoadBalancer.due_today` tracks those.
+    """
+
+    def __init__(self, today: int):
+        self.today = today
+        self.counts: List[int] = [0]
+
+    def add(self, due: int, count: int = 1):
+        offset = due - self.today
+        if offset <= 0:
+            return
+        if offset >= len(self.counts):
+            self.counts.extend(
+                [0] * max(offset + 1 - len(self.counts), len(self.counts))
+            )
+        self.counts[offset] += count
+
+    def __getitem__(self, due: int) -> int:
+        offset = due - self.today
+        if 0 < offset < len(self.counts):
+            return self.counts[offset]
+        return 0
+
+    def window(self, first_due: int, last_due: int) -> List[int]:
+        """Counts for each day from `first_due` to `last_due`, both after today."""
+        start = first_due - self.today
+        end = last_due - self.today + 1
+        counts = self.counts[start:end]
+        if len(counts) < end - start:
+            counts.extend([0] * (end - start - len(counts)))
+        return counts
+
+
+class BalanceCard(NamedTuple):
+    """What load balancing needs to know about one review card."""
+
+    cid: int
+    reps: int
+    target_ivl: int
+    maximum_interval: int
+    due: int
+    last_review: int
+    last_interval: int
+    # cards without a review in the revlog keep their due
+    reviewed: bool
+
+    def due_after(self, new_ivl: int) -> int:
+        """The due of the card after `update_card_due_ivl` gives it `new_ivl`."""
+        return self.last_review + max(new_ivl, 1) if self.reviewed else self.due
+
+
+class _MinTree:
+    """Index of the smallest key in a range, with point updates.
+
+    A segment tree, so both operations are O(log n). Ties go to the lowest
+    index.
+    """
+
+    def __init__(self, keys: List[float]):
+        size = 1
+        while size < len(keys):
+            size *= 2
+        self.size = size
+        self.keys = keys + [math.inf] * (size - len(keys))
+        self.best = [0] * size + list(range(size))
+        for node in range(size - 1, 0, -1):
+            self._pull(node)
+
+    def _pull(self, node: int):
+        left = self.best[2 * node]
+        right = self.best[2 * node + 1]
+        self.best[node] = left if self.keys[left] <= self.keys[right] else right
+
+    def _better(self, a: Optional[int], b: int) -> int:
+        if a is None:
+            return b
+        return a if (self.keys[a], a) <= (self.keys[b], b) else b
+
+    def update(self, index: int, key: float):
+        self.keys[index] = key
+        node = (index + self.size) // 2
+        while node:
+            self._pull(node)
+            node //= 2
+
+    def argmin(self, first: int, last: int) -> int:
+        """Index of the smallest key from `first` to `last`, both included."""
+        best = None
+        lo = first + self.size
+        hi = last + self.size + 1
+        while lo < hi:
+            if lo & 1:
+                best = self._better(best, self.best[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                best = self._better(best, self.best[hi])
+            lo //= 2
+            hi //= 2
+        return best
+
+
+class LoadBalancer:
+    """Fuzz and load balancing of review intervals.
+
+    Holds only plain data and never touches the collection, so worker
+    processes can run it for one preset at a time. `FSRS` adds the parts
+    that read from the collection.
+    """
+
+    maximum_interval: int
+    easy_specific_due_dates: Set[int]
+    due_cnt_per_day_per_preset: Dict[int, DueHistogram]
+    due_today_per_preset: Dict[int, int]
+    reviewed_today_per_preset: Dict[int, int]
+    easy_days_percentages_per_preset: Dict[int, List[float]]
+    apply_easy_days: bool
+    current_date: date
+    today: int
+    preset_id: int
+    fuzz_factor: float
+
+    def __init__(self, today: int, current_date: date) -> None:
+        self.maximum_interval = 36500
+        self.easy_specific_due_dates = set()
+        self.apply_easy_days = False
+        self.current_date = current_date
+        self.today = today
+        self.due_cnt_per_day_per_preset = defaultdict(lambda: DueHistogram(self.today))
+        self.due_today_per_preset = defaultdict(int)
+        self.reviewed_today_per_preset = defaultdict(int)
+        self.easy_days_percentages_per_preset = {}
+        self._weekday_tables = {}
+
+    @property
+    def due_cnt_per_day(self):
+        return self.due_cnt_per_day_per_preset[self.preset_id]
+
+    def update_due_cnt_per_day(self, due_before: int, due_after: int):
+        due_cnt_per_day = self.due_cnt_per_day
+        due_cnt_per_day.add(due_before, -1)
+        due_cnt_per_day.add(due_after, 1)
+        if due_before <= self.today and due_after > self.today:
+            self.due_today -= 1
+        if due_before > self.today and due_after <= self.today:
+            self.due_today += 1
+
+    @property
+    def due_today(self):
+        return self.due_today_per_preset[self.preset_id]
+
+    @due_today.setter
+    def due_today(self, value):
+        self.due_today_per_preset[self.preset_id] = value
+
+    @property
+    def reviewed_today(self):
+        return self.reviewed_today_per_preset[self.preset_id]
+
+    @property
+    def easy_days_review_ratio_list(self):
+        easy_days_percentages = self.easy_days_percentages_per_preset.get(
+            self.preset_id
+        )
+        return easy_days_percentages if easy_days_percentages else [1] * 7
+
+    def easy_days_percentages(self, first_due: int, last_due: int) -> List[float]:
+        """Easy days percentage of each day from `first_due` to `last_due`."""
+        ratio_list = self.easy_days_review_ratio_list
+        cached = self._weekday_tables.get(self.preset_id)
+        if cached is None or cached[0] is not ratio_list:
+            # percentage by (due - today) % 7, so a window is one slice
+            weekday = self.current_date.weekday()
+            table = [ratio_list[(weekday + offset) % 7] for offset in range(7)]
+            cached = (ratio_list, table)
+            self._weekday_tables[self.preset_id] = cached
+        table = cached[1]
+        start = (first_due - self.today) % 7
+        count = last_due - first_due + 1
+        return (table * (count // 7 + 2))[start : start + count]
+
+    def set_fuzz_factor(self, cid: int, reps: int):
+        self.fuzz_factor = fuzz_random(cid, reps)
+
+    def load_balance(
+        self,
+        possible_intervals: List[int],
+        review_cnts: List[int],
+        last_review: int,
+    ):
+        weights = [
+            1 if r == 0 else review_weight * interval_weight
+            for r, review_weight, interval_weight in zip(
+                review_cnts,
+                REVIEW_COUNT_WEIGHTS.gather(review_cnts),
+                INTERVAL_WEIGHTS.gather(possible_intervals),
+            )
+        ]
+
+        first_due = last_review + possible_intervals[0]
+        last_due = last_review + possible_intervals[-1]
+        easy_days_modifier = check_review_distribution(
+            review_cnts, self.easy_days_percentages(first_due, last_due)
+        )
+        for due in self.easy_specific_due_dates:
+            if first_due <= due <= last_due:
+                easy_days_modifier[due - first_due] = 0
+        final_weights = [w * m for w, m in zip(weights, easy_days_modifier)]
+
+        if sum(final_weights) > 0:
+            return weighted_choice(possible_intervals, final_weights, self.fuzz_factor)
+        else:
+            return weighted_choice(possible_intervals, weights, self.fuzz_factor)
+
+    def fuzz_window(
+        self, ivl, last_review: int, last_interval: int, due: int
+    ) -> Tuple[int, int]:
+        """The range of intervals load balancing chooses from, before it is clipped to today."""
+        min_ivl, max_ivl = get_fuzz_range(ivl, last_interval, self.maximum_interval)
+
+        if self.apply_easy_days:
+            if due > last_review + max_ivl + 2:
+                current_ivl = due - last_review
+                min_ivl, max_ivl = get_fuzz_range(
+                    current_ivl, last_interval, current_ivl
+                )
+        return min_ivl, max_ivl
+
+    def balanced_interval(
+        self, ivl, last_review: int, last_interval: int, due: int
+    ) -> int:
+        # Load balance
+        min_ivl, max_ivl = self.fuzz_window(ivl, last_review, last_interval, due)
+
+        if last_review + max_ivl < self.today:
+            return min(ivl, max_ivl)
+
+        min_ivl = max(min_ivl, self.today - last_review)
+
+        possible_intervals = list(range(min_ivl, max_ivl + 1))
+        # only the first candidate can fall on today, since min_ivl >= today - last_review
+        first_future_due = max(last_review + min_ivl, self.today + 1)
+        review_cnts = [self.due_today + self.reviewed_today] * (
+            first_future_due - (last_review + min_ivl)
+        )
+        if first_future_due <= last_review + max_ivl:
+            review_cnts += self.due_cnt_per_day.window(
+                first_future_due, last_review + max_ivl
+            )
+
+        best_ivl = self.load_balance(
+            possible_intervals,
+            review_cnts,
+            last_review,
+        )
+        return best_ivl
+
+    def balance_in_order(self, cards: Iterable[BalanceCard]) -> List[int]:
+        """New intervals of `cards`, placed one at a time in the given order."""
+        new_ivls = []
+        for card in cards:
+            self.set_fuzz_factor(card.cid, card.reps)
+            self.maximum_interval = card.maximum_interval
+            if card.target_ivl < 2.5:
+                new_ivl = card.target_ivl
+            else:
+                new_ivl = self.balanced_interval(
+                    card.target_ivl, card.last_review, card.last_interval, card.due
+                )
+            self.update_due_cnt_per_day(card.due, card.due_after(new_ivl))
+            new_ivls.append(new_ivl)
+        return new_ivls
+
+    def _add_due(self, due: int, count: int):
+        if due <= self.today:
+            self.due_today += count
+        else:
+            self.due_cnt_per_day.add(due, count)
+
+    def balance_globally(self, cards: List[BalanceCard]) -> List[int]:
+        """New intervals of `cards`, placed all together.
+
+        All cards are first taken out of the due counts. Then, in order of the
+        last day of their fuzz range, each card goes to the day of that range
+        with the lowest load relative to its easy days percentage, the
+        earliest such day on ties. The result does not depend on the order of
+        `cards`, and no fuzz factor is used. Each placement is O(log D) in the
+        number of days D.
+        """
+        today = self.today
+        new_ivls: List[Optional[int]] = [None] * len(cards)
+        windows = []
+        for index, card in enumerate(cards):
+            self._add_due(card.due, -1)
+            ivl = card.target_ivl
+            if ivl < 2.5:
+                new_ivls[index] = ivl
+                continue
+            self.maximum_interval = card.maximum_interval
+            min_ivl, max_ivl = self.fuzz_window(
+                ivl, card.last_review, card.last_interval, card.due
+            )
+            if card.last_review + max_ivl < today:
+                new_ivls[index] = min(ivl, max_ivl)
+                continue
+            min_ivl = max(min_ivl, today - card.last_review)
+            if not card.reviewed:
+                new_ivls[index] = min(max(ivl, min_ivl), max_ivl)
+                continue
+            windows.append(
+                (card.last_review + max_ivl, card.last_review + min_ivl, index)
+            )
+        for card, new_ivl in zip(cards, new_ivls):
+            if new_ivl is not None:
+                self._add_due(card.due_after(new_ivl), 1)
+        if not windows:
+            return new_ivls
+
+        last_day = max(window[0] for window in windows)
+        loads = [self.due_today + self.reviewed_today]
+        if last_day > today:
+            loads += self.due_cnt_per_day.window(today + 1, last_day)
+        capacities = [
+            p if p > 0 else 0.0001
+            for p in self.easy_days_percentages(today, today + len(loads) - 1)
+        ]
+        for due in self.easy_specific_due_dates:
+            if today <= due < today + len(loads):
+                capacities[due - today] = 0.0001
+        tree = _MinTree(
+            [(load + 1) / capacity for load, capacity in zip(loads, capacities)]
+        )
+
+        for last, first, index in sorted(windows):
+            offset = tree.argmin(first - today, last - today)
+            loads[offset] += 1
+            tree.update(offset, (loads[offset] + 1) / capacities[offset])
+            new_ivls[index] = today + offset - cards[index].last_review
+            self._add_due(today + offset, 1)
+        return new_ivls
@@ -0,0 +1,226 @@
+"""The FSRS-6 memory state update rules, replayed over a card's revlog.
+
+The results are identical to those of the Anki backend from 25.05, which
+replays with FSRS-6, where `EXACT` is set; see `FSRSModel`.
+"""
+
+import ctypes
+import ctypes.util
+import math
+import struct
+import sys
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+# revlog types, as stored in the `type` column
+REVLOG_LRN = 0
+REVLOG_CRAM = 3
+REVLOG_RESCHED = 4
+# Rescheduled by the "Reschedule cards on change" option of FSRS
+REVLOG_RESCHEDULED = 5
+
+DEFAULT_PARAMETERS = [
+    0.212,
+    1.2931,
+    2.3065,
+    8.2956,
+    6.4133,
+    0.8334,
+    3.0194,
+    0.001,
+    1.8722,
+    0.1666,
+    0.796,
+    1.4835,
+    0.0614,
+    0.2629,
+    1.6483,
+    0.6014,
+    1.8729,
+    0.5425,
+    0.0912,
+    0.0658,
+    0.1542,
+]
+
+S_MIN = 0.001
+S_MAX = 36500.0
+D_MIN = 1.0
+D_MAX = 10.0
+
+
+class MemoryState(NamedTuple):
+    stability: float
+    difficulty: float
+    decay: float
+
+
+def fill_parameters(params: Sequence[float]) -> Optional[List[float]]:
+    """The 21 FSRS-6 parameters equivalent to a preset's `params`, as float32.
+
+    This is how a backend with FSRS-6 reads presets with no or 19
+    parameters. Returns None for parameter sets that are left to the backend.
+    """
+    if len(params) == 0:
+        params = DEFAULT_PARAMETERS
+    elif len(params) == 19:
+        params = list(params) + [0.0, 0.5]
+    elif len(params) != 21:
+        return None
+    return [f32(w) for w in params]
+
+
+_FLOAT32 = struct.Struct("f")
+
+
+def f32(x: float) -> float:
+    """`x` rounded to the nearest float32."""
+    return _FLOAT32.unpack(_FLOAT32.pack(x))[0]
+
+
+def _load_c_math():
+    """`expf` and `powf` of the C library, or None where it can't be loaded.
+
+    The backend's float32 math calls these functions. They are not always
+    correctly rounded, so `math.exp` or `math.pow` rounded to float32 differs
+    from them in the last bit for some inputs.
+    """
+    name = "ucrtbase" if sys.platform == "win32" else ctypes.util.find_library("m")
+    try:
+        library = ctypes.CDLL(name)
+        expf, powf = library.expf, library.powf
+    except (OSError, AttributeError):
+        return None
+    expf.restype = powf.restype = ctypes.c_float
+    expf.argtypes = [ctypes.c_float]
+    powf.argtypes = [ctypes.c_float, ctypes.c_float]
+    return expf, powf
+
+
+_C_MATH = _load_c_math()
+# whether the memory states are bit-identical to the backend's
+EXACT = _C_MATH is not None
+
+if _C_MATH is not None:
+    _exp, _pow = _C_MATH
+else:
+
+    def _exp(x: float) -> float:
+        return f32(math.exp(x))
+
+    def _pow(x: float, y: float) -> float:
+        return f32(x**y)
+
+
+class FSRSModel:
+    """The FSRS update rules for one parameter set.
+
+    Every operation is rounded to float32 in the order the backend evaluates
+    it, and exponentials and powers use the C library's float32 functions as
+    the backend does, so the memory states are identical to the backend's.
+    Without them (`EXACT` unset) they may differ in the last bit. Terms that
+    only depend on the parameters are computed once.
+    """
+
+    def __init__(self, w: Sequence[float]):
+        self.w = w
+        self.decay = -w[20]
+        self.factor = f32(_pow(f32(0.9), 1 / self.decay) - 1)
+        self.init_difficulties = [self._init_difficulty(rating) for rating in range(5)]
+        # short-term stability increase before the stability term, per rating
+        self.short_term_bases = [
+            _exp(f32(w[17] * f32(rating - 3 + w[18]))) for rating in range(5)
+        ]
+        self.success_base = _exp(w[8])
+        self.failure_divisor = _exp(f32(w[17] * w[18]))
+
+    def _init_difficulty(self, rating: int) -> float:
+        w = self.w
+        return f32(f32(w[4] - _exp(f32(w[5] * (rating - 1)))) + 1)
+
+    def next_state(
+        self, delta_t: int, rating: int, state: Optional[Tuple[float, float]]
+    ) -> Tuple[float, float]:
+        """Stability and difficulty after one review, or after the first one."""
+        w = self.w
+        if state is None:
+            stability = w[rating - 1]
+            difficulty = min(max(self.init_difficulties[rating], D_MIN), D_MAX)
+            return min(max(stability, S_MIN), S_MAX), difficulty
+
+        last_s, last_d = state
+        if delta_t == 0:
+            sinc = f32(self.short_term_bases[rating] * _pow(last_s, -w[19]))
+            if rating >= 2:
+                sinc = max(sinc, 1.0)
+            stability = f32(last_s * sinc)
+        else:
+            r = _pow(f32(f32(f32(delta_t / last_s) * self.factor) + 1), self.decay)
+            if rating == 1:
+                stability = f32(w[11] * _pow(last_d, -w[12]))
+                stability = f32(stability * f32(_pow(f32(last_s + 1), w[13]) - 1))
+                stability = f32(stability * _exp(f32(f32(1 - r) * w[14])))
+                stability = min(stability, f32(last_s / self.failure_divisor))
+            else:
+                increase = f32(self.success_base * f32(11 - last_d))
+                increase = f32(increase * _pow(last_s, -w[9]))
+                increase = f32(increase * f32(_exp(f32(f32(1 - r) * w[10])) - 1))
+                if rating == 2:
+                    increase = f32(increase * w[15])
+                elif rating == 4:
+                    increase = f32(increase * w[16])
+                stability = f32(last_s * f32(increase + 1))
+
+        delta_d = f32(-w[6] * f32(rating - 3))
+        difficulty = f32(last_d + f32(f32(f32(10 - last_d) * delta_d) / 9))
+        difficulty = f32(
+            f32(w[7] * f32(self.init_difficulties[4] - difficulty)) + difficulty
+        )
+        difficulty = min(max(difficulty, D_MIN), D_MAX)
+        return min(max(stability, S_MIN), S_MAX), difficulty
+
+    def replay(self, reviews: Iterable[Tuple[int, int]]) -> Tuple[float, float]:
+        """Memory state after `reviews`, given as (delta_t, rating) pairs."""
+        state = None
+        for delta_t, rating in reviews:
+            state = self.next_state(delta_t, rating, state)
+        return state
+
+
+def reviews_for_fsrs(
+    entries: Sequence[Tuple[int, int, int, int]], today: int, day_cutoff: int
+) -> Optional[List[Tuple[int, int]]]:
+    """The (delta_t, rating) pairs the backend replays for one card.
+
+    `entries` are the card's (id, ease, type, factor) revlog rows in id
+    order. Returns None when the history does not start with the card's
+    last learning steps, which the backend handles with an SM-2 based
+    starting state instead.
+    """
+    first_learning = None
+    for index in range(len(entries) - 1, -1, -1):
+        _, ease, revlog_type, factor = entries[index]
+        if revlog_type == REVLOG_CRAM and factor == 0:
+            continue
+        if revlog_type == REVLOG_LRN and 1 <= ease <= 4:
+            first_learning = index
+        elif first_learning is not None:
+            break
+        elif revlog_type in (REVLOG_RESCHED, REVLOG_RESCHEDULED) and factor == 0:
+            # reset: the backend only uses the history after it
+            return None
+    if first_learning is None:
+        return None
+
+    reviews = []
+    last_day = None
+    for revlog_id, ease, revlog_type, factor in entries[first_learning:]:
+        if (
+            revlog_type in (REVLOG_RESCHED, REVLOG_RESCHEDULED)
+            or ease == 0
+            or (revlog_type == REVLOG_CRAM and factor == 0)
+        ):
+            continue
+        day = math.ceil((revlog_id // 1000 - day_cutoff) / 86400) + today
+        reviews.append((day - last_day if last_day is not None else 0, ease))
+        last_day = day
+    return reviews
@@ -0,0 +1,71 @@
+"""The days the cards due during a break are moved to."""
+
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Sequence
+
+
+def break_target_totals(
+    candidate_days: Sequence[int], base_counts: Dict[int, int], extra_cards: int
+) -> Dict[int, int]:
+    """The number of cards each candidate day should end up with.
+
+    Each day keeps the `base_counts` already due on it, and the
+    `extra_cards` due during the break are shared out evenly, the earlier
+    days taking the remainder.
+    """
+    extra_quota, extra_remainder = divmod(extra_cards, len(candidate_days))
+    target_totals = {}
+    for idx, day in enumerate(candidate_days):
+        additional = extra_quota + (1 if idx < extra_remainder else 0)
+        target_totals[day] = base_counts.get(day, 0) + additional
+    return target_totals
+
+
+def allocate_break_cards(
+    cards: Sequence,
+    candidate_days: List[int],
+    target_totals: Dict[int, int],
+    on_assign: Optional[Callable[[object, int], None]] = None,
+) -> Dict[int, list]:
+    """Assign `cards` to `candidate_days`, the shortest intervals first.
+
+    The cards need `original_due` and `original_interval` attributes. Each
+    card goes to the day with room left that is closest to its original due
+    date relative to its interval, preferring days on or after it.
+    `on_assign` is called with each card and its new due date.
+    """
+    assigned = defaultdict(list)
+    sorted_cards = sorted(
+        cards,
+        key=lambda c: (c.original_interval, c.original_due),
+    )
+
+    if not candidate_days:
+        return assigned
+
+    remaining = {day: target_totals.get(day, 0) for day in candidate_days}
+
+    for break_card in sorted_cards:
+        earliest_day = max(candidate_days[0], break_card.original_due)
+        feasible_days = [
+            day
+            for day in candidate_days
+            if day >= earliest_day and remaining.get(day, 0) > 0
+        ]
+
+        if not feasible_days:
+            feasible_days = [day for day in candidate_days if remaining.get(day, 0) > 0]
+
+        if not feasible_days:
+            continue
+
+        def day_cost(day: int) -> tuple[float, int]:
+            cost = abs(day - break_card.original_due) / break_card.original_interval
+            return (cost, day)
+
+        best_day = min(feasible_days, key=day_cost)
+        remaining[best_day] -= 1
+        assigned[best_day].append(break_card)
+        if on_assign is not None:
+            on_assign(break_card, best_day)
+    return assigned
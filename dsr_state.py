@@ -2,9 +2,9 @@ from anki import hooks
 from anki.template import TemplateRenderContext, TemplateRenderOutput
 
 from .configuration import Config
+from .core.intervals import power_forgetting_curve
 from .utils import (
     get_decay,
-    power_forgetting_curve,
     get_last_review_date_and_interval,
     mw,
 )
@@ -0,0 +1,151 @@
+"""Run the add-on's scheduling operations without the Anki main window.
+
+Used by `cli.py` and the scripts under `benchmarks/`.
+
+`HeadlessMainWindow` provides the parts of `aqt.mw` that the background
+functions of the operations use: the collection, a task manager that runs
+everything on the calling thread, a progress object that is never
+cancelled, and an add-on manager that reads `config.json`. Install it with
+`install` before `load_addon` imports any module of the add-on, since the
+modules bind `mw` when they are imported.
+
+Anki and aqt have to be installed, but no display is needed.
+"""
+
+import importlib.util
+import json
+import sys
+import tempfile
+from concurrent.futures import Future
+from pathlib import Path
+from types import ModuleType
+from typing import Optional
+
+import aqt
+from anki.collection import Collection
+from anki.lang import set_lang
+
+REPO = Path(__file__).resolve().parent
+PACKAGE = "fsrs4anki_helper"
+
+
+class HeadlessTaskManager:
+    def run_on_main(self, closure):
+        closure()
+
+    def run_in_background(self, task, on_done=None, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(task())
+        except Exception as exception:
+            future.set_exception(exception)
+        if on_done is not None:
+            on_done(future)
+        return future
+
+
+class HeadlessProgress:
+    def start(self, *args, **kwargs):
+        pass
+
+    def update(self, *args, **kwargs):
+        pass
+
+    def finish(self):
+        pass
+
+    def want_cancel(self) -> bool:
+        return False
+
+
+class HeadlessAddonManager:
+    def __init__(self, addons_folder: Path, config: dict):
+        self.addons_folder = addons_folder
+        self.config = config
+
+    def getConfig(self, module: str) -> dict:
+        return self.config
+
+    def writeConfig(self, module: str, config: dict):
+        self.config = config
+
+    def addonFromModule(self, module: str) -> str:
+        return module.split(".")[0]
+
+    def addonsFolder(self, module: Optional[str] = None) -> str:
+        return str(self.addons_folder / module if module else self.addons_folder)
+
+    def setConfigUpdatedAction(self, module: str, action):
+        pass
+
+
+class HeadlessProfileManager:
+    def __init__(self, name: str, folder: Path):
+        self.name = name
+        self.folder = folder
+        self.meta = {"defaultLang": "en_US"}
+
+    def profileFolder(self) -> str:
+        return str(self.folder)
+
+
+class HeadlessMainWindow:
+    def __init__(self, config: dict, folder: Path, profile: str = "headless"):
+        self.col: Optional[Collection] = None
+        self.taskman = HeadlessTaskManager()
+        self.progress = HeadlessProgress()
+        self.addonManager = HeadlessAddonManager(folder / "addons", config)
+        self.pm = HeadlessProfileManager(profile, folder)
+
+    def reset(self):
+        pass
+
+    def checkpoint(self, name: str):
+        pass
+
+
+def default_config() -> dict:
+    with open(REPO / "config.json", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def install(
+    config_overrides: Optional[dict] = None, folder: Optional[Path] = None
+) -> HeadlessMainWindow:
+    """Make a `HeadlessMainWindow` the `aqt.mw` of this process.
+
+    `folder` holds the add-on's user_files; it defaults to a new
+    temporary directory.
+    """
+    if isinstance(aqt.mw, HeadlessMainWindow):
+        aqt.mw.addonManager.config.update(config_overrides or {})
+        return aqt.mw
+    if folder is None:
+        folder = Path(tempfile.mkdtemp(prefix="fsrs4anki-helper-"))
+    config = {**default_config(), **(config_overrides or {})}
+    set_lang("en_US")
+    aqt.mw = HeadlessMainWindow(config, folder)
+    return aqt.mw
+
+
+def load_addon() -> ModuleType:
+    """Import the add-on as the `fsrs4anki_helper` package.
+
+    The package's `__init__.py`, which builds the menus of the main window,
+    is not run; import the modules needed, such as
+    `fsrs4anki_helper.schedule.reschedule`, after this.
+    """
+    package = sys.modules.get(PACKAGE)
+    if package is None:
+        spec = importlib.util.spec_from_loader(PACKAGE, loader=None, is_package=True)
+        package = importlib.util.module_from_spec(spec)
+        package.__path__ = [str(REPO)]
+        sys.modules[PACKAGE] = package
+    return package
+
+
+def open_collection(path: Path) -> Collection:
+    """Open the collection at `path` and make it `mw.col`."""
+    col = Collection(str(path))
+    aqt.mw.col = col
+    return col
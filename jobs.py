@@ -0,0 +1,255 @@
+"""Work deferred until Anki is idle, kept across restarts.
+
+Operations that would keep Anki busy for too long add a job to the
+`JobQueue` with `add_job` instead of doing all of the work at once. While
+the deck list or a deck's overview is shown and the user has not touched
+the keyboard or mouse for `IDLE_SECONDS`, the oldest job is run for a short
+step in the background, without a progress window. Any input pauses the
+queue: the current step stops early, and takes at most about
+`JOB_TIME_BUDGET` seconds anyway. The steps write their cards into one
+undo entry per kind of work, which a new one replaces as soon as the user
+does something undoable (see `job_undo_entry`).
+
+Each kind of job has a runner registered with `job_runner`. A runner does
+one step of the work in its payload, stopping early once the `should_stop`
+it is given returns True, and returns the payload of the work left, or
+None when the job is done.
+"""
+
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from anki.utils import ids2str
+from aqt import mw
+from aqt.qt import QEvent, QObject
+
+from .schedule.disperse_siblings import disperse_siblings_background
+from .schedule.reschedule import budget_slice_size, reschedule_background
+from .utils import RescheduleBacklog, RevlogSummaryCache
+
+IDLE_SECONDS = 10
+IDLE_STATES = ("deckBrowser", "overview")
+JOB_CHECK_MS = 2000
+# seconds per step of a job
+JOB_TIME_BUDGET = 0.5
+DISPERSE_NOTES_PER_STEP = 200
+
+RESCHEDULE_BACKLOG = "reschedule_backlog"
+DISPERSE = "disperse"
+REVLOG_SUMMARY = "revlog_summary"
+
+INPUT_EVENTS = (
+    QEvent.Type.KeyPress,
+    QEvent.Type.MouseButtonPress,
+    QEvent.Type.MouseMove,
+    QEvent.Type.Wheel,
+)
+
+
+class Job(NamedTuple):
+    id: int
+    kind: str
+    payload: dict
+
+
+class JobQueue:
+    """Jobs waiting to run, persisted in the add-on's user_files."""
+
+    def __init__(self, path: Optional[Path] = None):
+        if path is None:
+            addon = mw.addonManager.addonFromModule(__name__)
+            user_files = Path(mw.addonManager.addonsFolder(addon)) / "user_files"
+            user_files.mkdir(parents=True, exist_ok=True)
+            path = user_files / f"{mw.pm.name}_jobs.db"
+        self.db = sqlite3.connect(path)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL
+            )
+        """)
+
+    def add(self, kind: str, payload: dict, unique: bool = False):
+        with self.db:
+            if (
+                unique
+                and self.db.execute(
+                    "SELECT 1 FROM jobs WHERE kind = ?", (kind,)
+                ).fetchone()
+            ):
+                return
+            self.db.execute(
+                "INSERT INTO jobs (kind, payload) VALUES (?, ?)",
+                (kind, json.dumps(payload)),
+            )
+
+    def first(self) -> Optional[Job]:
+        row = self.db.execute(
+            "SELECT id, kind, payload FROM jobs ORDER BY id LIMIT 1"
+        ).fetchone()
+        return Job(row[0], row[1], json.loads(row[2])) if row else None
+
+    def update(self, job_id: int, payload: dict):
+        with self.db:
+            self.db.execute(
+                "UPDATE jobs SET payload = ? WHERE id = ?",
+                (json.dumps(payload), job_id),
+            )
+
+    def remove(self, job_id: int):
+        with self.db:
+            self.db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def close(self):
+        self.db.close()
+
+
+JOB_RUNNERS: Dict[str, Callable[[dict, Callable[[], bool]], Optional[dict]]] = {}
+
+
+def job_runner(kind: str):
+    def decorator(function):
+        JOB_RUNNERS[kind] = function
+        return function
+
+    return decorator
+
+
+def add_job(kind: str, payload: Optional[dict] = None, unique: bool = False):
+    """Queue a job of `kind`; with `unique`, only if none is queued yet."""
+    queue = JobQueue()
+    queue.add(kind, payload or {}, unique)
+    queue.close()
+
+
+@job_runner(RESCHEDULE_BACKLOG)
+def reschedule_backlog(
+    payload: dict, should_stop: Callable[[], bool]
+) -> Optional[dict]:
+    if not mw.col.get_config("fsrs"):
+        return None
+    backlog = RescheduleBacklog()
+    cids = backlog.cids(limit=budget_slice_size(JOB_TIME_BUDGET))
+    backlog.close()
+    if not cids:
+        return None
+    result = reschedule_background(
+        None,
+        filter_flag=True,
+        filtered_cids=set(cids),
+        auto_reschedule=True,
+        time_budget=JOB_TIME_BUDGET,
+        show_progress=False,
+        should_stop=should_stop,
+    )
+    # the notes of the rescheduled cards, when auto disperse after reschedule is on
+    if isinstance(result, tuple):
+        nids = mw.col.db.list(f"SELECT id FROM notes WHERE id IN {result[1]}")
+        if nids:
+            add_job(DISPERSE, {"nids": nids})
+    backlog = RescheduleBacklog()
+    done = backlog.empty()
+    backlog.close()
+    return None if done else payload
+
+
+@job_runner(DISPERSE)
+def disperse(payload: dict, should_stop: Callable[[], bool]) -> Optional[dict]:
+    nids = payload["nids"]
+    disperse_siblings_background(
+        None,
+        filter_flag=True,
+        filtered_nid_string=ids2str(nids[:DISPERSE_NOTES_PER_STEP]),
+        show_progress=False,
+        should_stop=should_stop,
+    )
+    nids = nids[DISPERSE_NOTES_PER_STEP:]
+    return {"nids": nids} if nids else None
+
+
+@job_runner(REVLOG_SUMMARY)
+def update_revlog_summary(
+    payload: dict, should_stop: Callable[[], bool]
+) -> Optional[dict]:
+    revlog_summary = RevlogSummaryCache()
+    revlog_summary.update()
+    revlog_summary.close()
+    return None
+
+
+class InputWatcher(QObject):
+    """Remembers when the user last used the keyboard or mouse."""
+
+    def __init__(self):
+        super().__init__(mw)
+        self.last_input = time.monotonic()
+
+    def eventFilter(self, obj, event) -> bool:
+        if event.type() in INPUT_EVENTS:
+            self.last_input = time.monotonic()
+        return False
+
+
+def is_idle(watcher: InputWatcher) -> bool:
+    return (
+        mw.col is not None
+        and mw.state in IDLE_STATES
+        and not mw.progress.busy()
+        and mw.app.activeModalWidget() is None
+        and time.monotonic() - watcher.last_input >= IDLE_SECONDS
+    )
+
+
+def run_next_job(watcher: InputWatcher, running: List[bool]):
+    if running or not is_idle(watcher):
+        return
+    queue = JobQueue()
+    job = queue.first()
+    if job is not None and job.kind not in JOB_RUNNERS:
+        # left by another version of the add-on
+        queue.remove(job.id)
+        job = None
+    queue.close()
+    if job is None:
+        return
+
+    def on_done(future):
+        running.clear()
+        queue = JobQueue()
+        try:
+            payload = future.result()
+            if payload is None:
+                queue.remove(job.id)
+            else:
+                queue.update(job.id, payload)
+        except Exception:
+            # a failing job would fail again on every step
+            queue.remove(job.id)
+            raise
+        finally:
+            queue.close()
+        if payload is None and mw.state in IDLE_STATES:
+            mw.reset()
+
+    started = time.monotonic()
+
+    def should_stop() -> bool:
+        return watcher.last_input > started
+
+    running.append(True)
+    mw.taskman.run_in_background(
+        lambda: JOB_RUNNERS[job.kind](job.payload, should_stop), on_done
+    )
+
+
+def init_jobs():
+    watcher = InputWatcher()
+    mw.app.installEventFilter(watcher)
+    running = []
+    mw.progress.timer(
+        JOB_CHECK_MS, lambda: run_next_job(watcher, running), True, parent=mw
+    )
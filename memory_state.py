@@ -0,0 +1,87 @@
+"""FSRS memory states of many cards, computed from one revlog query.
+
+`compute_memory_states` replays each card's review history with the FSRS
+formulas of `core.memory_state`, as the backend does in
+`Collection.compute_memory_state`, instead of making one backend call per
+card. Histories that need the backend's SM-2
+based starting state (reset, truncated or ignored revlogs) and presets with
+parameters it does not handle are still passed to the backend, and so is
+everything where the C library math that makes the results identical to
+the backend's can't be loaded. Backends before Anki 25.05 replay with the
+rules of older FSRS versions, so all cards are passed to them.
+"""
+
+from typing import Dict, Iterable, Optional
+
+from anki.utils import ids2str, point_version
+from aqt import mw
+
+from .core.memory_state import (
+    EXACT,
+    FSRSModel,
+    MemoryState,
+    fill_parameters,
+    reviews_for_fsrs,
+)
+from .utils import DeckConfigIndex
+
+# whether the backend's memory states are those `FSRSModel` replays: FSRS-6,
+# from Anki 25.05, with the C library math loaded
+REPLAY_LOCALLY = EXACT and point_version() >= 250500
+
+
+def compute_memory_states(
+    cids: Iterable[int],
+    deck_configs: Optional[DeckConfigIndex] = None,
+    chunk_size: int = 5000,
+) -> Dict[int, object]:
+    """Memory states of `cids`, keyed by card id.
+
+    Values have the `stability`, `difficulty` and `decay` attributes of the
+    result of `Collection.compute_memory_state`; the stability is None for
+    cards without a memory state.
+    """
+    if deck_configs is None:
+        deck_configs = DeckConfigIndex()
+    today = mw.col.sched.today
+    day_cutoff = mw.col.sched.day_cutoff
+    cids = list(cids)
+    memory_states = {}
+    models: Dict[int, Optional[FSRSModel]] = {}
+    for start in range(0, len(cids), chunk_size):
+        chunk = ids2str(cids[start : start + chunk_size])
+        dids = dict(
+            mw.col.db.all(f"""
+                SELECT id, CASE WHEN odid==0 THEN did ELSE odid END
+                FROM cards
+                WHERE id IN {chunk}
+            """)
+        )
+        entries_per_card = {cid: [] for cid in dids}
+        for cid, revlog_id, ease, revlog_type, factor in mw.col.db.all(f"""
+            SELECT cid, id, ease, type, factor
+            FROM revlog
+            WHERE cid IN {chunk}
+            ORDER BY cid, id
+        """):
+            entries_per_card[cid].append((revlog_id, ease, revlog_type, factor))
+
+        for cid, entries in entries_per_card.items():
+            deck_config = deck_configs.get(dids[cid])
+            if deck_config.preset_id not in models:
+                w = fill_parameters(deck_config.fsrs_params)
+                models[deck_config.preset_id] = (
+                    FSRSModel(w)
+                    if REPLAY_LOCALLY
+                    and w is not None
+                    and not deck_config.ignore_revlogs_before_date
+                    else None
+                )
+            model = models[deck_config.preset_id]
+            reviews = reviews_for_fsrs(entries, today, day_cutoff) if model else None
+            if reviews:
+                stability, difficulty = model.replay(reviews)
+                memory_states[cid] = MemoryState(stability, difficulty, model.w[20])
+            else:
+                memory_states[cid] = mw.col.compute_memory_state(cid)
+    return memory_states
@@ -12,10 +12,14 @@ zip -r "$OUT_ZIP" \
     utils.py \
     dsr_state.py \
     sync_hook.py \
+    jobs.py \
     stats.py \
     configuration.py \
     i18n.py \
     steps.py \
+    memory_state.py \
+    core/ \
+    profiler.py \
     browser/__init__.py \
     browser/browser.py \
     browser/custom_columns.py \
@@ -0,0 +1,156 @@
+"""Opt-in timing of the phases of the scheduling operations.
+
+With the `profile_operations` option on, every operation decorated with
+`profiled` appends one JSON line to `user_files/profile.jsonl`, with the
+wall and CPU seconds and the number of items of each phase. Code shared by
+the operations marks its phases with `profile_phase`, which does nothing
+when no operation is being profiled.
+
+Time spent in a phase nested in another one only counts towards the inner
+phase, so the phases of a line add up to its total. Time outside of any
+phase is reported as "other".
+"""
+
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from aqt import mw
+
+from .configuration import Config
+
+SQL = "sql"
+CONFIG = "config"
+REVLOG = "revlog"
+MEMORY_STATE = "memory_state"
+LOAD_BALANCE = "load_balance"
+CUSTOM_DATA = "custom_data"
+UPDATE_CARDS = "update_cards"
+# waiting for the user to answer a dialog
+PROMPT = "prompt"
+OTHER = "other"
+
+
+class Profiler:
+    """Wall and CPU time of the phases of one operation.
+
+    CPU time is that of the calling thread, since the operations run on a
+    background thread next to the UI.
+    """
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.started = datetime.now()
+        self.wall: Dict[str, float] = defaultdict(float)
+        self.cpu: Dict[str, float] = defaultdict(float)
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.stack: List[str] = [OTHER]
+        self.last_wall = time.perf_counter()
+        self.last_cpu = time.thread_time()
+
+    def _switch(self):
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        phase = self.stack[-1]
+        self.wall[phase] += wall - self.last_wall
+        self.cpu[phase] += cpu - self.last_cpu
+        self.last_wall = wall
+        self.last_cpu = cpu
+
+    @contextmanager
+    def phase(self, name: str, count: int = 0):
+        self._switch()
+        self.stack.append(name)
+        self.counts[name] += count
+        try:
+            yield
+        finally:
+            self._switch()
+            self.stack.pop()
+
+    def count(self, name: str, count: int = 1):
+        self.counts[name] += count
+
+    def record(self) -> dict:
+        self._switch()
+        phases = {
+            name: {
+                "wall": round(self.wall[name], 6),
+                "cpu": round(self.cpu[name], 6),
+                "count": self.counts.get(name, 0),
+            }
+            for name in sorted(set(self.wall) | set(self.counts))
+        }
+        return {
+            "operation": self.operation,
+            "started": self.started.isoformat(timespec="seconds"),
+            "profile": mw.pm.name,
+            "wall": round(sum(self.wall.values()), 6),
+            "cpu": round(sum(self.cpu.values()), 6),
+            "phases": phases,
+        }
+
+
+# operations on different threads are profiled separately
+_state = threading.local()
+
+
+def _active() -> Optional[Profiler]:
+    return getattr(_state, "profiler", None)
+
+
+def profile_path() -> Path:
+    addon = mw.addonManager.addonFromModule(__name__)
+    user_files = Path(mw.addonManager.addonsFolder(addon)) / "user_files"
+    user_files.mkdir(parents=True, exist_ok=True)
+    return user_files / "profile.jsonl"
+
+
+def profile_phase(name: str, count: int = 0):
+    """Context manager that attributes the time it wraps to phase `name`."""
+    profiler = _active()
+    if profiler is None:
+        return nullcontext()
+    return profiler.phase(name, count)
+
+
+def profile_count(name: str, count: int = 1):
+    profiler = _active()
+    if profiler is not None:
+        profiler.count(name, count)
+
+
+def profiled(operation: str):
+    """Profile each call of the decorated function as `operation`.
+
+    Calls made while another operation is being profiled on the same thread
+    are part of that operation.
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if _active() is not None:
+                return function(*args, **kwargs)
+            config = Config()
+            config.load()
+            if not config.profile_operations:
+                return function(*args, **kwargs)
+            _state.profiler = Profiler(operation)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record = _state.profiler.record()
+                _state.profiler = None
+                with open(profile_path(), "a", encoding="utf-8") as file:
+                    file.write(json.dumps(record) + "\n")
+
+        return wrapper
+
+    return decorator
@@ -4,7 +4,9 @@ from anki.utils import ids2str
 from aqt.utils import tooltip, showWarning, getText
 from anki.stats import QUEUE_TYPE_REV
 from ..i18n import t
+from ..profiler import PROMPT, SQL, UPDATE_CARDS, profile_phase, profiled
 from ..utils import *
+from ..core.intervals import power_forgetting_curve
 
 
 def get_desired_advance_cnt_with_response(safe_cnt, did):
@@ -31,6 +33,7 @@ def get_desired_advance_cnt_with_response(safe_cnt, did):
     return (None, r)
 
 
+@profiled("advance")
 def advance(did):
     if not mw.col.get_config("fsrs"):
         tooltip(t("enable-fsrs-warning"))
@@ -40,29 +43,30 @@ def advance(did):
     if did is not None:
         did_list = ids2str(DM.deck_and_child_ids(did))
 
-    cards = mw.col.db.all(f"""
-        SELECT 
-            id, 
-            CASE WHEN odid==0
-            THEN did
-            ELSE odid
-            END,
-            ivl,
-            json_extract(data, '$.s'),
-            CASE WHEN odid==0
-            THEN {mw.col.sched.today} - (due - ivl)
-            ELSE {mw.col.sched.today} - (odue - ivl)
-            END,
-            json_extract(data, '$.dr'),
-            COALESCE(json_extract(data, '$.decay'), 0.5)
-        FROM cards
-        WHERE data != '' 
-        AND json_extract(data, '$.s') IS NOT NULL
-        AND json_extract(data, '$.dr') IS NOT NULL
-        AND due > {mw.col.sched.today}
-        AND queue = {QUEUE_TYPE_REV}
-        {"AND did IN %s" % did_list if did is not None else ""}
-    """)
+    with profile_phase(SQL):
+        cards = mw.col.db.all(f"""
+            SELECT 
+                id, 
+                CASE WHEN odid==0
+                THEN did
+                ELSE odid
+                END,
+                ivl,
+                json_extract(data, '$.s'),
+                CASE WHEN odid==0
+                THEN {mw.col.sched.today} - (due - ivl)
+                ELSE {mw.col.sched.today} - (odue - ivl)
+                END,
+                json_extract(data, '$.dr'),
+                COALESCE(json_extract(data, '$.decay'), 0.5)
+            FROM cards
+            WHERE data != '' 
+            AND json_extract(data, '$.s') IS NOT NULL
+            AND json_extract(data, '$.dr') IS NOT NULL
+            AND due > {mw.col.sched.today}
+            AND queue = {QUEUE_TYPE_REV}
+            {"AND did IN %s" % did_list if did is not None else ""}
+        """)
     # x[0]: cid
     # x[1]: did
     # x[2]: interval
@@ -101,7 +105,8 @@ def advance(did):
         )
     )
 
-    desired_advance_cnt, resp = get_desired_advance_cnt_with_response(safe_cnt, did)
+    with profile_phase(PROMPT):
+        desired_advance_cnt, resp = get_desired_advance_cnt_with_response(safe_cnt, did)
     if desired_advance_cnt is None:
         if resp:
             showWarning(t("advance-enter-number"))
@@ -116,23 +121,26 @@ def advance(did):
     prev_target_rs = []
     advanced_cards = []
     start_time = time.time()
+    last_review_index = LastReviewIndex(x[0] for x in cards[:desired_advance_cnt])
     undo_entry = mw.col.add_custom_undo_entry(t("advance"))
     for cid, did, ivl, stability, _, _, decay, _ in cards:
         if cnt >= desired_advance_cnt:
             break
 
-        card = mw.col.get_card(cid)
-        last_review, _ = get_last_review_date_and_interval(card)
+        with profile_phase(SQL, 1):
+            card = mw.col.get_card(cid)
+        last_review, _ = get_last_review_date_and_interval(card, last_review_index)
         new_ivl = mw.col.sched.today - last_review
-        card = update_card_due_ivl(card, new_ivl)
+        card = update_card_due_ivl(card, new_ivl, last_review_index)
         write_custom_data(card, "v", "advance")
         advanced_cards.append(card)
         prev_target_rs.append(power_forgetting_curve(ivl, stability, -decay))
         new_target_rs.append(power_forgetting_curve(new_ivl, stability, -decay))
         cnt += 1
 
-    mw.col.update_cards(advanced_cards)
-    mw.col.merge_undo_entries(undo_entry)
+    with profile_phase(UPDATE_CARDS, len(advanced_cards)):
+        mw.col.update_cards(advanced_cards)
+        mw.col.merge_undo_entries(undo_entry)
     result_text = t("advance-result-text", count=cnt)
     if len(new_target_rs) > 0 and len(prev_target_rs) > 0:
         result_text += t(
@@ -1,11 +1,89 @@
 import time
-from typing import Dict, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
 from anki.utils import ids2str
+from aqt.qt import QTimer
 from aqt.utils import tooltip
 from anki.cards import Card
 from ..i18n import t
 from ..configuration import Config
+from ..profiler import LOAD_BALANCE, SQL, UPDATE_CARDS, profile_phase, profiled
 from ..utils import *
+from ..core.disperse import disperse_due_dates, disperse_notes, due_range
+
+# notes per task of a worker process
+DISPERSE_SHARD_SIZE = 2000
+# time without answers before the siblings of the answered cards are dispersed
+REVIEW_DISPERSE_DELAY_MS = 1000
+
+
+class Sibling(NamedTuple):
+    """What dispersing needs to know about a review card, read without a Card."""
+
+    cid: int
+    nid: int
+    did: int
+    stability: float
+    decay: float
+    due: int
+    last_review: int
+    last_interval: int
+    desired_retention: float
+    max_ivl: int
+
+
+def load_siblings(
+    query: str,
+) -> Tuple[Dict[int, List[Sibling]], LastReviewIndex]:
+    """The review cards matching `query`, grouped by note.
+
+    One pass over the cards table and one over the revlog; the returned
+    index holds the last review of every card loaded.
+    """
+    with profile_phase(SQL):
+        rows = mw.col.db.all(f"""
+        SELECT
+            id,
+            nid,
+            CASE WHEN odid==0
+            THEN did
+            ELSE odid
+            END,
+            json_extract(data, '$.s'),
+            json_extract(data, '$.decay'),
+            CASE WHEN odid==0 THEN due ELSE odue END,
+            ivl
+        FROM cards
+        WHERE data != ''
+        AND json_extract(data, '$.s') IS NOT NULL
+        AND type = 2
+        AND queue != -1
+        {query}
+        """)
+    last_review_index = LastReviewIndex(row[0] for row in rows)
+    deck_configs = DeckConfigIndex()
+    nid_siblings = {}
+    for cid, nid, did, stability, decay, due, ivl in rows:
+        config = deck_configs.get(did)
+        # same fallback as LastReviewIndex.get for cards without reviews
+        last_review, last_interval = last_review_index.last_reviews.get(
+            cid, (due - ivl, 0)
+        )
+        nid_siblings.setdefault(nid, []).append(
+            Sibling(
+                cid,
+                nid,
+                did,
+                stability,
+                decay or 0.5,
+                due,
+                last_review,
+                last_interval,
+                config.desired_retention,
+                config.max_ivl,
+            )
+        )
+    return nid_siblings, last_review_index
 
 
 def get_siblings(did=None, filter_flag=False, filtered_nid_string=""):
@@ -16,18 +94,8 @@ def get_siblings(did=None, filter_flag=False, filtered_nid_string=""):
     if filter_flag:
         nid_query = f"AND nid IN {filtered_nid_string}"
 
-    siblings = mw.col.db.all(f"""
-    SELECT 
-        id,
-        nid,
-        CASE WHEN odid==0
-        THEN did
-        ELSE odid
-        END,
-        json_extract(data, '$.s'),
-        CASE WHEN odid==0 THEN due ELSE odue END
-    FROM cards
-    WHERE nid IN (
+    return load_siblings(f"""
+    AND nid IN (
         SELECT nid
         FROM cards
         WHERE type = 2
@@ -38,125 +106,88 @@ def get_siblings(did=None, filter_flag=False, filtered_nid_string=""):
         GROUP BY nid
         HAVING count(*) > 1
     )
-    AND data != ''
-    AND json_extract(data, '$.s') IS NOT NULL
-    AND type = 2
-    AND queue != -1
     {did_query if did is not None else ""}
     """)
-    nid_siblings_dict = {}
-    deck_config_cache = {}
-    for cid, nid, did, stability, due in siblings:
-        if nid not in nid_siblings_dict:
-            nid_siblings_dict[nid] = []
-
-        if did not in deck_config_cache:
-            deck_config_cache[did] = {
-                "dr": get_dr(mw.col.decks, did),
-                "max_ivl": mw.col.decks.config_dict_for_deck_id(did)["rev"]["maxIvl"],
-            }
-
-        config = deck_config_cache[did]
-        nid_siblings_dict[nid].append(
-            (
-                cid,
-                did,
-                stability,
-                due,
-                config["dr"],
-                config["max_ivl"],
-            )
-        )
-    return nid_siblings_dict
-
-
-def get_siblings_when_review(card: Card):
-    siblings = mw.col.db.all(f"""
-    SELECT 
-        id,
-        CASE WHEN odid==0
-        THEN did
-        ELSE odid
-        END,
-        json_extract(data, '$.s'),
-        CASE WHEN odid==0 THEN due ELSE odue END
-    FROM cards
-    WHERE nid = {card.nid}
-    AND data != ''
-    AND json_extract(data, '$.s') IS NOT NULL
-    AND type = 2
-    AND queue != -1
-    """)
-    siblings = map(
-        lambda x: (
-            x
-            + [
-                get_dr(mw.col.decks, x[1]),
-                mw.col.decks.config_dict_for_deck_id(x[1])["rev"]["maxIvl"],
-            ]
-        ),
-        siblings,
+
+
+def due_range_args(sibling: Sibling) -> tuple:
+    """The arguments of `due_range` for `sibling`, but `today`."""
+    return (
+        sibling.stability,
+        sibling.due,
+        sibling.desired_retention,
+        sibling.max_ivl,
+        -sibling.decay,
+        sibling.last_review,
+        sibling.last_interval,
     )
-    return list(siblings)
-
-
-def get_due_range(cid, stability, due, desired_retention, maximum_interval):
-    card = mw.col.get_card(cid)
-    last_review, last_interval = get_last_review_date_and_interval(card)
-    new_ivl = next_interval(stability, desired_retention, -get_decay(card))
-
-    if new_ivl <= 2.5:
-        return (due, due), last_review
-
-    min_ivl, max_ivl = get_fuzz_range(new_ivl, last_interval, maximum_interval)
-
-    # If the card is currently scheduled outside the fuzz range, don't reschedule the card to bring it within the fuzz range.
-    # Rather, create a new fuzz range around the original due date. Users can use `reschedule` to bring the card in range.
-    if (
-        due > last_review + max_ivl + 2
-    ):  # +2 is just a safeguard to exclude cards that go beyond the fuzz range due to rounding
-        current_ivl = due - last_review
-        # set maximum_interval = current_ivl to prevent a further increase in ivl
-        min_ivl, max_ivl = get_fuzz_range(current_ivl, last_interval, current_ivl)
-
-    if (
-        due < last_review + min_ivl - 2
-    ):  # +2 is just a safeguard to exclude cards that go beyond the fuzz range due to rounding
-        current_ivl = due - last_review
-        min_ivl, max_ivl = get_fuzz_range(current_ivl, last_interval, maximum_interval)
-        # Prevent a further decrease in ivl because it is already lower than the optimal range
-        min_ivl = max(current_ivl, min_ivl)
-
-    if due >= mw.col.sched.today:
-        due_range = (
-            max(last_review + min_ivl, mw.col.sched.today),
-            max(last_review + max_ivl, mw.col.sched.today),
-        )
-    elif last_review + max_ivl > mw.col.sched.today:
-        due_range = (mw.col.sched.today, last_review + max_ivl)
-    else:
-        due_range = (due, due)
-    return due_range, last_review
 
 
-def disperse(siblings):
-    due_ranges_last_review = {
-        cid: get_due_range(cid, stability, due, dr, max_ivl)
-        for cid, _, stability, due, dr, max_ivl in siblings
-    }
-    due_ranges = {
-        cid: due_range for cid, (due_range, _) in due_ranges_last_review.items()
-    }
-    last_review = {
-        cid: last_review for cid, (_, last_review) in due_ranges_last_review.items()
-    }
-    latest_review = max(last_review.values())
-    due_ranges[-1] = (latest_review, latest_review)
-    min_gap, best_due_dates = maximize_siblings_due_gap(due_ranges)
-    best_due_dates.pop(-1)
+def get_due_range(sibling: Sibling):
+    return due_range(*due_range_args(sibling), mw.col.sched.today)
+
+
+def disperse(siblings: List[Sibling]):
+    due_ranges = {sibling.cid: get_due_range(sibling) for sibling in siblings}
+    last_review = {sibling.cid: sibling.last_review for sibling in siblings}
+    min_gap, best_due_dates = disperse_due_dates(due_ranges, last_review)
     return best_due_dates, due_ranges, min_gap
 
 
+def _disperse_shard(task) -> Dict[int, int]:
+    """Disperse the siblings of a share of the notes in a worker process."""
+    today, notes = task
+    return disperse_notes(notes, today)
+
+
+def iter_best_due_dates(
+    notes: List[List[Sibling]], workers: int
+) -> Iterator[Tuple[int, Dict[int, int]]]:
+    """Yield a number of `notes` and the new due dates of their siblings, in order.
+
+    With more than one worker where `worker_pool_context` allows them, the
+    notes are dispersed in shards of `DISPERSE_SHARD_SIZE` by a process pool;
+    the due dates are the same as those of a serial run. Closing the iterator early drops the
+    shards that have not started yet.
+    """
+    mp_context = worker_pool_context()
+    if workers <= 1 or len(notes) <= DISPERSE_SHARD_SIZE or mp_context is None:
+        for siblings in notes:
+            with profile_phase(LOAD_BALANCE, len(siblings)):
+                best_due_dates, _, _ = disperse(siblings)
+            yield 1, best_due_dates
+        return
+
+    today = mw.col.sched.today
+    shards = [
+        notes[start : start + DISPERSE_SHARD_SIZE]
+        for start in range(0, len(notes), DISPERSE_SHARD_SIZE)
+    ]
+    executor = ProcessPoolExecutor(
+        max_workers=min(workers, len(shards)), mp_context=mp_context
+    )
+    try:
+        futures = [
+            executor.submit(
+                _disperse_shard,
+                (
+                    today,
+                    [
+                        [(sibling.cid, *due_range_args(sibling)) for sibling in note]
+                        for note in shard
+                    ],
+                ),
+            )
+            for shard in shards
+        ]
+        for shard, future in zip(shards, futures):
+            with profile_phase(LOAD_BALANCE, sum(map(len, shard))):
+                best_due_dates = future.result()
+            yield len(shard), best_due_dates
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
 def disperse_siblings(
     did, filter_flag=False, filtered_nid_string="", text_from_reschedule=""
 ):
@@ -189,34 +220,57 @@ def disperse_siblings(
     return fut
 
 
+@profiled("disperse_siblings")
 def disperse_siblings_background(
-    did, filter_flag=False, filtered_nid_string="", text_from_reschedule=""
+    did,
+    filter_flag=False,
+    filtered_nid_string="",
+    text_from_reschedule="",
+    show_progress=True,
+    should_stop: Optional[Callable[[], bool]] = None,
 ):
-    nid_siblings = get_siblings(did, filter_flag, filtered_nid_string)
+    # a job step passes `should_stop`; see `reschedule_background`
+    nid_siblings, last_review_index = get_siblings(
+        did, filter_flag, filtered_nid_string
+    )
     sibilings_cnt = len(nid_siblings)
 
-    mw.taskman.run_on_main(
-        lambda: mw.progress.start(
-            label=t("disperse-label"), max=sibilings_cnt, immediate=True
+    if show_progress:
+        mw.taskman.run_on_main(
+            lambda: mw.progress.start(
+                label=t("disperse-label"), max=sibilings_cnt, immediate=True
+            )
         )
-    )
 
     card_cnt = 0
     note_cnt = 0
+    next_progress = 500
     dispersed_cards = []
-    undo_entry = mw.col.add_custom_undo_entry(t("disperse-siblings"))
-    for nid, siblings in nid_siblings.items():
-        best_due_dates, _, _ = disperse(siblings)
+    last_reviews = {
+        sibling.cid: sibling.last_review
+        for siblings in nid_siblings.values()
+        for sibling in siblings
+    }
+    changes = CardChanges()
+    config = Config()
+    config.load()
+    if should_stop is None:
+        undo_entry = mw.col.add_custom_undo_entry(t("disperse-siblings"))
+    for notes_done, best_due_dates in iter_best_due_dates(
+        list(nid_siblings.values()), config.disperse_workers
+    ):
         for cid, due in best_due_dates.items():
-            card = mw.col.get_card(cid)
-            last_review, _ = get_last_review_date_and_interval(card)
-            card = update_card_due_ivl(card, due - last_review)
+            with profile_phase(SQL, 1):
+                card = changes.get_card(cid)
+            card = update_card_due_ivl(card, due - last_reviews[cid], last_review_index)
             write_custom_data(card, "v", "disperse")
-            dispersed_cards.append(card)
+            if changes.changed(card):
+                dispersed_cards.append(card)
             card_cnt += 1
-        note_cnt += 1
+        note_cnt += notes_done
 
-        if note_cnt % 500 == 0:
+        if note_cnt >= next_progress and show_progress:
+            next_progress = note_cnt + 500
             mw.taskman.run_on_main(
                 lambda: mw.progress.update(
                     label=t(
@@ -228,155 +282,152 @@ def disperse_siblings_background(
             )
             if mw.progress.want_cancel():
                 break
+        if should_stop is not None and should_stop():
+            break
 
-    mw.col.update_cards(dispersed_cards)
-    mw.col.merge_undo_entries(undo_entry)
+    if should_stop is None:
+        with profile_phase(UPDATE_CARDS, len(dispersed_cards)):
+            mw.col.update_cards(dispersed_cards)
+            mw.col.merge_undo_entries(undo_entry)
+    else:
+        writer = CardWriter(None, job_undo_name=t("disperse-siblings"))
+        for card in dispersed_cards:
+            writer.add(card)
+        writer.finish()
     return f"{text_from_reschedule + ', ' if text_from_reschedule != '' else ''}{card_cnt} {t('disperse-cards-in')} {note_cnt} {t('disperse-notes')}"
 
 
-def disperse_siblings_when_review(reviewer, card: Card, ease):
-    if not mw.col.get_config("fsrs"):
-        tooltip(t("enable-fsrs-warning"))
-        return
+class ReviewDisperser:
+    """Disperses the siblings of answered cards shortly after the answers.
 
-    config = Config()
-    config.load()
-    if not config.auto_disperse_when_review:
-        return
-
-    siblings = get_siblings_when_review(card)
-
-    if len(siblings) <= 1:
-        return
-
-    messages = []
+    Answering a card only records its note. Once no card has been answered
+    for `REVIEW_DISPERSE_DELAY_MS`, the recorded notes are dispersed together
+    in the background, and the cards are written on the main thread as part
+    of the undo step of the last answer, so undoing it also undoes the
+    dispersal. Cards that were reviewed in the meantime are left alone.
+    """
 
-    card_cnt = 0
-    dispersed_cards = []
-    last_undo_step = mw.col.undo_status().last_step
-    best_due_dates, due_ranges, min_gap = disperse(siblings)
-
-    for cid, due in best_due_dates.items():
-        card = mw.col.get_card(cid)
-        old_due = card.odue if card.odid else card.due
-        last_review, _ = get_last_review_date_and_interval(card)
-        card = update_card_due_ivl(card, due - last_review)
-        write_custom_data(card, "v", "disperse")
-        dispersed_cards.append(card)
-        card_cnt += 1
-        message = t(
-            "disperse-card-message",
-            card_id=card.id,
-            old_due=due_to_date_str(old_due),
-            new_due=due_to_date_str(due),
+    def __init__(self):
+        # nid: the answered card, its reps after the answer and the undo step
+        self.answers: Dict[int, Tuple[int, int, int]] = {}
+        self.running = False
+        self.timer = QTimer(mw)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.flush)
+
+    def on_answer(self, reviewer, card: Card, ease):
+        if not mw.col.get_config("fsrs"):
+            tooltip(t("enable-fsrs-warning"))
+            return
+
+        config = Config()
+        config.load()
+        if not config.auto_disperse_when_review:
+            return
+
+        self.answers[card.nid] = (card.id, card.reps, mw.col.undo_status().last_step)
+        self.timer.start(REVIEW_DISPERSE_DELAY_MS)
+
+    def flush(self):
+        if not self.answers or mw.col is None:
+            return
+        if self.running:
+            self.timer.start(REVIEW_DISPERSE_DELAY_MS)
+            return
+
+        answers, self.answers = self.answers, {}
+        self.running = True
+        mw.taskman.run_in_background(
+            lambda: disperse_answered_notes(list(answers)),
+            lambda future: self.write(future, answers),
         )
-        messages.append(message)
-
-    mw.col.update_cards(dispersed_cards)
-    mw.col.merge_undo_entries(last_undo_step)
-
-    if config.debug_notify:
-        text = ""
-        if min_gap == 0:
-            for cid, due_range in due_ranges.items():
-                text += (
-                    t(
-                        "disperse-card-range",
-                        card_id=cid,
-                        start_due=due_to_date_str(due_range[0]),
-                        end_due=due_to_date_str(due_range[1]),
-                    )
-                    + "<br/>"
-                )
-            text = t("disperse-too-close") + "<br/>" + text
-        tooltip(text + "<br/>".join(messages))
 
+    def write(self, future, answers: Dict[int, Tuple[int, int, int]]):
+        self.running = False
+        dispersed_cards, text = future.result()
+        if mw.col is None:
+            return
 
-# Modifying the algorithm to accept a dictionary as input and return a dictionary as output
-def maximize_siblings_due_gap(points_dict: Dict[int, Tuple[int, int]]):
-    """
-    Function to find the arrangement that maximizes the gaps between adjacent points
-    while maintaining the maximum minimum gap. Accepts and returns dictionaries.
+        answered_cids = ids2str(cid for cid, _, _ in answers.values())
+        reps = dict(
+            mw.col.db.all(f"SELECT id, reps FROM cards WHERE id IN {answered_cids}")
+        )
+        # notes whose answer was undone meanwhile
+        undone = {
+            nid
+            for nid, (cid, answer_reps, _) in answers.items()
+            if reps.get(cid, 0) < answer_reps
+        }
+        dispersed_cids = ids2str(card.id for card in dispersed_cards)
+        current = {
+            cid: (mod, card_reps)
+            for cid, mod, card_reps in mw.col.db.all(
+                f"SELECT id, mod, reps FROM cards WHERE id IN {dispersed_cids}"
+            )
+        }
+        dispersed_cards = [
+            card
+            for card in dispersed_cards
+            if card.nid not in undone and current.get(card.id) == (card.mod, card.reps)
+        ]
+        if dispersed_cards:
+            last_step = mw.col.undo_status().last_step
+            if last_step not in {step for _, _, step in answers.values()}:
+                last_step = mw.col.add_custom_undo_entry(t("disperse-siblings"))
+            mw.col.update_cards(dispersed_cards)
+            mw.col.merge_undo_entries(last_step)
+
+        if text:
+            tooltip(text)
+
+
+def disperse_answered_notes(nids: List[int]) -> Tuple[List[Card], str]:
+    """The dispersed siblings of the notes `nids`, not written yet.
+
+    Also returns the text of the `debug_notify` tooltip, or "" when it is off.
     """
-    # Convert the dictionary to a list of tuples and also keep track of the original keys
-    points_list = [(k, v) for k, v in points_dict.items()]
-
-    # Sort the list based on the right endpoints of the intervals
-    points_list.sort(key=lambda x: x[1][1])
-
-    # First, find the maximum minimum gap and the arrangement that achieves it
-    intervals_only = [interval for _, interval in points_list]
-    max_min_gap, initial_arrangement = find_max_min_gap_and_arrangement(intervals_only)
-
-    # Initialize the optimized arrangement with the initial arrangement
-    optimized_arrangement = initial_arrangement.copy()
-
-    # Go through each point to try to maximize the gap with its adjacent points
-    for i in range(len(points_list)):
-        left_limit, right_limit = points_list[i][1]
-
-        # Set initial boundaries based on the previous and next points in the arrangement
-        if i > 0:
-            left_limit = max(left_limit, optimized_arrangement[i - 1] + max_min_gap)
-        if i < len(points_list) - 1:
-            right_limit = min(right_limit, optimized_arrangement[i + 1] - max_min_gap)
-
-        # Move the point as far to the right as possible within the adjusted limits
-        optimized_arrangement[i] = right_limit
-
-    # Convert the list back to a dictionary
-    optimized_arrangement_dict = {
-        points_list[i][0]: optimized_arrangement[i] for i in range(len(points_list))
-    }
-
-    return max_min_gap, optimized_arrangement_dict
-
+    config = Config()
+    config.load()
+    nid_siblings, last_review_index = load_siblings(f"AND nid IN {ids2str(nids)}")
 
-def find_max_min_gap_and_arrangement(points):
-    """
-    Find the maximum minimum gap between adjacent points and also return the arrangement that achieves it.
-    """
-    # Sort the points based on their right endpoints
-    points.sort(key=lambda x: x[1])
-
-    # Initialize binary search parameters
-    min_gap = 0  # Minimum possible gap
-    max_gap = points[-1][1] - points[0][0]  # Maximum possible gap
-    best_gap = 0  # To store the result
-
-    arrangement = []  # To store the best arrangement of points
-
-    def can_place_points_with_arrangement(points, min_gap):
-        """
-        A greedy algorithm to check if we can place all points with a minimum gap of `min_gap`.
-        Also returns the arrangement if possible.
-        """
-        last_point_position = points[0][
-            0
-        ]  # Place the first point at its leftmost position
-        temp_arrangement = [last_point_position]
-        for i in range(1, len(points)):
-            next_possible_point = last_point_position + min_gap
-            # Find the rightmost position in the current point's range where it can be placed
-            if next_possible_point > points[i][1]:
-                return (
-                    False,
-                    [],
-                )  # Can't place the point while maintaining the minimum gap
-            last_point_position = max(next_possible_point, points[i][0])
-            temp_arrangement.append(last_point_position)
-        return True, temp_arrangement
-
-    while min_gap <= max_gap:
-        mid_gap = (min_gap + max_gap) // 2  # Compute the middle gap
-        can_place, temp_arrangement = can_place_points_with_arrangement(points, mid_gap)
-        if can_place:
-            # If we can place all points with this gap, it means we can try to increase it
-            best_gap = mid_gap
-            arrangement = temp_arrangement  # Update the best arrangement
-            min_gap = mid_gap + 1
-        else:
-            # If we can't place all points with this gap, it means we need to try a smaller gap
-            max_gap = mid_gap - 1
-
-    return best_gap, arrangement
+    texts = []
+    dispersed_cards = []
+    changes = CardChanges()
+    for siblings in nid_siblings.values():
+        if len(siblings) <= 1:
+            continue
+
+        messages = []
+        best_due_dates, due_ranges, min_gap = disperse(siblings)
+        last_reviews = {sibling.cid: sibling.last_review for sibling in siblings}
+        for cid, due in best_due_dates.items():
+            card = changes.get_card(cid)
+            old_due = card.odue if card.odid else card.due
+            card = update_card_due_ivl(card, due - last_reviews[cid], last_review_index)
+            write_custom_data(card, "v", "disperse")
+            if changes.changed(card):
+                dispersed_cards.append(card)
+            message = t(
+                "disperse-card-message",
+                card_id=card.id,
+                old_due=due_to_date_str(old_due),
+                new_due=due_to_date_str(due),
+            )
+            messages.append(message)
+
+        if config.debug_notify:
+            text = ""
+            if min_gap == 0:
+                for cid, due_range in due_ranges.items():
+                    text += (
+                        t(
+                            "disperse-card-range",
+                            card_id=cid,
+                            start_due=due_to_date_str(due_range[0]),
+                            end_due=due_to_date_str(due_range[1]),
+                        )
+                        + "<br/>"
+                    )
+                text = t("disperse-too-close") + "<br/>" + text
+            texts.append(text + "<br/>".join(messages))
+    return dispersed_cards, "<br/>".join(texts)
@@ -6,7 +6,10 @@ from anki.stats import QUEUE_TYPE_REV
 from aqt.utils import tooltip, showWarning, getText
 from ..i18n import t
 from ..configuration import Config
+from ..profiler import SQL, UPDATE_CARDS, profile_phase, profiled
 from ..utils import *
+from ..core.flatten import flatten_due_dates
+from ..core.intervals import power_forgetting_curve
 
 
 def get_desired_flatten_limit_with_response(did):
@@ -46,6 +49,7 @@ def flatten(did):
     return fut
 
 
+@profiled("flatten")
 def flatten_background(did, desired_flatten_limit):
     start_time = time.time()
     config = Config()
@@ -59,71 +63,74 @@ def flatten_background(did, desired_flatten_limit):
     current_date = sched_current_date()
     true_due = "CASE WHEN odid==0 THEN due ELSE odue END"
 
-    cards_exceed_future = mw.col.db.all(f"""
-    SELECT rc.id, rc.true_due, rc.stability
-    FROM (
-        SELECT id,
-            true_due,
-            stability,
-            ROW_NUMBER() OVER (
-                PARTITION BY true_due
-                ORDER BY stability
-            ) AS rank
+    with profile_phase(SQL):
+        cards_exceed_future = mw.col.db.all(f"""
+        SELECT rc.id, rc.true_due, rc.stability
         FROM (
             SELECT id,
-                {true_due} AS true_due,
-                json_extract(data, '$.s') AS stability
+                true_due,
+                stability,
+                ROW_NUMBER() OVER (
+                    PARTITION BY true_due
+                    ORDER BY stability
+                ) AS rank
+            FROM (
+                SELECT id,
+                    {true_due} AS true_due,
+                    json_extract(data, '$.s') AS stability
+                FROM cards
+                WHERE true_due >= {today}
+                AND data != ''
+                AND json_extract(data, '$.s') IS NOT NULL
+                AND queue = {QUEUE_TYPE_REV}
+                {"AND did IN %s" % did_list if did is not None else ""}
+            ) AS subquery
+        ) AS rc
+        JOIN (
+            SELECT {true_due} AS true_due
             FROM cards
             WHERE true_due >= {today}
+            AND queue = {QUEUE_TYPE_REV}
             AND data != ''
             AND json_extract(data, '$.s') IS NOT NULL
-            AND queue = {QUEUE_TYPE_REV}
             {"AND did IN %s" % did_list if did is not None else ""}
-        ) AS subquery
-    ) AS rc
-    JOIN (
-        SELECT {true_due} AS true_due
+            GROUP BY true_due
+            HAVING COUNT(*) > {desired_flatten_limit}
+        ) AS overdue ON rc.true_due = overdue.true_due
+        WHERE rc.rank > {desired_flatten_limit}
+        ORDER BY rc.true_due
+            """)
+
+        cards_backlog = mw.col.db.all(f"""
+        SELECT id,
+            {true_due} AS true_due,
+            json_extract(data, '$.s') AS stability
         FROM cards
-        WHERE true_due >= {today}
-        AND queue = {QUEUE_TYPE_REV}
-        AND data != ''
+        WHERE true_due < {today}
+        AND data != '' 
         AND json_extract(data, '$.s') IS NOT NULL
+        AND queue = {QUEUE_TYPE_REV}
         {"AND did IN %s" % did_list if did is not None else ""}
-        GROUP BY true_due
-        HAVING COUNT(*) > {desired_flatten_limit}
-    ) AS overdue ON rc.true_due = overdue.true_due
-    WHERE rc.rank > {desired_flatten_limit}
-    ORDER BY rc.true_due
+        ORDER BY stability
         """)
 
-    cards_backlog = mw.col.db.all(f"""
-    SELECT id,
-        {true_due} AS true_due,
-        json_extract(data, '$.s') AS stability
-    FROM cards
-    WHERE true_due < {today}
-    AND data != '' 
-    AND json_extract(data, '$.s') IS NOT NULL
-    AND queue = {QUEUE_TYPE_REV}
-    {"AND did IN %s" % did_list if did is not None else ""}
-    ORDER BY stability
-    """)
-
     cards_to_flatten = cards_backlog + cards_exceed_future
     total_cnt = len(cards_to_flatten)
-
-    due_cnt_per_day = defaultdict(
-        int,
-        {
-            day: cnt
-            for day, cnt in mw.col.db.all(f"""SELECT {true_due} AS true_due, count() 
-                        FROM cards 
-                        WHERE true_due >= {today}
-                        AND queue = {QUEUE_TYPE_REV}
-                        {"AND did IN %s" % did_list if did is not None else ""}
-                        GROUP BY {true_due}""")
-        },
-    )
+    last_review_index = LastReviewIndex(cid for cid, _, _ in cards_to_flatten)
+
+    with profile_phase(SQL):
+        due_cnt_per_day = defaultdict(
+            int,
+            {
+                day: cnt
+                for day, cnt in mw.col.db.all(f"""SELECT {true_due} AS true_due, count() 
+                            FROM cards 
+                            WHERE true_due >= {today}
+                            AND queue = {QUEUE_TYPE_REV}
+                            {"AND did IN %s" % did_list if did is not None else ""}
+                            GROUP BY {true_due}""")
+            },
+        )
 
     mw.taskman.run_on_main(
         lambda: mw.progress.start(
@@ -131,49 +138,39 @@ def flatten_background(did, desired_flatten_limit):
         )
     )
     cnt = 0
-    cancelled = False
     new_target_rs = []
     prev_target_rs = []
     flattened_cards = []
     undo_entry = mw.col.add_custom_undo_entry(t("flatten"))
-    for new_due in range(today, today + 36500):
-        if cancelled:
-            break
-        rest_cnt = len(cards_to_flatten) - cnt
-        if rest_cnt <= 0:
-            break
-        # due_date = current_date + timedelta(days=new_due - today)
-        due_cnt = due_cnt_per_day[new_due]
-        quota = desired_flatten_limit - due_cnt
-        if quota <= 0:
-            continue
-        start_index = cnt
-        end_index = cnt + min(quota, rest_cnt)
-        for cid, _, ivl in cards_to_flatten[start_index:end_index]:
+    for (cid, _, ivl), new_due in flatten_due_dates(
+        cards_to_flatten, due_cnt_per_day, desired_flatten_limit, today
+    ):
+        with profile_phase(SQL, 1):
             card = mw.col.get_card(cid)
-            last_review, _ = get_last_review_date_and_interval(card)
-            new_ivl = new_due - last_review
-            card = update_card_due_ivl(card, new_ivl)
-            write_custom_data(card, "v", "flatten")
-            flattened_cards.append(card)
-            stability = card.memory_state.stability
-            decay = get_decay(card)
-            prev_target_rs.append(power_forgetting_curve(ivl, stability, -decay))
-            new_target_rs.append(power_forgetting_curve(new_ivl, stability, -decay))
-            cnt += 1
-            if cnt % 500 == 0:
-                mw.taskman.run_on_main(
-                    lambda: mw.progress.update(
-                        label=t("flatten-progress", count=cnt, total=total_cnt),
-                        value=cnt,
-                        max=total_cnt,
-                    )
+        last_review, _ = get_last_review_date_and_interval(card, last_review_index)
+        new_ivl = new_due - last_review
+        card = update_card_due_ivl(card, new_ivl, last_review_index)
+        write_custom_data(card, "v", "flatten")
+        flattened_cards.append(card)
+        stability = card.memory_state.stability
+        decay = get_decay(card)
+        prev_target_rs.append(power_forgetting_curve(ivl, stability, -decay))
+        new_target_rs.append(power_forgetting_curve(new_ivl, stability, -decay))
+        cnt += 1
+        if cnt % 500 == 0:
+            mw.taskman.run_on_main(
+                lambda: mw.progress.update(
+                    label=t("flatten-progress", count=cnt, total=total_cnt),
+                    value=cnt,
+                    max=total_cnt,
                 )
-                if mw.progress.want_cancel():
-                    cancelled = True
+            )
+            if mw.progress.want_cancel():
+                break
 
-    mw.col.update_cards(flattened_cards)
-    mw.col.merge_undo_entries(undo_entry)
+    with profile_phase(UPDATE_CARDS, len(flattened_cards)):
+        mw.col.update_cards(flattened_cards)
+        mw.col.merge_undo_entries(undo_entry)
     result_text = t(
         "flatten-result-text", count=cnt, seconds=f"{(time.time() - start_time):.2f}"
     )
@@ -1,4 +1,3 @@
-import random
 import time
 import math
 from anki.decks import DeckManager
@@ -6,7 +5,10 @@ from anki.utils import ids2str
 from anki.stats import QUEUE_TYPE_REV
 from aqt.utils import tooltip, showWarning, getText
 from ..i18n import t
+from ..profiler import SQL, UPDATE_CARDS, profile_phase, profiled
 from ..utils import *
+from ..core.intervals import power_forgetting_curve
+from ..core.load_balance import fuzz_random
 
 
 def get_desired_postpone_cnt_with_response(safe_cnt, did):
@@ -27,38 +29,40 @@ def get_desired_postpone_cnt_with_response(safe_cnt, did):
     return (None, r)
 
 
-def postpone(did):
-    if not mw.col.get_config("fsrs"):
-        tooltip(t("enable-fsrs-warning"))
-        return
+def get_postpone_candidates(did):
+    """Overdue review cards of `did`, the safest to postpone first.
 
+    Returns the cards and how many of them can be postponed safely.
+    """
     DM = DeckManager(mw.col)
+    deck_configs = DeckConfigIndex(DM)
     if did is not None:
         did_list = ids2str(DM.deck_and_child_ids(did))
 
-    cards = mw.col.db.all(f"""
-        SELECT 
-            id, 
-            CASE WHEN odid==0
-            THEN did
-            ELSE odid
-            END,
-            ivl,
-            json_extract(data, '$.s'),
-            CASE WHEN odid==0
-            THEN {mw.col.sched.today} - (due - ivl) + ivl * 0.075
-            ELSE {mw.col.sched.today} - (odue - ivl) + ivl * 0.075
-            END,
-            json_extract(data, '$.dr'),
-            COALESCE(json_extract(data, '$.decay'), 0.5)
-        FROM cards
-        WHERE data != ''
-        AND json_extract(data, '$.s') IS NOT NULL
-        AND json_extract(data, '$.dr') IS NOT NULL
-        AND due <= {mw.col.sched.today}
-        AND queue = {QUEUE_TYPE_REV}
-        {"AND did IN %s" % did_list if did is not None else ""}
-    """)
+    with profile_phase(SQL):
+        cards = mw.col.db.all(f"""
+            SELECT 
+                id, 
+                CASE WHEN odid==0
+                THEN did
+                ELSE odid
+                END,
+                ivl,
+                json_extract(data, '$.s'),
+                CASE WHEN odid==0
+                THEN {mw.col.sched.today} - (due - ivl) + ivl * 0.075
+                ELSE {mw.col.sched.today} - (odue - ivl) + ivl * 0.075
+                END,
+                json_extract(data, '$.dr'),
+                COALESCE(json_extract(data, '$.decay'), 0.5)
+            FROM cards
+            WHERE data != ''
+            AND json_extract(data, '$.s') IS NOT NULL
+            AND json_extract(data, '$.dr') IS NOT NULL
+            AND due <= {mw.col.sched.today}
+            AND queue = {QUEUE_TYPE_REV}
+            {"AND did IN %s" % did_list if did is not None else ""}
+        """)
     # x[0]: cid
     # x[1]: did
     # x[2]: interval
@@ -73,7 +77,7 @@ def postpone(did):
             x
             + [
                 power_forgetting_curve(max(x[4], 0), x[3], -x[6]),
-                DM.config_dict_for_deck_id(x[1])["rev"]["maxIvl"],
+                deck_configs.get(x[1]).max_ivl,
             ]
         ),
         cards,
@@ -97,7 +101,15 @@ def postpone(did):
             )
         )
     )
+    return cards, safe_cnt
+
+
+def postpone(did):
+    if not mw.col.get_config("fsrs"):
+        tooltip(t("enable-fsrs-warning"))
+        return
 
+    cards, safe_cnt = get_postpone_candidates(did)
     desired_postpone_cnt, resp = get_desired_postpone_cnt_with_response(safe_cnt, did)
     if desired_postpone_cnt is None:
         if resp:
@@ -108,36 +120,47 @@ def postpone(did):
             showWarning(t("postpone-positive-integer"))
             return
 
+    tooltip(postpone_background(did, desired_postpone_cnt, cards))
+    mw.reset()
+
+
+@profiled("postpone")
+def postpone_background(did, desired_postpone_cnt, cards=None):
+    if cards is None:
+        cards, _ = get_postpone_candidates(did)
     cnt = 0
     reach_max_ivl_cnt = 0
     new_target_rs = []
     prev_target_rs = []
     postponed_cards = []
     start_time = time.time()
+    last_review_index = LastReviewIndex(x[0] for x in cards[:desired_postpone_cnt])
     undo_entry = mw.col.add_custom_undo_entry(t("postpone"))
     for cid, did, ivl, stability, elapsed_days, _, decay, _, max_ivl in cards:
         if cnt >= desired_postpone_cnt:
             break
 
-        card = mw.col.get_card(cid)
-        random.seed(cid + ivl)
-        last_review, _ = get_last_review_date_and_interval(card)
+        with profile_phase(SQL, 1):
+            card = mw.col.get_card(cid)
+        last_review, _ = get_last_review_date_and_interval(card, last_review_index)
         elapsed_days = mw.col.sched.today - last_review
         delay = max(elapsed_days - ivl, 0)
         new_ivl = min(
-            max(1, math.ceil(ivl * (1.05 + 0.05 * random.random())) + delay), max_ivl
+            max(1, math.ceil(ivl * (1.05 + 0.05 * fuzz_random(cid, ivl))) + delay),
+            max_ivl,
         )
         if new_ivl <= ivl and new_ivl == max_ivl:
             reach_max_ivl_cnt += 1
-        card = update_card_due_ivl(card, new_ivl)
+        card = update_card_due_ivl(card, new_ivl, last_review_index)
         write_custom_data(card, "v", "postpone")
         postponed_cards.append(card)
         prev_target_rs.append(power_forgetting_curve(ivl, stability, -decay))
         new_target_rs.append(power_forgetting_curve(new_ivl, stability, -decay))
         cnt += 1
     cnt -= reach_max_ivl_cnt
-    mw.col.update_cards(postponed_cards)
-    mw.col.merge_undo_entries(undo_entry)
+    with profile_phase(UPDATE_CARDS, len(postponed_cards)):
+        mw.col.update_cards(postponed_cards)
+        mw.col.merge_undo_entries(undo_entry)
     result_text = t(
         "postpone-result-text", count=cnt, seconds=f"{(time.time() - start_time):.2f}"
     )
@@ -152,5 +175,4 @@ def postpone(did):
             prev_retention=f"{sum(prev_target_rs) / len(prev_target_rs):.2f}",
             new_retention=f"{sum(new_target_rs) / len(new_target_rs):.2f}",
         )
-    tooltip(result_text)
-    mw.reset()
+    return result_text
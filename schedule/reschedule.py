@@ -1,13 +1,14 @@
-import random
 import time
 from collections import defaultdict
-from datetime import date, datetime, timedelta
-from typing import Dict, List
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
 
-from anki.cards import Card, FSRSMemoryState
+from anki.cards import FSRSMemoryState
 from anki.decks import DeckManager
 from anki.stats import (
     CARD_TYPE_REV,
+    QUEUE_TYPE_LRN,
     QUEUE_TYPE_NEW,
     QUEUE_TYPE_PREVIEW,
     QUEUE_TYPE_SUSPENDED,
@@ -18,68 +19,63 @@ from aqt.gui_hooks import browser_menus_did_init
 from aqt.utils import tooltip
 
 from ..configuration import Config
+from ..core.intervals import (
+    in_threshold_band,
+    next_interval,
+    next_intervals,
+    threshold_retentions,
+)
+from ..core.load_balance import BalanceCard, LoadBalancer
 from ..i18n import t
+from ..memory_state import compute_memory_states
+from ..profiler import (
+    LOAD_BALANCE,
+    MEMORY_STATE,
+    SQL,
+    profile_phase,
+    profiled,
+)
 from ..utils import *
 from .disperse_siblings import disperse_siblings
 
+# about how many cards a run with a time budget reschedules per second
+BUDGET_CARDS_PER_SECOND = 2000
 
-def check_review_distribution(actual_reviews: List[int], percentages: List[float]):
-    easy_days_modifier = []
-    percentages = [p if p != 0 else 0.0001 for p in percentages]
-    possible_days_cnt = len(actual_reviews)
-    if possible_days_cnt <= 1:
-        return [1] * possible_days_cnt
-    total_review_count = sum(actual_reviews)
-    for p, review_count in zip(percentages, actual_reviews):
-        if p == 1:
-            easy_days_modifier.append(1)
-        elif p == 0.0001:
-            easy_days_modifier.append(0)
-        else:
-            other_days_count_total = total_review_count - review_count
-            other_days_p_total = sum(percentages) - p
-            if review_count / p >= other_days_count_total / other_days_p_total:
-                easy_days_modifier.append(0)
-            else:
-                easy_days_modifier.append(1)
-    return easy_days_modifier
 
+def budget_slice_size(time_budget: float) -> int:
+    """How many of the cards due soonest a run with `time_budget` takes on."""
+    return max(500, int(time_budget * BUDGET_CARDS_PER_SECOND))
 
-class FSRS:
+
+def load_balancer_enabled() -> bool:
+    # Version-specific load balancer check
+    anki_version = point_version()
+    if anki_version >= 250500:  # 25.05+
+        return mw.col._get_load_balancer_enabled()
+    elif anki_version >= 241100:  # 24.11+
+        return mw.col._get_enable_load_balancer()
+    else:  # Older versions
+        return False
+
+
+class FSRS(LoadBalancer):
     reschedule_threshold: float
-    maximum_interval: int
     desired_retention: float
-    easy_specific_due_dates: List[int]
-    due_cnt_per_day_per_preset: Dict[int, Dict[int, int]]
-    due_today_per_preset: Dict[int, int]
-    reviewed_today_per_preset: Dict[int, int]
-    card: Card
-    apply_easy_days: bool
-    current_date: date
-    today: int
+    card: CardSnapshot
     did: int
-    did_to_preset_id: Dict[int, int]
-    preset_id_to_easy_days_percentages: Dict[int, List[float]]
+    deck_configs: DeckConfigIndex
+    last_review_index: Optional[LastReviewIndex]
     load_balancer_enabled: bool
 
     def __init__(self) -> None:
+        super().__init__(mw.col.sched.today, sched_current_date())
         self.reschedule_threshold = 0
-        self.maximum_interval = 36500
         self.desired_retention = 0.9
-        self.easy_specific_due_dates = []
-        self.apply_easy_days = False
-        self.current_date = sched_current_date()
-        self.today = mw.col.sched.today
         self.DM = DeckManager(mw.col)
+        self.deck_configs = DeckConfigIndex(self.DM)
+        self.last_review_index = None
 
-        # Version-specific load balancer check
-        anki_version = point_version()
-        if anki_version >= 250500:  # 25.05+
-            self.load_balancer_enabled = mw.col._get_load_balancer_enabled()
-        elif anki_version >= 241100:  # 24.11+
-            self.load_balancer_enabled = mw.col._get_enable_load_balancer()
-        else:  # Older versions
-            self.load_balancer_enabled = False
+        self.load_balancer_enabled = load_balancer_enabled()
 
     def set_load_balance(self):
         true_due = "CASE WHEN odid==0 THEN due ELSE odue END"
@@ -91,28 +87,17 @@ class FSRS:
                 AND queue != -1
                 GROUP BY {original_did}, {true_due}""")
 
-        self.due_cnt_per_day_per_preset = defaultdict(lambda: defaultdict(int))
-        self.did_to_preset_id = {}
-        self.preset_id_to_easy_days_percentages = {}
-
         for did, due_date, count in deck_stats:
-            preset_id = self.DM.config_dict_for_deck_id(did)["id"]
-            self.due_cnt_per_day_per_preset[preset_id][due_date] += count
-            self.did_to_preset_id[did] = preset_id
-            self.preset_id_to_easy_days_percentages[preset_id] = (
-                self.DM.config_dict_for_deck_id(did).get("easyDaysPercentages", [])
+            deck_config = self.deck_configs.get(did)
+            preset_id = deck_config.preset_id
+            if due_date <= self.today:
+                self.due_today_per_preset[preset_id] += count
+            else:
+                self.due_cnt_per_day_per_preset[preset_id].add(due_date, count)
+            self.easy_days_percentages_per_preset[preset_id] = (
+                deck_config.easy_days_percentages
             )
 
-        self.due_today_per_preset = defaultdict(
-            int,
-            {
-                preset_id: sum(
-                    due_cnt for due, due_cnt in config_dues.items() if due <= self.today
-                )
-                for preset_id, config_dues in self.due_cnt_per_day_per_preset.items()
-            },
-        )
-
         reviewed_stats = mw.col.db.all(
             f"""SELECT {original_did}, count(distinct revlog.cid)
                 FROM revlog
@@ -124,78 +109,13 @@ class FSRS:
             """
         )
 
-        self.reviewed_today_per_preset = defaultdict(int)
-
         for did, count in reviewed_stats:
-            preset_id = self.DM.config_dict_for_deck_id(did)["id"]
+            preset_id = self.deck_configs.get(did).preset_id
             self.reviewed_today_per_preset[preset_id] += count
 
     @property
     def preset_id(self):
-        return self.did_to_preset_id[self.did]
-
-    @property
-    def due_cnt_per_day(self):
-        return self.due_cnt_per_day_per_preset[self.preset_id]
-
-    def update_due_cnt_per_day(self, due_before: int, due_after: int):
-        self.due_cnt_per_day_per_preset[self.preset_id][due_before] -= 1
-        self.due_cnt_per_day_per_preset[self.preset_id][due_after] += 1
-        if due_before <= self.today and due_after > self.today:
-            self.due_today -= 1
-        if due_before > self.today and due_after <= self.today:
-            self.due_today += 1
-
-    @property
-    def due_today(self):
-        return self.due_today_per_preset[self.preset_id]
-
-    @due_today.setter
-    def due_today(self, value):
-        self.due_today_per_preset[self.preset_id] = value
-
-    @property
-    def reviewed_today(self):
-        return self.reviewed_today_per_preset[self.preset_id]
-
-    @property
-    def easy_days_review_ratio_list(self):
-        easy_days_percentages = self.preset_id_to_easy_days_percentages[self.preset_id]
-        return easy_days_percentages if easy_days_percentages else [1] * 7
-
-    def set_fuzz_factor(self, cid: int, reps: int):
-        random.seed(rotate_number_by_k(cid, 8) + reps)
-        self.fuzz_factor = random.random()
-
-    def load_balance(
-        self,
-        possible_intervals: List[int],
-        review_cnts: List[int],
-        last_review: int,
-    ):
-        weights = [
-            1 if r == 0 else (1 / (r**2.15)) * (1 / (delta_t**3))
-            for r, delta_t in zip(review_cnts, possible_intervals)
-        ]
-
-        possible_dates = [
-            self.current_date + timedelta(days=(last_review + i - self.today))
-            for i in possible_intervals
-        ]
-        weekdays = [date.weekday() for date in possible_dates]
-
-        easy_days_modifier = check_review_distribution(
-            review_cnts, [self.easy_days_review_ratio_list[wd] for wd in weekdays]
-        )
-        for idx, ivl in enumerate(possible_intervals):
-            if last_review + ivl in self.easy_specific_due_dates:
-                easy_days_modifier[idx] = 0
-        final_weights = [w * m for w, m in zip(weights, easy_days_modifier)]
-
-        if sum(final_weights) > 0:
-            return random.choices(possible_intervals, weights=final_weights)[0]
-        else:
-            return random.choices(possible_intervals, weights=weights)[0]
+        return self.deck_configs.get(self.did).preset_id
 
     def apply_fuzz(self, ivl):
         if ivl < 2.5:
@@ -204,46 +124,270 @@ class FSRS:
         if not self.load_balancer_enabled and not self.easy_specific_due_dates:
             return ivl + mw.col.fuzz_delta(self.card.id, ivl)
 
-        last_review, last_interval = get_last_review_date_and_interval(self.card)
-        min_ivl, max_ivl = get_fuzz_range(ivl, last_interval, self.maximum_interval)
+        last_review, last_interval = get_last_review_date_and_interval(
+            self.card, self.last_review_index
+        )
+        return self.balanced_interval(
+            ivl, last_review, last_interval, self.card.true_due
+        )
 
-        # Load balance
-        due = self.card.odue if self.card.odid else self.card.due
+    def fuzzed_next_interval(self, stability, decay):
+        new_interval = next_interval(stability, self.desired_retention, decay)
+        return self.apply_fuzz(new_interval)
 
-        if self.apply_easy_days:
-            if due > last_review + max_ivl + 2:
-                current_ivl = due - last_review
-                min_ivl, max_ivl = get_fuzz_range(
-                    current_ivl, last_interval, current_ivl
-                )
+    def set_card(self, card: CardSnapshot):
+        self.card = card
 
-        if last_review + max_ivl < self.today:
-            return min(ivl, max_ivl)
+    def threshold_band_filter(self, card_filters: str) -> str:
+        """SQL condition dropping review cards that are surely inside the threshold band.
 
-        min_ivl = max(min_ivl, self.today - last_review)
+        The band's intervals are the stored stability times a coefficient per
+        (desired retention, decay), computed here for each pair among the
+        cards matching `card_filters`, so SQLite needs no math functions.
+        Cards whose rounded band edge could differ from `next_intervals` by
+        floating point error are kept for the exact check in
+        `batch_target_intervals`, so the rescheduled cards do not change.
+        """
+        original_did = "CASE WHEN odid==0 THEN did ELSE odid END"
+        stability = card_data_field("s")
+        decay = f"coalesce(nullif({card_data_field('decay')}, 0), 0.5)"
+        dids_per_band = defaultdict(list)
+        for did, card_decay in mw.col.db.all(f"""
+            SELECT DISTINCT {original_did}, {decay}
+            FROM cards
+            WHERE type = {CARD_TYPE_REV}
+            AND {stability} IS NOT NULL
+            {card_filters}
+        """):
+            desired_retention = self.deck_configs.get(did).desired_retention
+            dids_per_band[(desired_retention, card_decay)].append(did)
+
+        bands = []
+        for (desired_retention, card_decay), dids in dids_per_band.items():
+            dr_upper, dr_lower = threshold_retentions(
+                desired_retention, self.reschedule_threshold
+            )
+            factor = 0.9 ** (1 / -card_decay) - 1
+            lower = (dr_upper ** (1 / -card_decay) - 1) / factor
+            upper = (dr_lower ** (1 / -card_decay) - 1) / factor
+            bands.append(f"""(
+                {decay} = {card_decay!r}
+                AND {original_did} IN {ids2str(dids)}
+                AND {stability} * {lower!r} < ivl + 0.499999
+                AND {stability} * {upper!r} > ivl - 0.499999
+            )""")
+        if not bands:
+            return ""
+        return f"""AND NOT (
+            type = {CARD_TYPE_REV}
+            AND ivl >= 1
+            AND {stability} IS NOT NULL
+            AND ({" OR ".join(bands)})
+        )"""
+
+    def batch_target_intervals(
+        self, snapshots: List[CardSnapshot], check_threshold: bool
+    ):
+        """Evaluate the target interval of every review card in `snapshots` at once.
 
-        possible_intervals = list(range(min_ivl, max_ivl + 1))
-        review_cnts = []
-        for i in possible_intervals:
-            check_due = last_review + i
-            if check_due > self.today:
-                review_cnts.append(self.due_cnt_per_day[check_due])
-            else:
-                review_cnts.append(self.due_today + self.reviewed_today)
+        Returns the snapshots left to reschedule and their target intervals
+        keyed by card id. When `check_threshold` is set, review cards whose
+        interval lies inside the reschedule threshold band are dropped.
+        """
+        review_cards = [
+            snapshot
+            for snapshot in snapshots
+            if snapshot.type == CARD_TYPE_REV and snapshot.has_memory_state
+        ]
+        stabilities = [snapshot.stability for snapshot in review_cards]
+        retentions = [
+            self.deck_configs.get(snapshot.original_did).desired_retention
+            for snapshot in review_cards
+        ]
+        decays = [-get_decay(snapshot) for snapshot in review_cards]
+        target_ivls = dict(
+            zip(
+                (snapshot.id for snapshot in review_cards),
+                next_intervals(stabilities, retentions, decays),
+            )
+        )
+        if check_threshold:
+            in_band = in_threshold_band(
+                [snapshot.ivl for snapshot in review_cards],
+                stabilities,
+                retentions,
+                decays,
+                self.reschedule_threshold,
+            )
+            skipped_cids = {
+                snapshot.id for snapshot, skip in zip(review_cards, in_band) if skip
+            }
+            snapshots = [
+                snapshot for snapshot in snapshots if snapshot.id not in skipped_cids
+            ]
+        return snapshots, target_ivls
+
+
+def _balance_partition(partition) -> List[int]:
+    """Load balance the review cards of one preset.
+
+    Runs in a worker process, so `partition` only holds plain values: the
+    preset's load balancer state followed by the cards. Returns the new
+    interval of every card, in order.
+    """
+    (
+        today,
+        current_date,
+        apply_easy_days,
+        easy_specific_due_dates,
+        easy_days_percentages,
+        due_counts,
+        due_today,
+        reviewed_today,
+        global_balance,
+        cards,
+    ) = partition
+    balancer = LoadBalancer(today, current_date)
+    balancer.preset_id = 0
+    balancer.apply_easy_days = apply_easy_days
+    balancer.easy_specific_due_dates = easy_specific_due_dates
+    balancer.easy_days_percentages_per_preset[0] = easy_days_percentages
+    balancer.due_cnt_per_day.counts = due_counts
+    balancer.due_today = due_today
+    balancer.reviewed_today_per_preset[0] = reviewed_today
+    if global_balance:
+        return balancer.balance_globally(cards)
+    return balancer.balance_in_order(cards)
+
+
+def balance_presets(
+    fsrs: FSRS,
+    chunks: Iterable[Tuple[List[CardSnapshot], Dict[int, float]]],
+    workers: int,
+    global_balance: bool = False,
+) -> Dict[int, int]:
+    """Load balance the target intervals of `chunks` with one task per preset.
+
+    Presets share no load balancer state, so every preset can be handled by
+    its own worker process, and the new intervals equal those of a serial
+    run. Falls back to balancing in this process with a single worker or
+    where `worker_pool_context` allows no workers. With `global_balance`,
+    each preset's cards are placed together by `LoadBalancer.balance_globally`.
+    """
+    partitions = defaultdict(list)
+    for snapshots, target_ivls in chunks:
+        for snapshot in snapshots:
+            target_ivl = target_ivls.get(snapshot.id)
+            if target_ivl is None:
+                continue
+            deck_config = fsrs.deck_configs.get(snapshot.original_did)
+            last_review, last_interval = fsrs.last_review_index.get(snapshot)
+            partitions[deck_config.preset_id].append(
+                BalanceCard(
+                    cid=snapshot.id,
+                    reps=snapshot.reps,
+                    target_ivl=target_ivl,
+                    maximum_interval=deck_config.max_ivl,
+                    due=snapshot.true_due,
+                    last_review=last_review,
+                    last_interval=last_interval,
+                    reviewed=snapshot.id in fsrs.last_review_index,
+                )
+            )
 
-        best_ivl = self.load_balance(
-            possible_intervals,
-            review_cnts,
-            last_review,
+    preset_ids = list(partitions)
+    tasks = [
+        (
+            fsrs.today,
+            fsrs.current_date,
+            fsrs.apply_easy_days,
+            fsrs.easy_specific_due_dates,
+            fsrs.easy_days_percentages_per_preset.get(preset_id),
+            list(fsrs.due_cnt_per_day_per_preset[preset_id].counts),
+            fsrs.due_today_per_preset[preset_id],
+            fsrs.reviewed_today_per_preset[preset_id],
+            global_balance,
+            partitions[preset_id],
         )
-        return best_ivl
+        for preset_id in preset_ids
+    ]
+    mp_context = worker_pool_context()
+    if workers > 1 and len(tasks) > 1 and mp_context is not None:
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(tasks)), mp_context=mp_context
+        ) as executor:
+            results = list(executor.map(_balance_partition, tasks))
+    else:
+        results = list(map(_balance_partition, tasks))
+
+    new_ivls = {}
+    for preset_id, ivls in zip(preset_ids, results):
+        cids = (card.cid for card in partitions[preset_id])
+        new_ivls.update(zip(cids, ivls))
+    return new_ivls
+
+
+@dataclass
+class RescheduleSetup:
+    """What a reschedule run sets up before it looks at the cards.
+
+    That is the load balancer with the due counts of the whole collection,
+    and the cards left alone because they were rescheduled manually. The
+    budgeted runs that follow each other, like the steps of the backlog
+    job, share one while `key` says it still matches the collection.
+    """
+
+    fsrs: FSRS
+    manually_rescheduled: Set[int]
+    key: tuple
+
+
+def setup_key(config: Config, easy_specific_due_dates, apply_easy_days) -> tuple:
+    # the collection's mod changes with every card written, including the
+    # run's own cards; the run stores the mod after its writes
+    return (
+        id(mw.col),
+        mw.col.mod,
+        mw.col.sched.today,
+        load_balancer_enabled(),
+        tuple(config.easy_dates),
+        config.reschedule_set_due_date,
+        tuple(easy_specific_due_dates),
+        apply_easy_days,
+    )
 
-    def fuzzed_next_interval(self, stability, decay):
-        new_interval = next_interval(stability, self.desired_retention, decay)
-        return self.apply_fuzz(new_interval)
 
-    def set_card(self, card: Card):
-        self.card = card
+def prepare_reschedule(
+    config: Config, easy_specific_due_dates, apply_easy_days
+) -> RescheduleSetup:
+    fsrs = FSRS()
+    fsrs.apply_easy_days = apply_easy_days
+    fsrs.last_review_index = LastReviewIndex([])
+    if fsrs.load_balancer_enabled or easy_specific_due_dates:
+        with profile_phase(SQL):
+            fsrs.set_load_balance()
+        fsrs.easy_specific_due_dates = set(easy_specific_due_dates)
+
+        for easy_date_str in config.easy_dates:
+            easy_date = datetime.strptime(easy_date_str, "%Y-%m-%d").date()
+            specific_due = fsrs.today + (easy_date - fsrs.current_date).days
+            fsrs.easy_specific_due_dates.add(specific_due)
+
+    manually_rescheduled = set()
+    if not config.reschedule_set_due_date:
+        revlog_summary = RevlogSummaryCache()
+        revlog_summary.update()
+        manually_rescheduled = revlog_summary.manually_rescheduled_cids()
+        revlog_summary.close()
+    return RescheduleSetup(
+        fsrs,
+        manually_rescheduled,
+        setup_key(config, easy_specific_due_dates, apply_easy_days),
+    )
+
+
+# the setup of the last budgeted run, for the next one
+budget_setup: Optional[RescheduleSetup] = None
 
 
 def reschedule(
@@ -254,6 +398,7 @@ def reschedule(
     easy_specific_due_dates=[],
     apply_easy_days=False,
     auto_reschedule=False,
+    time_budget=0,
 ):
     if not mw.col.get_config("fsrs"):
         tooltip(t("enable-fsrs-warning"))
@@ -290,6 +435,7 @@ def reschedule(
             easy_specific_due_dates,
             apply_easy_days,
             auto_reschedule,
+            time_budget=time_budget,
         ),
         on_done,
     )
@@ -297,6 +443,7 @@ def reschedule(
     return fut
 
 
+@profiled("reschedule")
 def reschedule_background(
     did,
     recent=False,
@@ -305,28 +452,42 @@ def reschedule_background(
     easy_specific_due_dates=[],
     apply_easy_days=False,
     auto_reschedule=False,
+    write_chunk_size=5000,
+    time_budget=0,
+    show_progress=True,
+    should_stop: Optional[Callable[[], bool]] = None,
 ):
+    """Reschedule the review cards of `did`, or of the whole collection.
+
+    With a `time_budget` in seconds, only the `budget_slice_size` cards due
+    soonest are taken on, and the cards left when the time is up are added
+    to the `RescheduleBacklog` for a later run.
+
+    A job step passes `should_stop`, which returns True once the user wants
+    Anki back. The run then stops as if its time were up, and its cards are
+    written as those of a job step (see `CardWriter`).
+    """
+    global budget_setup
     config = Config()
     config.load()
 
-    fsrs = FSRS()
+    setup = None
+    if (
+        time_budget
+        and budget_setup is not None
+        and budget_setup.key
+        == setup_key(config, easy_specific_due_dates, apply_easy_days)
+    ):
+        setup = budget_setup
+    if setup is None:
+        setup = prepare_reschedule(config, easy_specific_due_dates, apply_easy_days)
+    fsrs = setup.fsrs
     fsrs.reschedule_threshold = config.reschedule_threshold
     did_query = None
     if did is not None:
         did_list = ids2str(fsrs.DM.deck_and_child_ids(did))
         did_query = f"AND did IN {did_list}"
 
-    fsrs.apply_easy_days = apply_easy_days
-    if fsrs.load_balancer_enabled or easy_specific_due_dates:
-        fsrs.set_load_balance()
-        fsrs.easy_specific_due_dates = list(easy_specific_due_dates)
-
-        for easy_date_str in config.easy_dates:
-            easy_date = datetime.strptime(easy_date_str, "%Y-%m-%d").date()
-            specific_due = fsrs.today + (easy_date - fsrs.current_date).days
-            if specific_due not in fsrs.easy_specific_due_dates:
-                fsrs.easy_specific_due_dates.append(specific_due)
-
     if recent:
         today_cutoff = mw.col.sched.day_cutoff
         day_before_cutoff = today_cutoff - (config.days_to_reschedule + 1) * 86400
@@ -343,96 +504,180 @@ def reschedule_background(
     if filter_flag:
         filter_query = f"AND id IN {ids2str(filtered_cids)}"
 
-    skip_query = (
-        """
-            AND id NOT IN (
-                SELECT cid
-                FROM revlog
-                GROUP BY cid
-                HAVING MAX(CASE WHEN type = 4 THEN id ELSE NULL END) = MAX(id)
-            )
-        """
-        if not config.reschedule_set_due_date
-        else ""
-    )
-
-    cid_did_nid = mw.col.db.all(f"""
-        SELECT
-            id,
-            CASE WHEN odid==0
-            THEN did
-            ELSE odid
-            END,
-            nid
-        FROM cards
-        WHERE queue NOT IN ({QUEUE_TYPE_SUSPENDED}, {QUEUE_TYPE_NEW}, {QUEUE_TYPE_PREVIEW})
+    card_filters = f"""
+        AND queue NOT IN ({QUEUE_TYPE_SUSPENDED}, {QUEUE_TYPE_NEW}, {QUEUE_TYPE_PREVIEW})
         {did_query if did_query is not None else ""}
         {recent_query if recent else ""}
         {filter_query if filter_flag else ""}
-        {skip_query}
-        ORDER BY ivl
-    """)
-    total_cnt = len(cid_did_nid)
-    mw.taskman.run_on_main(
-        lambda: mw.progress.start(
-            label=t("reschedule-label"), max=total_cnt, immediate=True
-        )
-    )
-    # x[0]: cid
-    # x[1]: did
-    # x[2]: nid
-    # x[3]: desired retention
-    # x[4]: max interval
-    cards = map(
-        lambda x: (
-            x
-            + [
-                get_dr(fsrs.DM, x[1]),
-                fsrs.DM.config_dict_for_deck_id(x[1])["rev"]["maxIvl"],
-            ]
-        ),
-        cid_did_nid,
+    """
+    check_threshold = fsrs.reschedule_threshold > 0 and not (
+        apply_easy_days or auto_reschedule
     )
+    # the cards due soonest first; intraday learning cards are due by the second
+    urgency_order = f"""
+        CASE WHEN queue = {QUEUE_TYPE_LRN} THEN {fsrs.today}
+        WHEN odid==0 THEN due ELSE odue END,
+        ivl
+    """
+    # stored memory states are stale when they are recomputed
+    with profile_phase(SQL):
+        band_filter = (
+            fsrs.threshold_band_filter(card_filters)
+            if check_threshold and not filter_flag
+            else ""
+        )
+        cids = mw.col.db.list(f"""
+            SELECT id
+            FROM cards
+            WHERE true
+            {card_filters}
+            {band_filter}
+            ORDER BY {urgency_order if time_budget else "ivl"}
+        """)
+    # the rest of the cards are left to later runs without being looked at
+    if time_budget:
+        slice_size = budget_slice_size(time_budget)
+        cids, deferred = cids[:slice_size], cids[slice_size:]
+    if setup.manually_rescheduled:
+        cids = [cid for cid in cids if cid not in setup.manually_rescheduled]
+    total_cnt = len(cids)
+    fsrs.last_review_index.add(cids)
+    if show_progress:
+        mw.taskman.run_on_main(
+            lambda: mw.progress.start(
+                label=t("reschedule-label"), max=total_cnt, immediate=True
+            )
+        )
     cnt = 0
     cancelled = False
-    rescheduled_cards = []
+    last_cid = None
     filtered_nids = set()
-    undo_entry = mw.col.add_custom_undo_entry(t("reschedule"))
-    for (
-        cid,
-        did,
-        nid,
-        desired_retention,
-        maximum_interval,
-    ) in cards:
+    # rescheduled cards that kept their due and interval only need the marker
+    unchanged_cids = []
+    changes = CardChanges()
+    if should_stop is None:
+        undo_entry = mw.col.add_custom_undo_entry(t("reschedule"))
+        writer = CardWriter(undo_entry, write_chunk_size, changes)
+    else:
+        writer = CardWriter(None, write_chunk_size, changes, t("reschedule"))
+    # smaller chunks overrun the time budget by less
+    chunk_size = 500 if time_budget else 5000
+    # memory states are only known up front when they are not recomputed
+    if filter_flag:
+        chunks = (
+            (snapshots, {}) for snapshots in iter_card_snapshot_chunks(cids, chunk_size)
+        )
+    else:
+        chunks = (
+            fsrs.batch_target_intervals(snapshots, check_threshold)
+            for snapshots in iter_card_snapshot_chunks(cids, chunk_size)
+        )
+    balanced_ivls = {}
+    if (
+        (config.reschedule_workers > 1 or config.global_load_balance)
+        and not filter_flag
+        and (fsrs.load_balancer_enabled or fsrs.easy_specific_due_dates)
+    ):
+        kept_cids = []
+        all_target_ivls = {}
+
+        def first_pass():
+            for snapshots, target_ivls in chunks:
+                kept_cids.extend(snapshot.id for snapshot in snapshots)
+                all_target_ivls.update(target_ivls)
+                yield snapshots, target_ivls
+
+        with profile_phase(LOAD_BALANCE):
+            balanced_ivls = balance_presets(
+                fsrs,
+                first_pass(),
+                config.reschedule_workers,
+                config.global_load_balance,
+            )
+        # read the snapshots again rather than keep those of every card
+        chunks = (
+            (snapshots, all_target_ivls)
+            for snapshots in iter_card_snapshot_chunks(kept_cids, chunk_size)
+        )
+    # the time budget is spent on the cards, not on the setup above
+    deadline = None
+    for snapshots, target_ivls in chunks:
         if cancelled:
             break
-        fsrs.desired_retention = desired_retention
-        fsrs.maximum_interval = maximum_interval
-        fsrs.did = did
-        card, interval_updated = reschedule_card(
-            cid, fsrs, filter_flag, auto_reschedule
-        )
-        if card is None:
-            continue
-        rescheduled_cards.append(card)
-        if interval_updated:
-            filtered_nids.add(nid)
-            cnt += 1
-        if cnt % 500 == 0:
-            mw.taskman.run_on_main(
-                lambda: mw.progress.update(
-                    label=t("reschedule-progress", count=cnt, total=total_cnt),
-                    value=cnt,
-                    max=total_cnt,
+        if deadline is None:
+            deadline = time.monotonic() + time_budget
+        memory_states = {}
+        if filter_flag:
+            with profile_phase(MEMORY_STATE, len(snapshots)):
+                memory_states = compute_memory_states(
+                    (snapshot.id for snapshot in snapshots), fsrs.deck_configs
                 )
+        for snapshot in snapshots:
+            if cancelled:
+                break
+            did = snapshot.original_did
+            deck_config = fsrs.deck_configs.get(did)
+            fsrs.desired_retention = deck_config.desired_retention
+            fsrs.maximum_interval = deck_config.max_ivl
+            fsrs.did = did
+            card, interval_updated = reschedule_card(
+                snapshot,
+                fsrs,
+                filter_flag,
+                auto_reschedule,
+                target_ivls.get(snapshot.id),
+                balanced_ivls.get(snapshot.id),
+                memory_states.get(snapshot.id),
+                changes,
             )
-            if mw.progress.want_cancel():
+            if interval_updated:
+                filtered_nids.add(snapshot.nid)
+                cnt += 1
+            if card is not None:
+                writer.add(card)
+            elif interval_updated:
+                unchanged_cids.append(snapshot.id)
+            last_cid = snapshot.id
+            if time_budget and time.monotonic() >= deadline:
                 cancelled = True
+            if should_stop is not None and should_stop():
+                cancelled = True
+            if cnt % 500 == 0 and show_progress:
+                mw.taskman.run_on_main(
+                    lambda: mw.progress.update(
+                        label=t("reschedule-progress", count=cnt, total=total_cnt),
+                        value=cnt,
+                        max=total_cnt,
+                    )
+                )
+                if mw.progress.want_cancel():
+                    cancelled = True
 
-    mw.col.update_cards(rescheduled_cards)
-    mw.col.merge_undo_entries(undo_entry)
+    # a cancelled run keeps the cards rescheduled before it stopped
+    write_custom_data_bulk(unchanged_cids, "v", "reschedule", writer)
+    writer.finish()
     finish_text = t("reschedule-result", count=cnt)
+    if time_budget:
+        # the due counts have followed the cards written, so the next run
+        # can carry on with them
+        setup.key = setup_key(config, easy_specific_due_dates, apply_easy_days)
+        budget_setup = setup
+
+    if time_budget:
+        unprocessed = deferred
+        if cancelled:
+            unprocessed = (
+                cids[cids.index(last_cid) + 1 :] if last_cid is not None else cids
+            ) + deferred
+        # only the cards this run has dealt with leave the backlog
+        candidates = filtered_cids if filter_flag else cids
+        handled = set(candidates).difference(unprocessed)
+        backlog = RescheduleBacklog()
+        backlog.remove(handled)
+        backlog.add(unprocessed)
+        backlog.close()
+        if unprocessed:
+            finish_text += ", " + t("reschedule-backlog", count=len(unprocessed))
 
     if config.auto_disperse_after_reschedule:
         filtered_nid_string = ids2str(filtered_nids)
@@ -441,10 +686,40 @@ def reschedule_background(
     return finish_text
 
 
-def reschedule_card(cid, fsrs: FSRS, recompute=False, auto_reschedule=False):
-    card = mw.col.get_card(cid)
+def reschedule_card(
+    snapshot: CardSnapshot,
+    fsrs: FSRS,
+    recompute=False,
+    auto_reschedule=False,
+    target_ivl: Optional[int] = None,
+    balanced_ivl: Optional[int] = None,
+    memory_state=None,
+    changes: Optional[CardChanges] = None,
+):
+    """Reschedule the card described by `snapshot`.
+
+    Returns the Card to write, or None when nothing needs to be written, and
+    whether the card went through rescheduling. A Card is only loaded from
+    the backend when its memory state is recomputed or its due, interval or
+    desired retention changes; the caller marks the other cards that went
+    through rescheduling with `write_custom_data_bulk`.
+
+    `target_ivl` is the unfuzzed interval from `FSRS.batch_target_intervals`;
+    the card has then already passed the reschedule threshold check.
+    `balanced_ivl` is its load balanced interval from `balance_presets`.
+    `memory_state` is the card's state from `compute_memory_states`, used
+    instead of a backend call when recomputing.
+    Cards are loaded through `changes`, when given, so that the ones that
+    end up unchanged can be left out of the write.
+    """
+    get_card = changes.get_card if changes is not None else mw.col.get_card
+    card = None
     if recompute:
-        memory_state = mw.col.compute_memory_state(cid)
+        with profile_phase(SQL, 1):
+            card = get_card(snapshot.id)
+        if memory_state is None:
+            with profile_phase(MEMORY_STATE, 1):
+                memory_state = mw.col.compute_memory_state(snapshot.id)
         s = memory_state.stability
         d = memory_state.difficulty
         if s is None or d is None:
@@ -452,47 +727,67 @@ def reschedule_card(cid, fsrs: FSRS, recompute=False, auto_reschedule=False):
         card.memory_state = FSRSMemoryState(stability=s, difficulty=d)
         if hasattr(memory_state, "decay") and hasattr(card, "decay"):
             card.decay = memory_state.decay
-    elif card.memory_state:
-        memory_state = card.memory_state
-        s = memory_state.stability
-        d = memory_state.difficulty
+            snapshot.decay = memory_state.decay
+    elif snapshot.has_memory_state:
+        s = snapshot.stability
     else:
         return None, False
 
-    if card.type == CARD_TYPE_REV:
-        fsrs.set_card(card)
-        fsrs.set_fuzz_factor(cid, card.reps)
-        decay = get_decay(card)
-        card.desired_retention = fsrs.desired_retention
-
-        if fsrs.reschedule_threshold > 0 and not (
-            fsrs.apply_easy_days or auto_reschedule
+    if snapshot.type == CARD_TYPE_REV:
+        fsrs.set_card(snapshot)
+        fsrs.set_fuzz_factor(snapshot.id, snapshot.reps)
+        decay = get_decay(snapshot)
+        dr_before = snapshot.desired_retention
+        snapshot.desired_retention = fsrs.desired_retention
+        if card is not None:
+            card.desired_retention = fsrs.desired_retention
+
+        if (
+            target_ivl is None
+            and fsrs.reschedule_threshold > 0
+            and not (fsrs.apply_easy_days or auto_reschedule)
         ):
-            dr = fsrs.desired_retention
-            odds = dr / (1 - dr)
-
-            odds_lower = (1 - fsrs.reschedule_threshold) * odds
-            dr_lower = odds_lower / (odds_lower + 1)
+            dr_upper, dr_lower = threshold_retentions(
+                fsrs.desired_retention, fsrs.reschedule_threshold
+            )
             adjusted_ivl_upper = next_interval(s, dr_lower, -decay)
-
-            odds_upper = (1 + fsrs.reschedule_threshold) * odds
-            dr_upper = odds_upper / (odds_upper + 1)
             adjusted_ivl_lower = next_interval(s, dr_upper, -decay)
 
-            if card.ivl >= adjusted_ivl_lower and card.ivl <= adjusted_ivl_upper:
-                if recompute:
-                    return card, False
-                else:
-                    return None, False
-
-        new_ivl = fsrs.fuzzed_next_interval(s, -decay)
-        due_before = card.odue if card.odid else card.due
-        card = update_card_due_ivl(card, new_ivl)
-        write_custom_data(card, "v", "reschedule")
-        due_after = card.odue if card.odid else card.due
+            if (
+                snapshot.ivl >= adjusted_ivl_lower
+                and snapshot.ivl <= adjusted_ivl_upper
+            ):
+                return card, False
+
+        if balanced_ivl is not None:
+            new_ivl = balanced_ivl
+        elif target_ivl is None:
+            with profile_phase(LOAD_BALANCE, 1):
+                new_ivl = fsrs.fuzzed_next_interval(s, -decay)
+        else:
+            with profile_phase(LOAD_BALANCE, 1):
+                new_ivl = fsrs.apply_fuzz(target_ivl)
+        ivl_before = snapshot.ivl
+        due_before = snapshot.true_due
+        update_card_due_ivl(snapshot, new_ivl, fsrs.last_review_index)
+        due_after = snapshot.true_due
+        # `balance_presets` counted balanced intervals in copies of the due
+        # counts; the runs that reuse `fsrs` need them in its own
         if fsrs.load_balancer_enabled or fsrs.easy_specific_due_dates:
             fsrs.update_due_cnt_per_day(due_before, due_after)
 
+        if card is None and (
+            snapshot.ivl != ivl_before
+            or due_after != due_before
+            or dr_before is None
+            or round(dr_before, 2) != round(fsrs.desired_retention, 2)
+        ):
+            with profile_phase(SQL, 1):
+                card = get_card(snapshot.id)
+        if card is not None:
+            apply_snapshot(card, snapshot)
+            write_custom_data(card, "v", "reschedule")
+
     return card, True
 
 
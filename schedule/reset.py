@@ -8,25 +8,18 @@ def clear_custom_data(did):
     if not askUser(t("clear-custom-data-confirmation")):
         return
 
-    cards = mw.col.db.list("""
+    cids = mw.col.db.list("""
             SELECT id
             FROM cards
             WHERE data != '' 
             AND json_extract(data, '$.cd') IS NOT NULL
         """)
 
-    cnt = 0
-    reset_cards = []
     start_time = time.time()
     undo_entry = mw.col.add_custom_undo_entry(t("clear-custom-data"))
-    for cid in cards:
-        card = mw.col.get_card(cid)
-        card.custom_data = ""
-        reset_cards.append(card)
-        cnt += 1
-
-    mw.col.update_cards(reset_cards)
-    # mw.col.merge_undo_entries(undo_entry) # Removed this line
+    writer = CardWriter(undo_entry, CUSTOM_DATA_CHUNK_SIZE)
+    cnt = clear_custom_data_bulk(cids, writer)
+    writer.finish()
     tooltip(
         t(
             "clear-custom-data-result",
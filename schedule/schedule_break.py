@@ -17,11 +17,23 @@ from aqt import mw
 from aqt.qt import QInputDialog, QMessageBox
 from aqt.utils import tooltip
 
+from ..core.intervals import power_forgetting_curve
+from ..core.schedule_break import allocate_break_cards, break_target_totals
 from ..i18n import t
+from ..memory_state import compute_memory_states
+from ..profiler import (
+    LOAD_BALANCE,
+    MEMORY_STATE,
+    SQL,
+    UPDATE_CARDS,
+    profile_count,
+    profile_phase,
+    profiled,
+)
 from ..utils import (
+    LastReviewIndex,
     get_decay,
     get_last_review_date_and_interval,
-    power_forgetting_curve,
     update_card_due_ivl,
     write_custom_data,
 )
@@ -75,13 +87,20 @@ def _append_log_entry(log_path: Optional[Path], break_card: BreakCard, new_due:
         pass
 
 
-def _ensure_memory_state(card: Card) -> Optional[FSRSMemoryState]:
-    if card.memory_state:
-        stability = card.memory_state.stability
-        difficulty = card.memory_state.difficulty
-        if stability is not None and difficulty is not None:
-            return card.memory_state
-    memory_state = mw.col.compute_memory_state(card.id)
+def _has_memory_state(card: Card) -> bool:
+    return bool(
+        card.memory_state
+        and card.memory_state.stability is not None
+        and card.memory_state.difficulty is not None
+    )
+
+
+def _ensure_memory_state(card: Card, memory_state=None) -> Optional[FSRSMemoryState]:
+    if _has_memory_state(card):
+        return card.memory_state
+    if memory_state is None:
+        with profile_phase(MEMORY_STATE, 1):
+            memory_state = mw.col.compute_memory_state(card.id)
     if (
         memory_state is None
         or memory_state.stability is None
@@ -133,25 +152,29 @@ def _prompt_break_parameters():
 
 
 def _fetch_window_cards(window_end: int, did_query: str) -> List[Card]:
-    cids = mw.col.db.list(f"""
-        SELECT id
-        FROM cards
-        WHERE type = {CARD_TYPE_REV}
-        AND queue NOT IN ({QUEUE_TYPE_SUSPENDED}, {QUEUE_TYPE_NEW}, {QUEUE_TYPE_PREVIEW})
-        {did_query}
-        AND CASE WHEN odid==0 THEN due ELSE odue END <= {window_end}
-    """)
-    return [mw.col.get_card(cid) for cid in cids]
+    with profile_phase(SQL):
+        cids = mw.col.db.list(f"""
+            SELECT id
+            FROM cards
+            WHERE type = {CARD_TYPE_REV}
+            AND queue NOT IN ({QUEUE_TYPE_SUSPENDED}, {QUEUE_TYPE_NEW}, {QUEUE_TYPE_PREVIEW})
+            {did_query}
+            AND CASE WHEN odid==0 THEN due ELSE odue END <= {window_end}
+        """)
+        profile_count(SQL, len(cids))
+        return [mw.col.get_card(cid) for cid in cids]
 
 
 def _build_break_card(
     card: Card,
     break_end: int,
+    last_review_index: Optional[LastReviewIndex] = None,
+    memory_state=None,
 ) -> Optional[BreakCard]:
-    memory_state = _ensure_memory_state(card)
+    memory_state = _ensure_memory_state(card, memory_state)
     if memory_state is None:
         return None
-    last_review, _ = get_last_review_date_and_interval(card)
+    last_review, _ = get_last_review_date_and_interval(card, last_review_index)
     true_due = card.odue if card.odid else card.due
     original_interval = max(1, true_due - last_review)
 
@@ -170,49 +193,25 @@ def _allocate_break_cards(
     target_totals: Dict[int, int],
     log_path: Optional[Path],
 ) -> Dict[int, List[BreakCard]]:
-    assigned = defaultdict(list)
-    sorted_cards = sorted(
+    return allocate_break_cards(
         cards,
-        key=lambda c: (c.original_interval, c.original_due),
+        candidate_days,
+        target_totals,
+        lambda break_card, new_due: _append_log_entry(log_path, break_card, new_due),
     )
 
-    if not candidate_days:
-        return assigned
-
-    remaining = {day: target_totals.get(day, 0) for day in candidate_days}
-
-    for break_card in sorted_cards:
-        earliest_day = max(candidate_days[0], break_card.original_due)
-        feasible_days = [
-            day
-            for day in candidate_days
-            if day >= earliest_day and remaining.get(day, 0) > 0
-        ]
 
-        if not feasible_days:
-            feasible_days = [day for day in candidate_days if remaining.get(day, 0) > 0]
-
-        if not feasible_days:
-            continue
-
-        def day_cost(day: int) -> tuple[float, int]:
-            cost = abs(day - break_card.original_due) / break_card.original_interval
-            return (cost, day)
-
-        best_day = min(feasible_days, key=day_cost)
-        remaining[best_day] -= 1
-        assigned[best_day].append(break_card)
-        _append_log_entry(log_path, break_card, best_day)
-    return assigned
-
-
-def _update_cards(assignments: Dict[int, List[BreakCard]], total: int) -> int:
+def _update_cards(
+    assignments: Dict[int, List[BreakCard]],
+    total: int,
+    last_review_index: Optional[LastReviewIndex] = None,
+) -> int:
     updated_cards = []
     processed = 0
     for due_day, cards in assignments.items():
         for break_card in cards:
             interval = max(1, due_day - break_card.last_review)
-            update_card_due_ivl(break_card.card, interval)
+            update_card_due_ivl(break_card.card, interval, last_review_index)
             write_custom_data(break_card.card, "v", "reschedule")
             updated_cards.append(break_card.card)
             processed += 1
@@ -230,7 +229,8 @@ def _update_cards(assignments: Dict[int, List[BreakCard]], total: int) -> int:
                     )
                 )
     if updated_cards:
-        mw.col.update_cards(updated_cards)
+        with profile_phase(UPDATE_CARDS, len(updated_cards)):
+            mw.col.update_cards(updated_cards)
     mw.taskman.run_on_main(
         lambda total_cards=total: mw.progress.update(
             label=t(
@@ -245,6 +245,7 @@ def _update_cards(assignments: Dict[int, List[BreakCard]], total: int) -> int:
     return len(updated_cards)
 
 
+@profiled("schedule_break")
 def _schedule_break_background(did, break_days: int, spread_days: int):
     deck_manager = DeckManager(mw.col)
     today = mw.col.sched.today
@@ -276,6 +277,12 @@ def _schedule_break_background(did, break_days: int, spread_days: int):
         return {"count": 0, "skipped": 0, "break_days": break_days}
 
     total_cards = len(window_cards)
+    last_review_index = LastReviewIndex(card.id for card in window_cards)
+    missing_memory_states = [
+        card.id for card in window_cards if not _has_memory_state(card)
+    ]
+    with profile_phase(MEMORY_STATE, len(missing_memory_states)):
+        computed_memory_states = compute_memory_states(missing_memory_states)
     mw.taskman.run_on_main(
         lambda: mw.progress.start(
             label=t("schedule-break-label"), max=total_cards, immediate=True
@@ -305,6 +312,8 @@ def _schedule_break_background(did, break_days: int, spread_days: int):
         break_entry = _build_break_card(
             card=card,
             break_end=break_end,
+            last_review_index=last_review_index,
+            memory_state=computed_memory_states.get(card.id),
         )
         if break_entry is None:
             skipped_cards += 1
@@ -350,19 +359,16 @@ def _schedule_break_background(did, break_days: int, spread_days: int):
         )
     )
 
-    extra_cards = break_period_cards
-    extra_quota, extra_remainder = divmod(extra_cards, len(candidate_days))
-    target_totals = {}
-    for idx, day in enumerate(candidate_days):
-        additional = extra_quota + (1 if idx < extra_remainder else 0)
-        target_totals[day] = base_counts[day] + additional
+    target_totals = break_target_totals(candidate_days, base_counts, break_period_cards)
 
-    assignments = _allocate_break_cards(
-        break_card_entries, candidate_days, target_totals, log_path
-    )
-    updated_count = _update_cards(assignments, assignment_total)
+    with profile_phase(LOAD_BALANCE, len(break_card_entries)):
+        assignments = _allocate_break_cards(
+            break_card_entries, candidate_days, target_totals, log_path
+        )
+    updated_count = _update_cards(assignments, assignment_total, last_review_index)
     if updated_count > 0:
-        mw.col.merge_undo_entries(undo_entry)
+        with profile_phase(UPDATE_CARDS):
+            mw.col.merge_undo_entries(undo_entry)
     return {
         "count": updated_count,
         "skipped": skipped_cards,
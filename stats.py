@@ -7,6 +7,7 @@ from .configuration import Config
 from .steps import steps_stats
 from .i18n import t
 from .utils import *
+from .core.intervals import power_forgetting_curve
 
 
 def _line_now(i, a, b, bold=True):
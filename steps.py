@@ -1,5 +1,6 @@
 from collections import defaultdict
 from .utils import *
+from .core.intervals import power_forgetting_curve
 
 
 def log_loss(y_true, y_pred):
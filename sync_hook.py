@@ -1,11 +1,12 @@
 from aqt.gui_hooks import sync_will_start, sync_did_finish
 from anki.utils import ids2str
 from typing import List
-from .schedule.reschedule import reschedule
+from .schedule.reschedule import budget_slice_size, reschedule
 from .schedule.disperse_siblings import disperse_siblings
 from .configuration import Config
 from .utils import *
 from .i18n import t
+from .jobs import RESCHEDULE_BACKLOG, REVLOG_SUMMARY, add_job
 
 
 def create_comparelog(local_rids: List[int]) -> None:
@@ -44,6 +45,13 @@ def auto_reschedule(local_rids: List[int], texts: List[str]):
         return
 
     remote_reviewed_cids = review_cid_remote(local_rids)
+    if config.auto_reschedule_time_budget:
+        # the cards left over by earlier runs compete for the same budget
+        backlog = RescheduleBacklog()
+        remote_reviewed_cids += backlog.cids(
+            limit=budget_slice_size(config.auto_reschedule_time_budget)
+        )
+        backlog.close()
 
     fut = reschedule(
         did=None,
@@ -51,11 +59,15 @@ def auto_reschedule(local_rids: List[int], texts: List[str]):
         filter_flag=True,
         filtered_cids=set(remote_reviewed_cids),
         auto_reschedule=True,
+        time_budget=config.auto_reschedule_time_budget,
     )
 
     if fut:
         # wait for reschedule to finish
         texts.append(fut.result())
+    if config.auto_reschedule_time_budget:
+        # the cards left over are rescheduled when Anki is idle
+        add_job(RESCHEDULE_BACKLOG, unique=True)
 
 
 def auto_disperse(local_rids: List[int], texts: List[str]):
@@ -93,6 +105,15 @@ def auto_disperse(local_rids: List[int], texts: List[str]):
         return fut.result()
 
 
+def update_revlog_summary_later():
+    config = Config()
+    config.load()
+    # auto reschedule has just updated it, and setting due dates doesn't use it
+    if config.auto_reschedule_after_sync or config.reschedule_set_due_date:
+        return
+    add_job(REVLOG_SUMMARY, unique=True)
+
+
 def init_sync_hook():
     local_rids = []
     texts = []
@@ -100,3 +121,5 @@ def init_sync_hook():
     sync_will_start.append(lambda: create_comparelog(local_rids))
     sync_did_finish.append(lambda: auto_reschedule(local_rids, texts))
     sync_did_finish.append(lambda: auto_disperse(local_rids, texts))
+    # the revlog summary catches up with a sync; do it before it is needed
+    sync_did_finish.append(update_revlog_summary_later)
@@ -0,0 +1,240 @@
+"""The memory states of `compute_memory_states` against those of the Anki backend.
+
+Needs Anki installed with pip; the tests of `compute_memory_states` also need
+aqt, for `headless`. Run with `python -m pytest tests` from the root of the
+repository.
+"""
+
+import datetime
+import random
+
+import pytest
+from anki.collection import Collection
+from anki.utils import point_version
+
+from core.memory_state import (
+    EXACT,
+    REVLOG_LRN,
+    REVLOG_RESCHED,
+    FSRSModel,
+    fill_parameters,
+    reviews_for_fsrs,
+)
+
+REVLOG_REV = 1
+REVLOG_RELRN = 2
+# FSRS-6 parameters other than the defaults
+CUSTOM_PARAMETERS = [
+    0.4072,
+    1.1829,
+    3.1262,
+    15.4722,
+    7.2102,
+    0.5316,
+    1.0651,
+    0.0234,
+    1.616,
+    0.1544,
+    1.0824,
+    1.9813,
+    0.0953,
+    0.2975,
+    2.2042,
+    0.2407,
+    2.9466,
+    0.5034,
+    0.6567,
+    0.1,
+    0.2,
+]
+# FSRS-5 parameters, which the backend reads as FSRS-6 ones
+LEGACY_PARAMETERS = [
+    0.40255,
+    1.18385,
+    3.173,
+    15.69105,
+    7.1949,
+    0.5345,
+    1.4604,
+    0.0046,
+    1.54575,
+    0.1192,
+    1.01925,
+    1.9395,
+    0.11,
+    0.29605,
+    2.2698,
+    0.2315,
+    2.9898,
+    0.51655,
+    0.6621,
+]
+# preset name: (parameter key, parameters, days of revlog ignored)
+PRESETS = {
+    "Custom": ("fsrsParams6", CUSTOM_PARAMETERS, None),
+    "Legacy": ("fsrsParams5", LEGACY_PARAMETERS, None),
+    "Ignore": ("fsrsParams6", CUSTOM_PARAMETERS, 300),
+}
+CARDS = 1200
+
+fsrs6_backend = pytest.mark.skipif(
+    point_version() < 250500, reason="the backend replays without FSRS-6"
+)
+
+
+def random_history(rng, kind):
+    """(day, ease, type, factor) revlog rows of one card, oldest first.
+
+    `kind` adds to the learning and review entries: "reset" forgets the card
+    and learns it again, "set_due" sets its due date, "reviews_only" leaves
+    out the learning steps, and "empty" has no entries at all.
+    """
+    if kind == "empty":
+        return []
+    day = -rng.randint(30, 2000)
+    rows = []
+    if kind != "reviews_only":
+        for _ in range(rng.randint(1, 3)):
+            rows.append((day, rng.choice((1, 3, 3, 4)), REVLOG_LRN, 0))
+    while day < -1:
+        day = min(-1, day + rng.choice((1, 2, 5, 20, 60, 200, 700)))
+        ease = rng.choices((1, 2, 3, 4), (0.15, 0.1, 0.65, 0.1))[0]
+        rows.append((day, ease, REVLOG_REV, 2500))
+        if ease == 1:
+            rows.append((day, 3, REVLOG_RELRN, 2500))
+        if kind == "set_due" and rng.random() < 0.2:
+            rows.append((day, 0, REVLOG_RESCHED, 2500))
+        if kind == "reset" and rng.random() < 0.1:
+            rows.append((day, 0, REVLOG_RESCHED, 0))
+            rows.append((day, 3, REVLOG_LRN, 0))
+    return rows
+
+
+@pytest.fixture(scope="module")
+def collection(tmp_path_factory):
+    col = Collection(str(tmp_path_factory.mktemp("collection") / "collection.anki2"))
+    col.set_config("fsrs", True)
+    dids = [1]
+    for name, (key, params, ignored_days) in PRESETS.items():
+        preset = col.decks.get_config(col.decks.add_config_returning_id(name))
+        preset[key] = params
+        if ignored_days is not None:
+            ignore_date = datetime.date.today() - datetime.timedelta(ignored_days)
+            preset["ignoreRevlogsBeforeDate"] = ignore_date.isoformat()
+        col.decks.save(preset)
+        did = col.decks.id(name)
+        deck = col.decks.get(did)
+        deck["conf"] = preset["id"]
+        col.decks.save(deck)
+        dids.append(did)
+
+    rng = random.Random(0)
+    kinds = ("plain", "plain", "reset", "set_due", "reviews_only", "empty")
+    notetype = col.models.by_name("Basic")
+    day_cutoff = col.sched.day_cutoff
+    revlog_rows = []
+    for index in range(CARDS):
+        note = col.new_note(notetype)
+        note["Front"] = str(index)
+        col.add_note(note, dids[index % len(dids)])
+        cid = note.card_ids()[0]
+        second = rng.randint(1, 80000)
+        for day, ease, revlog_type, factor in random_history(
+            rng, kinds[index // len(dids) % len(kinds)]
+        ):
+            second += 1
+            revlog_id = (day_cutoff + (day - 1) * 86400 + second) * 1000 + index
+            revlog_rows.append((revlog_id, cid, ease, factor, revlog_type))
+    col.db.executemany(
+        "INSERT INTO revlog VALUES (?, ?, -1, ?, 1, 0, ?, 0, ?)", revlog_rows
+    )
+    col.db.execute(
+        "UPDATE cards SET type = 2, queue = 2, ivl = 1, due = ?", col.sched.today
+    )
+    yield col
+    col.close()
+
+
+def revlog_entries(col, cid):
+    return col.db.all(
+        "SELECT id, ease, type, factor FROM revlog WHERE cid = ? ORDER BY id", cid
+    )
+
+
+@fsrs6_backend
+@pytest.mark.skipif(not EXACT, reason="the C library math can't be loaded")
+def test_replay_matches_backend(collection):
+    col = collection
+    models = {1: FSRSModel(fill_parameters([]))}
+    for name, (_, params, ignored_days) in PRESETS.items():
+        if ignored_days is None:
+            models[col.decks.id(name)] = FSRSModel(fill_parameters(params))
+    compared = 0
+    for cid, did in col.db.all("SELECT id, did FROM cards"):
+        if did not in models:
+            continue
+        reviews = reviews_for_fsrs(
+            revlog_entries(col, cid), col.sched.today, col.sched.day_cutoff
+        )
+        if reviews is None:
+            continue
+        expected = col.compute_memory_state(cid)
+        stability, difficulty = models[did].replay(reviews)
+        assert (stability, difficulty) == (expected.stability, expected.difficulty), cid
+        compared += 1
+    assert compared > CARDS // 3
+
+
+def test_histories_left_to_backend():
+    today, day_cutoff = 1000, 86400 * 1000
+
+    def entries(*rows):
+        return [
+            ((day_cutoff + (day - today - 1) * 86400 + index + 1) * 1000, *row)
+            for index, (day, *row) in enumerate(rows)
+        ]
+
+    learned = [(900, 3, REVLOG_LRN, 0), (910, 3, REVLOG_REV, 2500)]
+    assert reviews_for_fsrs(entries(*learned), today, day_cutoff) == [(0, 3), (10, 3)]
+    # a manual due date is left out of the replay
+    set_due = learned + [(920, 0, REVLOG_RESCHED, 2500), (950, 3, REVLOG_REV, 2500)]
+    assert reviews_for_fsrs(entries(*set_due), today, day_cutoff) == [
+        (0, 3),
+        (10, 3),
+        (40, 3),
+    ]
+    # a reset card learned again starts over
+    relearned = learned + [(920, 0, REVLOG_RESCHED, 0), (930, 4, REVLOG_LRN, 0)]
+    assert reviews_for_fsrs(entries(*relearned), today, day_cutoff) == [(0, 4)]
+    # the backend starts these from the SM-2 state, or from nothing
+    reset = learned + [(920, 0, REVLOG_RESCHED, 0)]
+    reviews_only = [(900, 3, REVLOG_REV, 2500), (910, 3, REVLOG_REV, 2500)]
+    for rows in (reset, reviews_only, []):
+        assert reviews_for_fsrs(entries(*rows), today, day_cutoff) is None
+
+
+@pytest.fixture(scope="module")
+def memory_state(collection, tmp_path_factory):
+    pytest.importorskip("aqt")
+    import headless
+
+    headless.install(folder=tmp_path_factory.mktemp("addon"))
+    headless.load_addon()
+    headless.aqt.mw.col = collection
+    from fsrs4anki_helper import memory_state
+
+    return memory_state
+
+
+def test_compute_memory_states_match_backend(collection, memory_state):
+    col = collection
+    cids = col.db.list("SELECT id FROM cards")
+    memory_states = memory_state.compute_memory_states(cids)
+    assert sorted(memory_states) == sorted(cids)
+    for cid in cids:
+        expected = col.compute_memory_state(cid)
+        actual = memory_states[cid]
+        assert (actual.stability, actual.difficulty) == (
+            expected.stability,
+            expected.difficulty,
+        ), cid
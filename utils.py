@@ -1,9 +1,14 @@
 import json
 import math
+import multiprocessing
+import sqlite3
+import sys
 import time
+from dataclasses import dataclass
 from anki.decks import DeckManager
+from anki.utils import ids2str
 from aqt.utils import askUser
-from typing import List
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
 from anki.stats_pb2 import CardStatsResponse
 from anki.cards import Card
 from anki.stats import (
@@ -11,9 +16,20 @@ from anki.stats import (
     REVLOG_REV,
     REVLOG_RELRN,
     REVLOG_CRAM,
+    REVLOG_RESCHED,
 )
 from aqt import mw
 from datetime import date, datetime, timedelta
+from pathlib import Path
+from .profiler import (
+    CONFIG,
+    CUSTOM_DATA,
+    REVLOG,
+    SQL,
+    UPDATE_CARDS,
+    profile_count,
+    profile_phase,
+)
 
 
 def RepresentsInt(s):
@@ -40,7 +56,8 @@ def reset_ivl_and_due(cid: int, revlogs: List[CardStatsResponse.StatsRevlogEntry
 
 
 def get_revlogs(cid: int):
-    return mw.col.get_review_logs(cid)
+    with profile_phase(REVLOG, 1):
+        return mw.col.get_review_logs(cid)
 
 
 def filter_revlogs(
@@ -56,7 +73,12 @@ def filter_revlogs(
     )
 
 
-def get_last_review_date_and_interval(card: Card):
+def get_last_review_date_and_interval(
+    card: Card, last_review_index: Optional["LastReviewIndex"] = None
+):
+    if last_review_index is not None:
+        return last_review_index.get(card)
+
     revlogs = filter_revlogs(get_revlogs(card.id))
     last_interval_seconds = 0  # set default value
 
@@ -81,10 +103,385 @@ def get_last_review_date_and_interval(card: Card):
     return last_review_date, last_interval
 
 
-def update_card_due_ivl(card: Card, new_ivl: int):
+class LastReviewIndex:
+    """Last review day and last interval of many cards, read from the revlog in bulk.
+
+    Applies the same filter as `filter_revlogs` and returns the same values as
+    `get_last_review_date_and_interval`, without a backend call per card.
+    Pass `cids=None` to index every card in the collection in a single pass.
+    """
+
+    def __init__(self, cids: Optional[Iterable[int]] = None, chunk_size: int = 5000):
+        self.today = mw.col.sched.today
+        self.day_cutoff = mw.col.sched.day_cutoff
+        self.last_reviews: Dict[int, Tuple[int, int]] = {}
+        # the cards read so far, None once every card is
+        self.indexed: Optional[Set[int]] = set()
+        if cids is None:
+            self._load("")
+            self.indexed = None
+        else:
+            self.add(cids, chunk_size)
+
+    def add(self, cids: Iterable[int], chunk_size: int = 5000):
+        """Index the cards of `cids` that are not indexed yet."""
+        if self.indexed is None:
+            return
+        cids = [cid for cid in cids if cid not in self.indexed]
+        self.indexed.update(cids)
+        for start in range(0, len(cids), chunk_size):
+            chunk = cids[start : start + chunk_size]
+            self._load(f"AND cid IN {ids2str(chunk)}")
+
+    def _load(self, cid_query: str):
+        with profile_phase(REVLOG):
+            rows = mw.col.db.all(f"""
+                SELECT cid, id, lastIvl
+                FROM (
+                    SELECT cid,
+                        id,
+                        lastIvl,
+                        ROW_NUMBER() OVER (
+                            PARTITION BY cid
+                            ORDER BY id DESC
+                        ) AS rank
+                    FROM revlog
+                    WHERE ease >= 1
+                    AND (type != {REVLOG_CRAM} OR factor != 0)
+                    {cid_query}
+                )
+                WHERE rank = 1
+            """)
+        profile_count(REVLOG, len(rows))
+        for cid, revlog_id, last_ivl in rows:
+            last_review_date = (
+                math.ceil((revlog_id // 1000 - self.day_cutoff) / 86400) + self.today
+            )
+            # positive lastIvl values are days, negative ones are seconds
+            last_interval_seconds = last_ivl * 86400 if last_ivl > 0 else -last_ivl
+            last_interval = int(round(last_interval_seconds / 86400))
+            self.last_reviews[cid] = (last_review_date, last_interval)
+
+    def __contains__(self, cid: int) -> bool:
+        return cid in self.last_reviews
+
+    def get(self, card: Card) -> Tuple[int, int]:
+        last_review = self.last_reviews.get(card.id)
+        if last_review is not None:
+            return last_review
+        due = card.odue if card.odid else card.due
+        return due - card.ivl, 0
+
+
+class RevlogSummaryCache:
+    """Per-card summary of the revlog, persisted in the add-on's user_files.
+
+    For each card it keeps the id and type of its last revlog entry, the id
+    of its last entry that is not a manual reschedule, and the number and a
+    checksum of the ids of its entries. `update` re-aggregates only the
+    cards with entries newer than the stored watermark, and those with
+    entries a sync has brought in since the last update, found by their
+    usn. When the totals of the numbers and checksums no longer match the
+    revlog (entries were deleted or imported), the cards whose own ones
+    differ are re-aggregated as well. The summary is only rebuilt from
+    scratch when the profile's collection changed.
+    """
+
+    # bumped when the layout of the summary changes, to rebuild it
+    VERSION = 2
+    # the checksum of a card is the sum of its entries' ids modulo this prime
+    CHECKSUM_MODULUS = 1000000007
+
+    def __init__(self, path: Optional[Path] = None):
+        if path is None:
+            addon = mw.addonManager.addonFromModule(__name__)
+            user_files = Path(mw.addonManager.addonsFolder(addon)) / "user_files"
+            user_files.mkdir(parents=True, exist_ok=True)
+            path = user_files / f"{mw.pm.name}_revlog_summary.db"
+        self.db = sqlite3.connect(path)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        """)
+        if self._get_meta("version") != self.VERSION:
+            with self.db:
+                self.db.execute("DROP TABLE IF EXISTS cards")
+                self.db.execute("DELETE FROM meta")
+                self._set_meta(version=self.VERSION)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS cards (
+                cid INTEGER PRIMARY KEY,
+                last_id INTEGER NOT NULL,
+                last_type INTEGER NOT NULL,
+                last_review_id INTEGER,
+                entries INTEGER NOT NULL,
+                checksum INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS cards_last_type ON cards (last_type);
+        """)
+
+    def _get_meta(self, key: str) -> Optional[int]:
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, **values: int):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", values.items()
+        )
+
+    def update(self):
+        """Bring the summary up to date with the collection's revlog."""
+        with profile_phase(REVLOG):
+            crt = mw.col.crt
+            watermark = self._get_meta("watermark")
+            usn = self._get_meta("usn")
+            with self.db:
+                if watermark is None or usn is None or self._get_meta("crt") != crt:
+                    self.db.execute("DELETE FROM cards")
+                    self._aggregate()
+                else:
+                    # reviews made here since the last update; a sync gives the
+                    # entries it adds, older ones included, the server's usn
+                    touched = set(
+                        mw.col.db.list("SELECT cid FROM revlog WHERE id > ?", watermark)
+                    )
+                    touched.update(
+                        mw.col.db.list("SELECT cid FROM revlog WHERE usn >= ?", usn)
+                    )
+                    self._aggregate(touched)
+                    totals = self.db.execute(
+                        "SELECT coalesce(sum(entries), 0), coalesce(sum(checksum), 0) "
+                        "FROM cards"
+                    ).fetchone()
+                    if tuple(totals) != tuple(
+                        mw.col.db.first(
+                            "SELECT count(), coalesce(sum(id % ?), 0) FROM revlog",
+                            self.CHECKSUM_MODULUS,
+                        )
+                    ):
+                        self._aggregate(self._changed_cids())
+                self._set_meta(
+                    crt=crt,
+                    # the server's usn when the collection last synced
+                    usn=mw.col.db.scalar("SELECT usn FROM col"),
+                    watermark=mw.col.db.scalar(
+                        "SELECT coalesce(max(id), 0) FROM revlog"
+                    ),
+                )
+
+    def _aggregate(self, cids: Optional[Iterable[int]] = None):
+        """Summarize the revlog of `cids`, or of every card when None."""
+        if cids is not None:
+            cids = list(cids)
+            if not cids:
+                return
+            self.db.executemany(
+                "DELETE FROM cards WHERE cid = ?", ((cid,) for cid in cids)
+            )
+        # the type of the last entry is packed below its id, so one MAX finds both
+        rows = mw.col.db.all(
+            f"""
+            SELECT cid,
+                MAX(id * 8 + type),
+                MAX(CASE WHEN type != {REVLOG_RESCHED} THEN id END),
+                count(),
+                sum(id % ?)
+            FROM revlog
+            {f"WHERE cid IN {ids2str(cids)}" if cids is not None else ""}
+            GROUP BY cid
+        """,
+            self.CHECKSUM_MODULUS,
+        )
+        self.db.executemany(
+            "INSERT INTO cards VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (cid, last >> 3, last & 7, last_review_id, entries, checksum)
+                for cid, last, last_review_id, entries, checksum in rows
+            ),
+        )
+
+    def _changed_cids(self) -> List[int]:
+        """Cards whose number or checksum of entries differs from the summary's."""
+        revlog = {
+            cid: (entries, checksum)
+            for cid, entries, checksum in mw.col.db.all(
+                "SELECT cid, count(), sum(id % ?) FROM revlog GROUP BY cid",
+                self.CHECKSUM_MODULUS,
+            )
+        }
+        summary = {
+            cid: (entries, checksum)
+            for cid, entries, checksum in self.db.execute(
+                "SELECT cid, entries, checksum FROM cards"
+            )
+        }
+        return [
+            cid
+            for cid in revlog.keys() | summary.keys()
+            if revlog.get(cid) != summary.get(cid)
+        ]
+
+    def manually_rescheduled_cids(self) -> set[int]:
+        """Cards whose last revlog entry is a manual reschedule (set due date)."""
+        return {
+            cid
+            for (cid,) in self.db.execute(
+                "SELECT cid FROM cards WHERE last_type = ?", (REVLOG_RESCHED,)
+            )
+        }
+
+    def close(self):
+        self.db.close()
+
+
+class RescheduleBacklog:
+    """Cards left to reschedule, persisted in the add-on's user_files.
+
+    Filled when an auto reschedule after sync runs out of its time budget,
+    and emptied by later runs as they reschedule the cards.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        if path is None:
+            addon = mw.addonManager.addonFromModule(__name__)
+            user_files = Path(mw.addonManager.addonsFolder(addon)) / "user_files"
+            user_files.mkdir(parents=True, exist_ok=True)
+            path = user_files / f"{mw.pm.name}_reschedule_backlog.db"
+        self.db = sqlite3.connect(path)
+        # the cards are kept in the order they were added, the most urgent first
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS backlog (
+                position INTEGER PRIMARY KEY AUTOINCREMENT,
+                cid INTEGER UNIQUE
+            )
+        """)
+
+    def cids(self, limit: int = -1) -> List[int]:
+        return [
+            cid
+            for (cid,) in self.db.execute(
+                "SELECT cid FROM backlog ORDER BY position LIMIT ?", (limit,)
+            )
+        ]
+
+    def empty(self) -> bool:
+        return self.db.execute("SELECT 1 FROM backlog LIMIT 1").fetchone() is None
+
+    def add(self, cids: Iterable[int]):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO backlog (cid) VALUES (?)",
+                ((cid,) for cid in cids),
+            )
+
+    def remove(self, cids: Iterable[int]):
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM backlog WHERE cid = ?", ((cid,) for cid in cids)
+            )
+
+    def close(self):
+        self.db.close()
+
+
+@dataclass
+class CardSnapshot:
+    """The scheduling fields of a card, read directly from the cards table.
+
+    Attribute names follow `Card`, so the snapshot can be passed to helpers
+    such as `update_card_due_ivl` and `get_decay` without building a Card.
+    """
+
+    id: int
+    nid: int
+    did: int
+    odid: int
+    ivl: int
+    due: int
+    odue: int
+    type: int
+    reps: int
+    stability: Optional[float]
+    difficulty: Optional[float]
+    desired_retention: Optional[float]
+    decay: Optional[float]
+
+    @property
+    def original_did(self) -> int:
+        return self.odid if self.odid else self.did
+
+    @property
+    def true_due(self) -> int:
+        return self.odue if self.odid else self.due
+
+    @property
+    def has_memory_state(self) -> bool:
+        return self.stability is not None and self.difficulty is not None
+
+
+def card_data_field(key: str) -> str:
+    return f"CASE WHEN data != '' THEN json_extract(data, '$.{key}') END"
+
+
+def custom_data_field(key: str) -> str:
+    """SQL for `key` of the custom data, which `data` keeps as a JSON string."""
+    return f"json_extract(nullif({card_data_field('cd')}, ''), '$.{key}')"
+
+
+def iter_card_snapshot_chunks(
+    cids: Iterable[int], chunk_size: int = 5000
+) -> Iterator[List[CardSnapshot]]:
+    """Yield the snapshots of `cids` in lists of at most `chunk_size`, preserving their order.
+
+    The cards table is read one chunk at a time, so only one chunk of rows is
+    held in memory at a time. Cards that no longer exist are skipped.
+    """
+    cids = list(cids)
+    for start in range(0, len(cids), chunk_size):
+        chunk = cids[start : start + chunk_size]
+        with profile_phase(SQL, len(chunk)):
+            rows = {
+                row[0]: row
+                for row in mw.col.db.all(f"""
+                    SELECT
+                        id,
+                        nid,
+                        did,
+                        odid,
+                        ivl,
+                        due,
+                        odue,
+                        type,
+                        reps,
+                        {card_data_field("s")},
+                        {card_data_field("d")},
+                        {card_data_field("dr")},
+                        {card_data_field("decay")}
+                    FROM cards
+                    WHERE id IN {ids2str(chunk)}
+                """)
+            }
+        yield [CardSnapshot(*rows[cid]) for cid in chunk if cid in rows]
+
+
+def apply_snapshot(card: Card, snapshot: CardSnapshot) -> Card:
+    """Copy the fields the schedulers modify from `snapshot` onto `card`."""
+    card.ivl = snapshot.ivl
+    card.due = snapshot.due
+    card.odue = snapshot.odue
+    if snapshot.desired_retention is not None:
+        card.desired_retention = snapshot.desired_retention
+    return card
+
+
+def update_card_due_ivl(
+    card: Card, new_ivl: int, last_review_index: Optional[LastReviewIndex] = None
+):
     new_ivl = max(new_ivl, 1)
     card.ivl = new_ivl
-    last_review_date, _ = get_last_review_date_and_interval(card)
+    last_review_date, _ = get_last_review_date_and_interval(card, last_review_index)
     new_due = last_review_date + new_ivl
     if card.odid:
         card.odue = new_due if new_due != 0 else 1
@@ -115,42 +512,6 @@ def has_manual_reset(revlogs: List[CardStatsResponse.StatsRevlogEntry]):
     return False
 
 
-FUZZ_RANGES = [
-    {
-        "start": 2.5,
-        "end": 7.0,
-        "factor": 0.15,
-    },
-    {
-        "start": 7.0,
-        "end": 20.0,
-        "factor": 0.1,
-    },
-    {
-        "start": 20.0,
-        "end": math.inf,
-        "factor": 0.05,
-    },
-]
-
-
-def get_fuzz_range(interval, last_interval, maximum_interval):
-    delta = 1.0
-    for range in FUZZ_RANGES:
-        delta += range["factor"] * max(
-            min(interval, range["end"]) - range["start"], 0.0
-        )
-    interval = min(interval, maximum_interval)
-    min_ivl = int(round(interval - delta))
-    max_ivl = int(round(interval + delta))
-    min_ivl = max(2, min_ivl)
-    max_ivl = min(max_ivl, maximum_interval)
-    if interval > last_interval:
-        min_ivl = max(min_ivl, last_interval + 1)
-    min_ivl = min(min_ivl, max_ivl)
-    return min_ivl, max_ivl
-
-
 def due_to_date_str(due: int) -> str:
     offset = due - mw.col.sched.today
     today_date = sched_current_date()
@@ -163,35 +524,202 @@ def sched_current_date() -> date:
     return (now - timedelta(hours=next_day_start_at)).date()
 
 
-DECAY = -0.2
+def write_custom_data(card: Card, key, value):
+    with profile_phase(CUSTOM_DATA, 1):
+        if card.custom_data != "":
+            custom_data = json.loads(card.custom_data)
+            if custom_data.get(key) == value:
+                return
+            custom_data[key] = value
+        else:
+            custom_data = {key: value}
+        card.custom_data = json.dumps(custom_data)
+
+
+def card_state(card: Card) -> tuple:
+    """The fields of `card` that the scheduling operations change.
+
+    Memory states and desired retention are rounded as the collection stores
+    them, so a recomputed state that rounds to the stored one is no change.
+    """
+    memory_state = card.memory_state
+    desired_retention = getattr(card, "desired_retention", None)
+    decay = getattr(card, "decay", None)
+    return (
+        card.due,
+        card.odue,
+        card.ivl,
+        card.custom_data,
+        round(memory_state.stability, 4) if memory_state else None,
+        round(memory_state.difficulty, 3) if memory_state else None,
+        round(desired_retention, 2) if desired_retention is not None else None,
+        round(decay, 3) if decay is not None else None,
+    )
 
 
-def power_forgetting_curve(t, s, decay=DECAY):
-    factor = 0.9 ** (1 / decay) - 1
-    return (1 + factor * t / s) ** decay
+class CardChanges:
+    """Tells which of the cards loaded for an operation it actually changed.
 
+    Cards loaded with `get_card` remember their `card_state`, and `changed`
+    compares it with the current one, so writes that would store the same
+    row again can be dropped. Cards loaded otherwise count as changed.
+    """
 
-def next_interval(s, r, decay=DECAY):
-    factor = 0.9 ** (1 / decay) - 1
-    ivl = s / factor * (r ** (1 / decay) - 1)
-    return max(1, int(round(ivl)))
+    def __init__(self):
+        self.loaded: Dict[int, tuple] = {}
 
+    def get_card(self, cid: int) -> Card:
+        card = mw.col.get_card(cid)
+        self.loaded[cid] = card_state(card)
+        return card
 
-def write_custom_data(card: Card, key, value):
-    if card.custom_data != "":
-        custom_data = json.loads(card.custom_data)
-        custom_data[key] = value
-    else:
-        custom_data = {key: value}
-    card.custom_data = json.dumps(custom_data)
+    def changed(self, card: Card) -> bool:
+        return self.loaded.pop(card.id, None) != card_state(card)
+
+
+# the undo entry of the job writes, by name
+job_undo_entries: Dict[str, int] = {}
+
+
+def job_undo_entry(name: str) -> int:
+    """The undo entry called `name` that job steps write into.
+
+    The steps of background jobs share one entry while it is the last undo
+    step. Once the user has done something undoable, a new one is started,
+    so none of the user's own actions is merged into it.
+    """
+    undo_entry = job_undo_entries.get(name)
+    if undo_entry is None or mw.col.undo_status().last_step != undo_entry:
+        undo_entry = mw.col.add_custom_undo_entry(name)
+        job_undo_entries[name] = undo_entry
+    return undo_entry
+
+
+def unmodified_cards(cards: List[Card]) -> List[Card]:
+    """The cards of `cards` that were not modified since they were loaded.
+
+    `mod` is in seconds, so a card answered or suspended in the second it
+    was loaded is told by its reps and queue.
+    """
+    if not cards:
+        return cards
+    cids = ids2str(card.id for card in cards)
+    current = {
+        cid: (mod, reps, queue)
+        for cid, mod, reps, queue in mw.col.db.all(
+            f"SELECT id, mod, reps, queue FROM cards WHERE id IN {cids}"
+        )
+    }
+    return [
+        card
+        for card in cards
+        if current.get(card.id) == (card.mod, card.reps, card.queue)
+    ]
+
+
+class CardWriter:
+    """Writes modified cards to the collection in chunks of `chunk_size`.
 
+    Every chunk is merged into `undo_entry` as soon as it is written, so the
+    operation stays a single undo step and memory is bounded by the chunk
+    size. Stopping early and calling `finish` keeps the cards written so far.
+    Cards that `changes` loaded and that are unchanged are not written.
 
-def rotate_number_by_k(N, K):
-    num = str(N)
-    length = len(num)
-    K = K % length
-    rotated = num[K:] + num[:K]
-    return int(rotated)
+    A job step passes `job_undo_name` instead of `undo_entry`. It runs while
+    the user can use Anki, so each chunk goes to `job_undo_entry`, and the
+    cards the user modified since they were loaded are left out.
+    """
+
+    def __init__(
+        self,
+        undo_entry: Optional[int],
+        chunk_size: int = 5000,
+        changes: Optional[CardChanges] = None,
+        job_undo_name: Optional[str] = None,
+    ):
+        self.undo_entry = undo_entry
+        self.chunk_size = chunk_size
+        self.changes = changes
+        self.job_undo_name = job_undo_name
+        self.pending: List[Card] = []
+        self.written = 0
+        self.unchanged = 0
+
+    def add(self, card: Card):
+        if self.changes is not None and not self.changes.changed(card):
+            self.unchanged += 1
+            return
+        self.pending.append(card)
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.job_undo_name is not None:
+            self.pending = unmodified_cards(self.pending)
+        if not self.pending:
+            return
+        if self.job_undo_name is not None:
+            self.undo_entry = job_undo_entry(self.job_undo_name)
+        with profile_phase(UPDATE_CARDS, len(self.pending)):
+            mw.col.update_cards(self.pending)
+            mw.col.merge_undo_entries(self.undo_entry)
+        self.written += len(self.pending)
+        self.pending = []
+
+    def finish(self):
+        self.flush()
+        if self.job_undo_name is None:
+            mw.col.merge_undo_entries(self.undo_entry)
+
+
+# cards checked and loaded at a time by the bulk custom data writers
+CUSTOM_DATA_CHUNK_SIZE = 5000
+
+
+def write_custom_data_bulk(
+    cids: Iterable[int], key: str, value: str, writer: CardWriter
+) -> int:
+    """Set `key` of the custom data of the cards `cids` to `value`.
+
+    The cards that already have the value are left out in SQL, and only the
+    others are loaded, a chunk at a time, and written by `writer`. The change
+    goes through `update_cards`, so it is undone with the operation. Returns
+    the number of cards marked.
+    """
+    cids = list(cids)
+    count = 0
+    for start in range(0, len(cids), CUSTOM_DATA_CHUNK_SIZE):
+        chunk = cids[start : start + CUSTOM_DATA_CHUNK_SIZE]
+        with profile_phase(SQL, len(chunk)):
+            unmarked = mw.col.db.list(
+                f"""
+                SELECT id
+                FROM cards
+                WHERE id IN {ids2str(chunk)}
+                AND {custom_data_field(key)} IS NOT ?
+            """,
+                value,
+            )
+        for cid in unmarked:
+            card = mw.col.get_card(cid)
+            write_custom_data(card, key, value)
+            writer.add(card)
+        count += len(unmarked)
+    return count
+
+
+def clear_custom_data_bulk(cids: Iterable[int], writer: CardWriter) -> int:
+    """Remove the custom data of the cards `cids`, written by `writer` in chunks.
+
+    Returns the number of cards cleared.
+    """
+    count = 0
+    for cid in cids:
+        card = mw.col.get_card(cid)
+        card.custom_data = ""
+        writer.add(card)
+        count += 1
+    return count
 
 
 def p_obey_easy_days(num_of_easy_days, easy_days_review_ratio):
@@ -230,6 +758,18 @@ def p_obey_specific_due_dates(num_of_specific_due_dates, easy_days_review_ratio)
     return 8 / (easy_days_review_ratio * num_of_specific_due_dates + 8)
 
 
+def worker_pool_context():
+    """The multiprocessing context of worker pools, or None to work in process.
+
+    Workers are forked from Anki's process, which runs Qt and other threads.
+    That is only safe on Linux: macOS has started processes with spawn by
+    default since Python 3.8 for this reason, and Windows cannot fork.
+    """
+    if sys.platform.startswith("linux"):
+        return multiprocessing.get_context("fork")
+    return None
+
+
 def col_set_modified():
     mw.col.db.execute(f"UPDATE col set mod = {int(time.time() * 1000)}")
 
@@ -263,3 +803,56 @@ def get_dr(deck_manager: DeckManager, did: int):
         if deck_manager.get(did).get("desiredRetention") is not None
         else deck_manager.config_dict_for_deck_id(did)["desiredRetention"]
     )
+
+
+class DeckConfig(NamedTuple):
+    preset_id: int
+    desired_retention: float
+    max_ivl: int
+    easy_days_percentages: List[float]
+    fsrs_params: List[float]
+    ignore_revlogs_before_date: str
+
+
+class DeckConfigIndex:
+    """Scheduling settings per deck, read from the backend once per deck.
+
+    Build one index per operation and look up each card's original deck,
+    instead of calling `get_dr` and `config_dict_for_deck_id` for every card.
+    """
+
+    def __init__(self, deck_manager: Optional[DeckManager] = None):
+        self.deck_manager = deck_manager if deck_manager else mw.col.decks
+        self.configs: Dict[int, DeckConfig] = {}
+
+    def get(self, did: int) -> DeckConfig:
+        config = self.configs.get(did)
+        if config is None:
+            config = self._load(did)
+            self.configs[did] = config
+        return config
+
+    def _load(self, did: int) -> DeckConfig:
+        with profile_phase(CONFIG, 1):
+            deck = self.deck_manager.get(did)
+            preset = self.deck_manager.config_dict_for_deck_id(did)
+        desired_retention = (
+            deck.get("desiredRetention") / 100
+            if deck.get("desiredRetention") is not None
+            else preset["desiredRetention"]
+        )
+        ignore_date = preset.get("ignoreRevlogsBeforeDate", "")
+        return DeckConfig(
+            preset_id=preset["id"],
+            desired_retention=desired_retention,
+            max_ivl=preset["rev"]["maxIvl"],
+            easy_days_percentages=preset.get("easyDaysPercentages", []),
+            fsrs_params=(
+                preset.get("fsrsParams6")
+                or preset.get("fsrsParams5")
+                or preset.get("fsrsWeights", [])
+            ),
+            ignore_revlogs_before_date=(
+                ignore_date if ignore_date != "1970-01-01" else ""
+            ),
+        )